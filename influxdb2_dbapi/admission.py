@@ -0,0 +1,97 @@
+"""
+Cap the queries sent to InfluxDB at a time.
+
+Queries over the cap wait in a queue, served by priority, then in the order
+they arrived. Queues are shared by the connections to the same hosts with
+the same cap, so that the connections of a SQLAlchemy engine's pool are
+capped together, while a connection with another cap can't change theirs.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import heapq
+import itertools
+import threading
+import time
+
+from .exceptions import OperationalError
+
+
+# priorities: queries with lower values are admitted first
+INTERACTIVE = 0
+BACKGROUND = 10
+
+# how often waiting queries check whether they were cancelled
+POLL_SECONDS = 0.05
+
+_queues = {}
+_lock = threading.Lock()
+
+
+class AdmissionQueue(object):
+    """Admits up to `limit` queries at a time."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.running = 0
+        # (priority, arrival, granted) of the queries waiting
+        self._waiting = []
+        self._arrivals = itertools.count()
+        self._lock = threading.Lock()
+
+    def acquire(self, priority=INTERACTIVE, timeout=None, cancelled=None):
+        """
+        Wait until the query can run and return the seconds waited, or `None`
+        if the `cancelled` event is set first; raise `OperationalError` after
+        `timeout` seconds. Every admitted query must be `release`d.
+        """
+        start = time.monotonic()
+        with self._lock:
+            if self.running < self.limit and not self._waiting:
+                self.running += 1
+                return 0.0
+            waiter = (priority, next(self._arrivals), threading.Event())
+            heapq.heappush(self._waiting, waiter)
+
+        granted = waiter[2]
+        while not granted.wait(POLL_SECONDS):
+            waited = time.monotonic() - start
+            expired = timeout is not None and waited >= timeout
+            if not expired and not (cancelled is not None and cancelled.is_set()):
+                continue
+            with self._lock:
+                if granted.is_set():
+                    # admitted meanwhile
+                    break
+                self._waiting.remove(waiter)
+                heapq.heapify(self._waiting)
+            if expired:
+                raise OperationalError(
+                    f'Query waited over {timeout}s for one of {self.limit} query slots')
+            return None
+        return time.monotonic() - start
+
+    def release(self):
+        """Let the next query in, now that one is done."""
+        with self._lock:
+            if self._waiting and self.running <= self.limit:
+                # hand the slot over
+                heapq.heappop(self._waiting)[2].set()
+            else:
+                self.running -= 1
+
+    @property
+    def waiting(self):
+        return len(self._waiting)
+
+
+def get_queue(key, limit):
+    """Return the queue of the connections to `key` admitting `limit` queries."""
+    with _lock:
+        queue = _queues.get((key, limit))
+        if queue is None:
+            queue = _queues[key, limit] = AdmissionQueue(limit)
+        return queue
@@ -0,0 +1,257 @@
+"""
+An on-disk cache for the results of rolling-window Flux queries.
+
+Queries like `from(bucket: "b") |> range(start: -24h) |> filter(...)` are
+cached by their text without the range. When one runs again only the time
+that is not cached yet is fetched, plus a short overlap for late points;
+points that fell out of the range are dropped, and the result is served
+from the cache.
+
+Only pipelines that are a `from()` and a `range()` followed by row-wise
+transformations can be spliced by time like that; others are not cached. That
+excludes `fill(usePrevious: true)`, which reads the rows before, and `map()`s
+that move points in time.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import csv
+import io
+import json
+import re
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from . import flux
+
+
+# stages that transform each row on its own, so results can be spliced
+CACHEABLE = {'filter', 'map', 'fill', 'keep', 'drop', 'rename', 'yield'}
+
+# a `_time` set by a record expression to anything but `r._time`
+TIME_ASSIGNMENT_RE = re.compile(
+    r'(?:[{,]|\bwith)\s*_time\s*:(?!\s*r\._time\s*[,}])')
+
+SCHEMA = [
+    # `start` is NULL for queries whose results can't be cached
+    'CREATE TABLE IF NOT EXISTS windows '
+    '(key TEXT PRIMARY KEY, start INTEGER, stop INTEGER)',
+    'CREATE TABLE IF NOT EXISTS points '
+    '(key TEXT, series TEXT, time INTEGER, cells TEXT)',
+    'CREATE INDEX IF NOT EXISTS points_by_key ON points (key, time)',
+]
+
+TIME_COLUMN = flux.FluxColumn('_time', 'dateTime:RFC3339', False, '')
+
+
+def is_cacheable(stage):
+    """Whether the pipeline `stage` transforms each row on its own."""
+    function = flux.get_function(stage)
+    if function == 'fill':
+        return flux.get_arguments(stage).get('usePrevious') != 'true'
+    if function == 'map':
+        return not TIME_ASSIGNMENT_RE.search(stage)
+    return function in CACHEABLE
+
+
+def get_window(query, now):
+    """
+    Return the `(key, start, stop)` window of a cacheable `query`: its text
+    without the range, and the range in nanoseconds resolved against `now`.
+    Return `None` if `query` can't be cached.
+    """
+    try:
+        stages = flux.split_pipeline(query)
+        if (
+            len(stages) < 2 or
+            flux.get_function(stages[0]) != 'from' or
+            flux.get_function(stages[1]) != 'range' or
+            not all(is_cacheable(stage) for stage in stages[2:])
+        ):
+            return None
+        arguments = flux.get_arguments(stages[1])
+    except Exception:
+        return None
+    start = flux.parse_time(arguments.get('start', ''), now)
+    stop = flux.parse_time(arguments.get('stop', 'now()'), now)
+    if start is None or stop is None or start >= stop:
+        return None
+    key = '\n  |> '.join([stages[0], 'range()'] + stages[2:])
+    return key, start, stop
+
+
+def read_points(rows):
+    """
+    Return the `(series, time, cells)` of the `(columns, cells)` rows of
+    `flux.iter_csv`, or `None` if they have no `_time` column.
+
+    `series` identifies the table of a row by its columns and group key, so
+    that points fetched separately end up in the same table.
+    """
+    points = []
+    times = []
+    columns = None
+    for row_columns, cells in rows:
+        if row_columns is not columns:
+            columns = row_columns
+            names = [column.name for column in columns]
+            if '_time' not in names:
+                return None
+            position = names.index('_time')
+            layout = [list(column) for column in columns]
+            group = [
+                i for i, column in enumerate(columns)
+                if column.group and column.name not in ('_start', '_stop')
+            ]
+        series = json.dumps([layout, [cells[i] for i in group]])
+        points.append((series, json.dumps(cells)))
+        times.append(cells[position])
+    times = flux.to_array(times, TIME_COLUMN).astype(np.int64).tolist()
+    return [(series, t, cells) for (series, cells), t in zip(points, times)]
+
+
+def to_csv(rows, start, stop):
+    """
+    Return the annotated CSV of the cached `(series, cells)` rows, with the
+    `_start` and `_stop` of the window being served.
+    """
+    out = io.StringIO()
+    writer = csv.writer(out, lineterminator='\r\n')
+    bounds = {'_start': flux.format_time(start), '_stop': flux.format_time(stop)}
+    layout = series = None
+    table = -1
+    for row_series, row_cells in rows:
+        if row_series != series:
+            series = row_series
+            table += 1
+            row_layout = json.loads(series)[0]
+            if row_layout != layout:
+                layout = row_layout
+                if table:
+                    writer.writerow([])
+                names, datatypes, groups, defaults = zip(*layout)
+                writer.writerow(['#datatype'] + list(datatypes))
+                writer.writerow(
+                    ['#group'] + ['true' if group else 'false' for group in groups])
+                writer.writerow(['#default'] + list(defaults))
+                writer.writerow([''] + list(names))
+                replaced = [
+                    (i, bounds.get(name)) for i, name in enumerate(names)
+                    if name in bounds or name == 'table'
+                ]
+        cells = json.loads(row_cells)
+        for i, value in replaced:
+            cells[i] = str(table) if value is None else value
+        writer.writerow([''] + cells)
+    return out.getvalue().encode('utf-8')
+
+
+class CachedResponse(object):
+    """Results served from the cache, read like a `urllib3.HTTPResponse`."""
+
+    def __init__(self, data):
+        self.data = data
+        self.closed = False
+
+    def __iter__(self):
+        return iter(self.data.splitlines(True))
+
+    def stream(self, amt=flux.CHUNK_SIZE):
+        for start in range(0, len(self.data), amt):
+            if self.closed:
+                return
+            yield self.data[start:start + amt]
+
+    def close(self):
+        self.closed = True
+
+
+class FluxCache(object):
+    """
+    Cache of Flux results in the SQLite database at `path`, that may be
+    shared by threads.
+
+    Queries are keyed within `namespace`, e.g. the server and organization;
+    `overlap` is how many seconds before the end of the cached window are
+    fetched again, for points that arrive late.
+    """
+
+    def __init__(self, path, namespace='', overlap=60):
+        self.path = path
+        self.namespace = namespace
+        self.overlap = int(overlap * 10 ** 9)
+        self.clock = time.time_ns
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.db:
+            for statement in SCHEMA:
+                self.db.execute(statement)
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def open(self, query, fetch):
+        """
+        Return a response to `query` served from the cache, after fetching
+        the time it misses with `fetch(query)`, that must yield the rows of
+        `flux.iter_csv`; return `None` if `query` can't be cached.
+        """
+        window = get_window(query, self.clock())
+        if window is None:
+            return None
+        key, start, stop = window
+        key = f'{self.namespace}\n{key}'
+        with self.lock:
+            cached = self.db.execute(
+                'SELECT start, stop FROM windows WHERE key = ?', (key,)).fetchone()
+        if cached is not None and cached[0] is None:
+            return None
+
+        reset = cached is None or cached[1] <= start or cached[0] >= stop
+        if reset:
+            spans = [(start, stop)]
+        else:
+            spans = []
+            if start < cached[0]:
+                spans.append((start, cached[0]))
+            if stop > cached[1] - self.overlap:
+                spans.append((max(start, cached[1] - self.overlap), stop))
+
+        fetched = []
+        for span in spans:
+            points = read_points(fetch(flux.replace_range(query, *span)))
+            if points is None:
+                with self.lock, self.db:
+                    self.db.execute(
+                        'INSERT OR REPLACE INTO windows VALUES (?, NULL, NULL)',
+                        (key,))
+                return None
+            fetched.append((span, points))
+
+        with self.lock, self.db:
+            if reset:
+                self.db.execute('DELETE FROM points WHERE key = ?', (key,))
+            for (span_start, span_stop), points in fetched:
+                self.db.execute(
+                    'DELETE FROM points WHERE key = ? AND time >= ? AND time < ?',
+                    (key, span_start, span_stop))
+                self.db.executemany(
+                    'INSERT INTO points VALUES (?, ?, ?, ?)',
+                    [(key, series, t, cells) for series, t, cells in points])
+            self.db.execute(
+                'DELETE FROM points WHERE key = ? AND (time < ? OR time >= ?)',
+                (key, start, stop))
+            self.db.execute(
+                'INSERT OR REPLACE INTO windows VALUES (?, ?, ?)',
+                (key, start, stop))
+            rows = self.db.execute(
+                'SELECT series, cells FROM points WHERE key = ? '
+                'ORDER BY series, time', (key,)).fetchall()
+        return CachedResponse(to_csv(rows, start, stop))
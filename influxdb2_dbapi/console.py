@@ -1,11 +1,23 @@
 from __future__ import unicode_literals
 
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import csv
+import itertools
+import json
 import os
 import sys
+import threading
+import time
 
-from prompt_toolkit import prompt, AbortAction
+from prompt_toolkit import prompt
 from prompt_toolkit.history import FileHistory
-from prompt_toolkit.contrib.completers import WordCompleter
+try:
+    from prompt_toolkit import AbortAction
+    from prompt_toolkit.contrib.completers import WordCompleter
+except ImportError:  # prompt_toolkit >= 2
+    AbortAction = None
+    from prompt_toolkit.completion import WordCompleter
 from pygments.lexers import SqlLexer
 from pygments.style import Style
 from pygments.token import Token
@@ -13,11 +25,19 @@ from pygments.styles.default import DefaultStyle
 from six.moves.urllib import parse
 from tabulate import tabulate
 
+from influxdb2_dbapi import admission
 from influxdb2_dbapi.db import connect
 
 
+# rows rendered per table while streaming, and rows shown before the query
+# is cancelled; the latter can be changed with `\maxrows N`
+PAGE_SIZE = 50
+MAX_ROWS = 1000
+
+
 keywords = [
     'EXPLAIN PLAN FOR',
+    'EXPLAIN ANALYZE',
     'WITH',
     'SELECT',
     'ALL',
@@ -105,27 +125,46 @@ class DocumentStyle(Style):
 
 def get_connection_kwargs(url):
     parts = parse.urlparse(url)
-    if ':' in parts.netloc:
+    if ',' in parts.netloc:
+        # several nodes, each with its own port or the default one
+        host, port = parts.netloc, 8086
+    elif ':' in parts.netloc:
         host, port = parts.netloc.split(':', 1)
         port = int(port)
     else:
         host = parts.netloc
-        port = 8082
+        port = 8086
 
-    return {
+    kwargs = {
         'host': host,
         'port': port,
         'path': parts.path,
         'scheme': parts.scheme,
     }
+    # org and token are passed in the query string, as in SQLAlchemy URLs
+    query = dict(parse.parse_qsl(parts.query))
+    for key in ('org', 'token', 'record', 'replay'):
+        if key in query:
+            kwargs[key] = query[key]
+    if 'replay_speed' in query:
+        kwargs['replay_speed'] = float(query['replay_speed'])
+    return kwargs
 
 
 def get_tables(connection):
+    """Return bucket, measurement and field names from the Flux schema."""
     cursor = connection.cursor()
-    return [
-        row.TABLE_NAME for row in
-        cursor.execute('SELECT TABLE_NAME FROM INFORMATION_SCHEMA.TABLES')
-    ]
+    buckets = [
+        row.name for row in cursor.execute('buckets()', priority=admission.BACKGROUND)]
+    words = list(buckets)
+    for bucket in buckets:
+        for function in ('measurements', 'fieldKeys'):
+            cursor.execute(f"""
+                import "influxdata/influxdb/schema"
+                schema.{function}(bucket: "{bucket}")
+            """, priority=admission.BACKGROUND)
+            words.extend(row.value for row in cursor)
+    return sorted(set(words))
 
 
 def get_autocomplete(connection):
@@ -135,47 +174,209 @@ def get_autocomplete(connection):
         numeric_functions +
         string_functions +
         time_functions +
-        other_functions +
-        get_tables(connection)
+        other_functions
     )
 
 
-def main():
-    history = FileHistory(os.path.expanduser('~/.influxdb2_dbapi_history'))
+def load_autocomplete(connection, completer):
+    """
+    Add the schema names to `completer` from a background thread, so that the
+    prompt does not wait for them.
+    """
+    def load():
+        try:
+            tables = get_tables(connection)
+        except Exception:
+            return  # autocomplete without schema names
+        completer.words = list(completer.words) + tables
+
+    thread = threading.Thread(target=load, daemon=True)
+    thread.start()
+    return thread
+
+
+def print_results(cursor, max_rows=MAX_ROWS, page_size=PAGE_SIZE, out=None):
+    """
+    Print the rows of an executed cursor a page at a time, as they arrive.
+
+    At most `max_rows` are printed; the query is cancelled past that. Return
+    the number of rows printed.
+    """
+    out = out or sys.stdout
+    headers = [t[0] for t in cursor.description or []]
+    n = 0
+    while n < max_rows:
+        page = list(itertools.islice(cursor, min(page_size, max_rows - n)))
+        if not page:
+            break
+        table = tabulate(page, headers=headers if n == 0 else ())
+        print(table, file=out, flush=True)
+        n += len(page)
+    else:
+        if cursor.fetchone() is not None:
+            cursor.cancel()
+            print(f'(stopped after {max_rows} rows)', file=out)
+    return n
+
+
+def format_timing(ttfb, total, rows):
+    rate = rows / total if total else 0
+    return (
+        f'Time: {ttfb:.3f}s to first row, {total:.3f}s total, '
+        f'{rows} rows, {rate:.0f} rows/s'
+    )
+
+
+def write_rows(cursor, f, format):
+    """
+    Write the rows of an executed cursor to `f` as they are decoded, as CSV
+    with a header or as one JSON object per line. Return the number of rows.
+    """
+    headers = [t[0] for t in cursor.description or []]
+    n = 0
+    if format == 'csv':
+        writer = csv.writer(f)
+        writer.writerow(headers)
+        for row in cursor:
+            writer.writerow(row)
+            n += 1
+    else:
+        for row in cursor:
+            f.write(json.dumps(dict(zip(headers, row)), default=str))
+            f.write('\n')
+            n += 1
+    return n
 
+
+def export_query(connection, path, format, out_dir):
+    """
+    Run the query in the file at `path` and stream its rows to a file of the
+    same name in `out_dir`. Return the number of rows and the seconds taken.
+    """
+    with open(path) as f:
+        query = f.read().strip().rstrip(';')
+    name = os.path.splitext(os.path.basename(path))[0]
+    start = time.perf_counter()
+    # server-side, so that rows of SQL over Flux are converted as written
+    # rather than all at once
+    cursor = connection.cursor(server_side=True)
     try:
-        url = sys.argv[1]
-    except IndexError:
-        url = 'http://localhost:8086/'
-    kwargs = get_connection_kwargs(url)
-    connection = connect(**kwargs)
+        cursor.execute(query)
+        with open(os.path.join(out_dir, f'{name}.{format}'), 'w', newline='') as f:
+            rows = write_rows(cursor, f, format)
+    finally:
+        cursor.close()
+    return rows, time.perf_counter() - start
+
+
+def export(connection, paths, format='csv', out_dir='.', parallel=1, out=None):
+    """
+    Export the queries in `paths`, running up to `parallel` at a time, and
+    report rows/sec for each. Return the number of queries that failed.
+    """
+    out = out or sys.stdout
+    os.makedirs(out_dir, exist_ok=True)
+
+    def run(path):
+        try:
+            rows, seconds = export_query(connection, path, format, out_dir)
+        except Exception as e:
+            print(f'{path}: {e}', file=out, flush=True)
+            return False
+        rate = rows / seconds if seconds else 0
+        print(
+            f'{path}: {rows} rows in {seconds:.3f}s ({rate:.0f} rows/s)',
+            file=out, flush=True)
+        return True
+
+    with ThreadPoolExecutor(max_workers=parallel) as executor:
+        return list(executor.map(run, paths)).count(False)
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Query influxdb2 interactively, or export query results.')
+    parser.add_argument(
+        'url', nargs='?', default='http://localhost:8086/',
+        help='server URL, e.g. http://localhost:8086/?org=...&token=...')
+    parser.add_argument(
+        '-f', '--file', action='append', dest='files', metavar='FILE',
+        help='export the results of the query in FILE and exit; repeatable')
+    parser.add_argument(
+        '--format', choices=['csv', 'jsonl'], default='csv',
+        help='format of exported files')
+    parser.add_argument(
+        '--out', default='.', metavar='DIR',
+        help='directory where exported files are written')
+    parser.add_argument(
+        '--parallel', type=int, default=1, metavar='N',
+        help='number of queries exported concurrently')
+    parser.add_argument(
+        '--decode-processes', type=int, default=0, metavar='N',
+        help='number of processes decoding large responses')
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    kwargs = get_connection_kwargs(args.url)
+    connection = connect(decode_processes=args.decode_processes, **kwargs)
+
+    if args.files:
+        failed = export(
+            connection, args.files, args.format, args.out, args.parallel)
+        return 1 if failed else 0
+
+    history = FileHistory(os.path.expanduser('~/.influxdb2_dbapi_history'))
     cursor = connection.cursor()
 
     words = get_autocomplete(connection)
     sql_completer = WordCompleter(words, ignore_case=True)
+    load_autocomplete(connection, sql_completer)
+
+    prompt_kwargs = {}
+    if AbortAction is not None:
+        prompt_kwargs['on_abort'] = AbortAction.RETRY
+    timing = False
+    max_rows = MAX_ROWS
 
     while True:
         try:
             query = prompt(
                 '> ', lexer=SqlLexer, completer=sql_completer,
-                style=DocumentStyle, history=history,
-                on_abort=AbortAction.RETRY)
+                style=DocumentStyle, history=history, **prompt_kwargs)
         except EOFError:
             break  # Control-D pressed.
 
+        # meta commands
+        command = query.strip().split()
+        if command and command[0] == '\\timing':
+            timing = command[1:] != ['off'] if command[1:] else not timing
+            print(f'Timing is {"on" if timing else "off"}.')
+            continue
+        if command and command[0] == '\\maxrows':
+            try:
+                max_rows = int(command[1])
+            except (IndexError, ValueError):
+                print('Usage: \\maxrows N')
+            continue
+
         # run query
         if query.strip():
+            start = time.perf_counter()
             try:
-                result = cursor.execute(query.rstrip(';'))
+                cursor.execute(query.rstrip(';'))
+                ttfb = time.perf_counter() - start
+                rows = print_results(cursor, max_rows)
             except Exception as e:
                 print(e)
                 continue
 
-            headers = [t[0] for t in cursor.description or []]
-            print(tabulate(result, headers=headers))
+            if timing:
+                print(format_timing(ttfb, time.perf_counter() - start, rows))
 
     print('GoodBye!')
 
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
@@ -3,19 +3,38 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import datetime
 import logging
 from collections import namedtuple
 from enum import Enum
+import functools
 import itertools
 import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+import weakref
+from concurrent.futures import FIRST_EXCEPTION, ProcessPoolExecutor, ThreadPoolExecutor, wait
 from six import string_types
 from six.moves.urllib import parse
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, types
+import numpy as np
 import pandas as pd
 import requests
 from sqlalchemy import text
+from sqlalchemy.pool import StaticPool
 
-from .exceptions import Error, NotSupportedError, ProgrammingError
+from .exceptions import (
+    Error, NotSupportedError, OperationalError, ProgrammingError,
+)
+from . import admission, flux, hosts, metrics, optimizer, parallel, singleflight, vectorized
+from .cache import FluxCache
+from .prefetch import Prefetcher
+from .replay import Recorder, Replayer
+from .flux import count_query
 
 
 from requests.auth import HTTPBasicAuth
@@ -25,6 +44,11 @@ from influxdb_client import InfluxDBClient
 
 from zeep import ns
 
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
 logger = logging.getLogger(__name__)
 
 
@@ -36,14 +60,84 @@ class Type(Enum):
 
 def connect(host='localhost', port=8086, scheme='http',
             trusted_connection=False, token=None,
-            path='',username='',password=',', org=None):
+            path='',username='',password=',', org=None, timeout=None, cache=None,
+            max_points_per_series=None, single_flight=False, time_format='datetime',
+            rowcount_query=False, decode_processes=0, memory_budget=None,
+            max_concurrent_queries=None, queue_timeout=None, optimize_flux=False,
+            record=None, replay=None, replay_speed=None, prefetch=0):
     """
     Constructor for creating a connection to the database.
 
         >>> conn = InfluxDBClient(url=f"http://{host}:{port}", token=token, org=org)
 
+    `host` can also list several nodes, as a list or a comma-separated
+    string of `host[:port]`: queries then go to the healthy node with the
+    fewest in flight, and fail over to the others.
+
+    `timeout` is the default deadline, in seconds, for every query executed
+    on the connection; it can be overridden per `Cursor.execute`.
+
+    `cache` is the path of a SQLite file where the results of rolling-window
+    Flux queries are cached, so that only new points are fetched when they
+    run again.
+
+    `max_points_per_series` caps the points returned per series by plain Flux
+    queries over a literal `range()` that don't aggregate, by inserting an
+    `aggregateWindow()`; it can be overridden per `Cursor.execute`. Flux
+    wrapped in SQL is not downsampled, as the SQL would then count or average
+    the windows instead of the points.
+
+    With `single_flight`, a Flux query sent while the same query is already
+    in flight for the same org, from any connection of the process, shares
+    its HTTP request instead of sending another. Connections that don't set
+    it neither share their queries nor join those of others.
+
+    `time_format` is how times are returned: as timezone-aware `datetime`s
+    (the default), as `'epoch_ns'` integers or as NumPy `'datetime64'`
+    values; it can be overridden per `Cursor.execute`.
+
+    With `rowcount_query`, `Cursor.rowcount` counts the rows with a query
+    rewritten to `count()` them on the server, or with `SELECT COUNT(*)` for
+    SQL run locally, instead of fetching them all; it can be overridden per
+    `Cursor.execute`.
+
+    With `decode_processes`, large Flux responses are cut into segments that
+    are decoded by a pool of that many processes, for exports that would
+    otherwise be bound by a single core.
+
+    `memory_budget` caps, in bytes, the Flux results that SQL wrapping Flux
+    queries holds in memory, as NumPy columns or in an in-memory SQLite
+    database; past it, the results move to a SQLite database in a temporary
+    file and the rest is loaded there.
+
+    `max_concurrent_queries` caps the queries in flight to the hosts, across
+    the connections to them in the process with the same cap; the others
+    wait in a queue, by `Cursor.execute` priority then in order, for up to
+    `queue_timeout` seconds.
+
+    With `optimize_flux`, Flux pipelines are rewritten so that storage can
+    push more of them down, e.g. moving `filter()`s written after `map()`
+    next to `range()`; it can be overridden per `Cursor.execute`.
+
+    `record` is a directory where the raw responses of the Flux queries
+    sent are saved, with the query and timings. A connection with `replay`
+    set to such a directory serves those responses instead of sending
+    queries, as fast as they are read or, with `replay_speed`, at that
+    multiple of the recorded pace.
+
+    With `prefetch`, a background thread reads and decodes the rows of each
+    query up to that many chunks ahead of the application; it can be
+    overridden per `Cursor.execute`.
     """
-    return Connection(host, port, scheme, path='', trusted_connection=trusted_connection, token=token, org=org)
+    return Connection(host, port, scheme, path='', trusted_connection=trusted_connection, token=token, org=org,
+                      timeout=timeout, cache=cache, max_points_per_series=max_points_per_series,
+                      single_flight=single_flight, time_format=time_format,
+                      rowcount_query=rowcount_query, decode_processes=decode_processes,
+                      memory_budget=memory_budget,
+                      max_concurrent_queries=max_concurrent_queries,
+                      queue_timeout=queue_timeout, optimize_flux=optimize_flux,
+                      record=record, replay=replay, replay_speed=replay_speed,
+                      prefetch=prefetch)
 
 
 def check_closed(f):
@@ -57,6 +151,14 @@ def check_closed(f):
     return g
 
 
+def check_time_format(time_format):
+    if time_format not in flux.TIME_FORMATS:
+        raise ProgrammingError(
+            f'Unknown time format {time_format!r}, expected one of '
+            f'{", ".join(flux.TIME_FORMATS)}')
+    return time_format
+
+
 def check_result(f):
     """Decorator that checks if the cursor has results from `execute`."""
 
@@ -70,6 +172,304 @@ def check_result(f):
 
 MAX_COLS = 254  # python 3.6 namedtuple constraint
 
+EXPLAIN_RE = re.compile(
+    r'^\s*EXPLAIN\s+(?:PLAN\s+FOR\s+|(ANALYZE)\s+)?(.*)$', re.I | re.S)
+
+# one row per stage of an `EXPLAIN`: where it runs, what it runs, how many
+# rows it produces (estimated, or actual with `ANALYZE`) and how long it took
+PlanRow = namedtuple('PlanRow', ['stage', 'engine', 'query', 'rows', 'seconds'])
+
+PLAN_DESCRIPTION = [
+    (name, t, None, None, None, None, True)
+    for name, t in zip(PlanRow._fields, [
+        Type.STRING, Type.STRING, Type.STRING, Type.NUMBER, Type.NUMBER])
+]
+
+# SQLAlchemy types of the `Model` columns, by Flux datatype; times keep the
+# text format SQLAlchemy gives them so that they compare with time literals
+MODEL_TYPES = {
+    'double': types.Float,
+    'long': types.BigInteger,
+    # SQLite integers are signed 64-bit
+    'unsignedLong': types.Float,
+    'duration': types.BigInteger,
+    'boolean': types.Boolean,
+    'dateTime': types.DateTime,
+    'string': types.Text,
+    'base64Binary': types.LargeBinary,
+}
+
+# the `Model` database lives in memory for the duration of a single query
+SQLITE_PRAGMAS = [
+    'journal_mode = OFF',
+    'synchronous = OFF',
+    'locking_mode = EXCLUSIVE',
+    'temp_store = MEMORY',
+    'cache_size = -65536',
+]
+
+# rows of Flux results loaded into the `Model` database at a time
+BATCH_ROWS = 100000
+
+# clauses of the outer SQL whose columns are worth an index
+INDEXED_CLAUSES = {'WHERE', 'GROUP BY', 'ORDER BY', 'ON'}
+
+# how SQLAlchemy stores `DateTime`s in SQLite, as text that sorts like times
+SQLITE_TIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+SQLITE_TIME_RE = re.compile(r'\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}\.\d{6}$')
+
+# what may stand between a column and a literal it is compared with
+COMPARED_TOKENS = {
+    '=', '==', '!=', '<>', '<', '<=', '>', '>=', '(', ',', '-', 'AND', 'BETWEEN', 'IN', 'NOT',
+}
+
+
+def get_model_types(datatypes):
+    """Return the SQLAlchemy types of columns with the given Flux `datatypes`."""
+    model_types = {}
+    for name, datatype in datatypes.items():
+        model_type = MODEL_TYPES.get(datatype.split(':')[0])
+        if model_type is not None:
+            model_types[name] = model_type
+    return model_types
+
+
+def get_compared_column(tokens, i):
+    """
+    Return the lowercase name of the column that the literal `tokens[i]` is
+    compared with, directly, with `BETWEEN` or `IN`, or `None`.
+    """
+    def name(token):
+        if token.kind == 'quoted':
+            return token.value[1:-1].replace('""', '"').lower()
+        if token.kind == 'name' and token.value.upper() not in vectorized.KEYWORDS:
+            return token.value.lower()
+        return None
+
+    # 'literal' < column
+    if i + 2 < len(tokens) and tokens[i + 1].value in vectorized.COMPARISONS:
+        return name(tokens[i + 2])
+    # column < 'literal', column BETWEEN 'literal' AND 'literal', column IN (...)
+    for token in reversed(tokens[:i]):
+        column = name(token)
+        if column is not None:
+            return column
+        if not (token.kind in ('string', 'number') or token.value.upper() in COMPARED_TOKENS):
+            return None
+    return None
+
+
+def to_sqlite_times(sql, time_columns):
+    """
+    Rewrite the time literals of `sql` compared with `time_columns` in the
+    format SQLite holds times in, in UTC, so that they compare as times
+    rather than text, like the vectorized executor does. Literals compared
+    with other columns, e.g. string tags holding dates, are left alone.
+    """
+    if not time_columns:
+        return sql
+    # unknown characters, e.g. arithmetic, are skipped
+    tokens = [
+        vectorized.Token(match.lastgroup, match.group(), match.start(), match.end())
+        for match in vectorized.TOKEN_RE.finditer(sql)
+    ]
+    parts, position = [], 0
+    for i, token in enumerate(tokens):
+        if token.kind != 'string' or get_compared_column(tokens, i) not in time_columns:
+            continue
+        time = vectorized.parse_time(token.value[1:-1].replace("''", "'"))
+        if time is not None:
+            parts.extend([sql[position:token.start], f"'{time.strftime(SQLITE_TIME_FORMAT)}'"])
+            position = token.end
+    parts.append(sql[position:])
+    return ''.join(parts)
+
+
+def from_sqlite_time(value, time_format):
+    """Convert a time held in SQLite into `time_format`, like Flux times."""
+    if time_format == 'epoch_ns':
+        return int(np.datetime64(value.replace(' ', 'T'), 'ns').astype('int64'))
+    if time_format == 'datetime64':
+        return np.datetime64(value.replace(' ', 'T'), 'ns')
+    return datetime.datetime.strptime(value, SQLITE_TIME_FORMAT).replace(
+        tzinfo=datetime.timezone.utc)
+
+
+def get_indexed_columns(sql, names):
+    """
+    Return the columns among `names` that `sql` filters, groups, sorts or
+    joins on.
+    """
+    lookup = {name.lower(): name for name in names}
+    columns = []
+    clause = None
+    for token in sqlparse.parse(sql)[0].flatten():
+        if token.is_whitespace:
+            continue
+        if token.is_keyword:
+            keyword = ' '.join(token.normalized.upper().split())
+            if keyword in INDEXED_CLAUSES:
+                clause = keyword
+                continue
+            if keyword in ('SELECT', 'FROM', 'HAVING', 'LIMIT', 'UNION') or 'JOIN' in keyword:
+                clause = None
+                continue
+        if clause is None or token.ttype in sqlparse.tokens.Literal.String.Single:
+            continue
+        name = token.value.strip('"`[]').lower()
+        if name in lookup and lookup[name] not in columns:
+            columns.append(lookup[name])
+    return columns
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cursor.execute(f'PRAGMA {pragma}')
+    cursor.close()
+
+
+def get_peak_rss():
+    """Return the peak resident set size of the process in bytes, if known."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def get_columns_bytes(columns):
+    """Return the memory used by a dict of NumPy columns, objects included."""
+    return int(pd.DataFrame(columns).memory_usage(deep=True).sum()) if columns else 0
+
+
+def merge_batches(batches, datatypes):
+    """
+    Concatenate the `(columns, datatypes)` batches of `Cursor._read_batches`
+    into one dict of columns, filling `datatypes`.
+    """
+    blocks = [
+        ([flux.FluxColumn(name, batch_types.get(name), False, '') for name in columns],
+         list(columns.values()))
+        for columns, batch_types in batches if columns
+    ]
+    return flux.merge_blocks(blocks, datatypes)
+
+
+class ModelDatabase(object):
+    """
+    The SQLite database that SQL wrapping Flux queries runs on, with a table
+    per subquery, loaded in batches.
+
+    The database lives in memory until the data loaded grows over `budget`
+    bytes, if set; it is then copied to a temporary file, where the rest of
+    the data is loaded.
+    """
+
+    def __init__(self, budget=None):
+        self.budget = budget
+        self.loaded = 0
+        self.path = None
+        self.names = {}
+        # the lowercase names of the columns holding times, in any table
+        self.time_columns = set()
+        self._lock = threading.Lock()
+        self.engine = self._create_engine('sqlite:///:memory:')
+
+    @staticmethod
+    def _create_engine(url):
+        # one connection, so that the results can be fetched, and the cursor
+        # closed, from another thread than the one that executed the query
+        engine = create_engine(
+            url, poolclass=StaticPool,
+            connect_args={'check_same_thread': False})
+        event.listen(engine, 'connect', set_sqlite_pragmas)
+        return engine
+
+    @property
+    def spill_bytes(self):
+        """The size of the temporary file, or 0 while in memory."""
+        return os.path.getsize(self.path) if self.path else 0
+
+    def load(self, table, columns, datatypes):
+        """
+        Append Flux `columns` with the given `datatypes` to `table`, creating
+        it on first use, a batch of `BATCH_ROWS` rows at a time.
+        """
+        size = len(next(iter(columns.values()))) if columns else 0
+        for start in range(0, max(size, 1), BATCH_ROWS):
+            self._append(table, {
+                name: array[start:start + BATCH_ROWS]
+                for name, array in columns.items()}, datatypes)
+
+    def _append(self, table, columns, datatypes):
+        df = pd.DataFrame(columns)
+        for name, datatype in datatypes.items():
+            if datatype == 'unsignedLong' and name in df:
+                df[name] = df[name].astype('float64')
+        model_types = get_model_types(datatypes)
+        with self._lock:
+            self.time_columns.update(
+                name.lower() for name, datatype in datatypes.items()
+                if datatype.startswith('dateTime'))
+            with self.engine.begin() as connection:
+                names = self.names.get(table)
+                if names is None:
+                    connection.execute(text(f'drop table if exists "{table}"'))
+                    df.head(0).to_sql(
+                        table, connection, index=False, dtype=model_types)
+                    names = self.names[table] = list(df.columns)
+                for name in df.columns:
+                    if name not in names:
+                        # a column that the tables of earlier batches lacked
+                        model_type = model_types.get(name, types.Text)
+                        compiled = model_type().compile(dialect=self.engine.dialect)
+                        quoted = name.replace('"', '""')
+                        connection.execute(text(
+                            f'ALTER TABLE "{table}" ADD COLUMN "{quoted}" {compiled}'))
+                        names.append(name)
+                if len(df):
+                    df.to_sql(table, connection, index=False, if_exists='append')
+            self.loaded += int(df.memory_usage(deep=True).sum())
+            if self.budget is not None and self.path is None and self.loaded > self.budget:
+                self._spill()
+
+    def _spill(self):
+        """Move the database to a temporary file."""
+        fd, self.path = tempfile.mkstemp(prefix='influxdb2_dbapi_', suffix='.db')
+        os.close(fd)
+        engine = self._create_engine(f'sqlite:///{self.path}')
+        source, target = self.engine.raw_connection(), engine.raw_connection()
+        try:
+            source.connection.backup(target.connection)
+        finally:
+            source.close()
+            target.close()
+        self.engine.dispose()
+        self.engine = engine
+        logger.info(
+            'Spilled %d bytes of Flux results over the budget of %d to %s',
+            self.loaded, self.budget, self.path)
+
+    def create_indexes(self, sql):
+        """Index the columns that `sql` filters, groups, sorts or joins on."""
+        with self._lock, self.engine.begin() as connection:
+            for table, names in self.names.items():
+                for i, column in enumerate(get_indexed_columns(sql, names)):
+                    quoted = column.replace('"', '""')
+                    connection.execute(text(
+                        f'CREATE INDEX "ix_{table}_{i}" ON "{table}" ("{quoted}")'))
+
+    def close(self):
+        """Dispose of the database, removing its file if it spilled."""
+        self.engine.dispose()
+        if self.path is not None:
+            try:
+                os.remove(self.path)
+            except OSError:
+                logger.warning('Unable to remove %s', self.path, exc_info=True)
+            self.path = None
+
 
 def get_description_from_row(row, res):
     """
@@ -156,6 +556,16 @@ def get_type(value):
     raise Error(f'Value of unknown type: {value}')
 
 
+def get_type_from_array(array, time_format='datetime'):
+    """Infer type from the dtype of a NumPy array."""
+    if array.dtype.kind == 'b':
+        return Type.BOOLEAN
+    elif array.dtype.kind in 'fiu' or (
+            array.dtype.kind == 'M' and time_format == 'epoch_ns'):
+        return Type.NUMBER
+    return Type.STRING
+
+
 def get_type_from_schema(t):
     """Infer type from value.
     http://books.xmlschemata.org/relaxng/relax-CHP-19.html
@@ -249,32 +659,90 @@ class Connection(object):
             path='',
             trusted_connection=False,
             token=None,
-            org=None
+            org=None,
+            timeout=None,
+            cache=None,
+            max_points_per_series=None,
+            single_flight=False,
+            time_format='datetime',
+            rowcount_query=False,
+            decode_processes=0,
+            memory_budget=None,
+            max_concurrent_queries=None,
+            queue_timeout=None,
+            optimize_flux=False,
+            record=None,
+            replay=None,
+            replay_speed=None,
+            prefetch=0
     ):
-        netloc = f'{host}:{port}'
-        self.url = parse.urlunparse(
-            (scheme, netloc, "", None, None, None))
+        urls = [
+            parse.urlunparse((scheme, f'{name}:{node_port}', "", None, None, None))
+            for name, node_port in hosts.parse_hosts(host, port)
+        ]
+        self.url = ','.join(urls)
         self.closed = False
-        self.cursors = []
+        # cursors are closed with the connection, but not kept alive by it
+        self.cursors = weakref.WeakSet()
+        self._lock = threading.Lock()
         self.org = org
+        self.timeout = timeout
+        self.max_points_per_series = max_points_per_series
+        self.single_flight = single_flight
+        self.time_format = check_time_format(time_format)
+        self.rowcount_query = rowcount_query
+        self.decode_processes = decode_processes
+        self._decode_pool = None
+        self.memory_budget = memory_budget
+        self.admission = admission.get_queue(
+            (self.url, org), max_concurrent_queries) if max_concurrent_queries else None
+        self.queue_timeout = queue_timeout
+        self.optimize_flux = optimize_flux
+        self.recorder = Recorder(record) if record else None
+        self.replayer = Replayer(replay, replay_speed) if replay else None
+        self.prefetch = prefetch
+        self.cache = FluxCache(cache, f'{self.url} {org}') if cache else None
         auth = None
         # if trusted_connection and username:
         #     auth = HttpNtlmAuth(username, password)
         # elif username:
         #     auth = HTTPBasicAuth(username, password)
 
-        self.influxDb2 = InfluxDBClient(url=self.url, token=token, org=org, )
+        self.hosts = hosts.HostPool([
+            hosts.Node(url, InfluxDBClient(url=url, token=token, org=org))
+            for url in urls
+        ])
+        self.influxDb2 = self.hosts.nodes[0].client
+        metrics.CONNECTIONS_OPEN.inc()
+        self._finalizer = weakref.finalize(self, metrics.CONNECTIONS_OPEN.dec)
 
 
     @check_closed
     def close(self):
-        """Close the connection now."""
-        self.closed = True
-        for cursor in self.cursors:
+        """Close the connection now, cancelling any query still in flight."""
+        with self._lock:
+            if self.closed:
+                raise Error('Connection already closed')
+            self.closed = True
+            cursors = list(self.cursors)
+        for cursor in cursors:
             try:
                 cursor.close()
             except Error:
                 pass  # already closed
+        if self.cache is not None:
+            self.cache.close()
+        if self._decode_pool is not None:
+            self._decode_pool.shutdown(wait=False)
+        self.hosts.close()
+        self._finalizer()
+
+    def decode_pool(self):
+        """Return the pool of processes decoding responses, started on first use."""
+        with self._lock:
+            if self._decode_pool is None:
+                self._decode_pool = ProcessPoolExecutor(self.decode_processes)
+            return self._decode_pool
 
     @check_closed
     def commit(self):
@@ -286,10 +754,16 @@ class Connection(object):
         pass
 
     @check_closed
-    def cursor(self):
-        """Return a new Cursor Object using the connection."""
-        cursor = Cursor(self)
-        self.cursors.append(cursor)
+    def cursor(self, server_side=False):
+        """
+        Return a new Cursor Object using the connection; a `server_side` one
+        streams results without ever holding them all.
+        """
+        cursor = Cursor(self, server_side)
+        with self._lock:
+            if self.closed:
+                raise Error('Connection already closed')
+            self.cursors.add(cursor)
 
         return cursor
 
@@ -308,10 +782,14 @@ class Connection(object):
 class Cursor(object):
     """Connection cursor."""
 
-    def __init__(self, connection):
+    def __init__(self, connection, server_side=False):
         self.url = connection.url
         self.connection = connection
 
+        # server-side cursors hold no more than a batch of converted rows,
+        # and don't fetch all the rows to count them
+        self.server_side = server_side
+
         # This read/write attribute specifies the number of rows to fetch at a
         # time with .fetchmany(). It defaults to 1 meaning to fetch a single
         # row at a time.
@@ -324,11 +802,57 @@ class Cursor(object):
 
         # this is set to an iterator after a successfull query
         self._results = None
+        # the database the SQL wrapping Flux queries runs on, if any
+        self._model = None
+        self.sqliteengine = None
+
+        # timings and row counts of the last query, per stage
+        self.stats = {}
+        self.max_points_per_series = None
+        self.optimize_flux = connection.optimize_flux
+        self.prefetch = connection.prefetch
+        self.time_format = connection.time_format
+        self.rowcount_query = connection.rowcount_query
+
+        # the Flux query sent by the last `execute`, if it was plain Flux,
+        # and its row count once known
+        self._flux_query = None
+        self._rowcount = None
+
+        # queries with a lower value are admitted first when queued, and the
+        # responses holding the cursor's admission
+        self.priority = admission.INTERACTIVE
+        self._admitted = 0
+        self._admission_lock = threading.Lock()
+
+        # the HTTP responses being streamed, so that `cancel` can abort them
+        self._responses = set()
+        self._cancelled = False
+        self._cancel_event = threading.Event()
+        self._timed_out = False
+        self._deadline = None
+        # the queries in flight, or about to be sent; the deadline is stopped
+        # once there are none left
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+
+        # rows fetched since last added to the metrics
+        self._rows = 0
+        metrics.CURSORS.inc()
+        metrics.CURSORS_OPEN.inc()
+        self._finalizer = weakref.finalize(self, metrics.CURSORS_OPEN.dec)
 
     @property
     @check_result
     @check_closed
     def rowcount(self):
+        if self.rowcount_query and self._rowcount is None:
+            self._rowcount = self._count_rows()
+        if self._rowcount is not None:
+            return self._rowcount
+        if self.server_side:
+            return -1
+
         # consume the iterator
         results = list(self._results)
         n = len(results)
@@ -339,70 +863,344 @@ class Cursor(object):
     def close(self):
         """Close the cursor."""
         self.closed = True
+        self.cancel()
+        self._release()
+        self._finalizer()
+
+    def _release(self):
+        """Drop the results of the last query and the SQLite database."""
+        if self._rows:
+            metrics.ROWS.inc(self._rows)
+            self._rows = 0
+        if isinstance(self._results, Prefetcher):
+            # abort the query read ahead, so that its thread stops before
+            # another query starts, rather than racing it
+            for response in list(self._responses):
+                response.close()
+            self._results.close()
+        if self._results is not None:
+            self._results = iter(())
+        if self._model is not None:
+            self._model.close()
+            self._model = None
+        self.sqliteengine = None
+
+    def cancel(self):
+        """
+        Abort the query in flight, if any.
 
-    def is_supported_query(self, parsed):
-        if hasattr(parsed, "tokens"):
-            for token in parsed.tokens:
-                if "on" == token.value.lower():
-                    return True
-        return False
-
-    def get_supported_query(self, parsed, original_parsed=None):
-        if not original_parsed:
-            original_parsed = parsed
-        # query is not supported. Try finding a supported inner query
-        if parsed and hasattr(parsed, "tokens"):
-            for token in parsed.tokens:
-                value = token.value
-                if "from%%%bucket:" in value.replace("(", "%%%").replace(" ", "").lower():
-                    # if self.is_supported_query(token):
-                    # found supported query
-                    # return it and modified
-                    return (value.replace(')as qry',"").replace(') AS "virtual_table"',"").strip(' ()\'\"') if value.strip(' ').startswith("(") else value,
-                            original_parsed.value.replace(value, "(SELECT * FROM Model)"))
-                else:
-                    ret = self.get_supported_query(token, original_parsed)
-                    if ret:
-                        return ret
-                # else:
-                #     ret = self.get_supported_query(token, original_parsed)
-                #     if ret:
-                #         return ret
-        return None
+        This may be called from another thread; the thread consuming the
+        results will get an `OperationalError`.
+        """
+        self._cancelled = True
+        self._cancel_event.set()
+        if self._responses and not self._timed_out:
+            metrics.CANCELLATIONS.inc()
+        for response in list(self._responses):
+            response.close()
+
+    def _expire(self):
+        self._timed_out = True
+        metrics.TIMEOUTS.inc()
+        self.cancel()
+
+    def _start_deadline(self, timeout):
+        self._cancelled = False
+        self._cancel_event.clear()
+        self._start_timer(timeout)
+
+    def _start_timer(self, timeout):
+        """Start the deadline only, leaving any pending `cancel` in effect."""
+        self._stop_deadline()
+        self._timed_out = False
+        if timeout is None:
+            timeout = self.connection.timeout
+        self.timeout = timeout
+        if timeout is not None:
+            self._deadline = threading.Timer(timeout, self._expire)
+            self._deadline.daemon = True
+            self._deadline.start()
+
+    def _stop_deadline(self):
+        if self._deadline is not None:
+            self._deadline.cancel()
+            self._deadline = None
+
+    def _enter_query(self):
+        with self._pending_lock:
+            self._pending += 1
+
+    def _leave_query(self):
+        with self._pending_lock:
+            self._pending -= 1
+            done = not self._pending
+        if done:
+            # the deadline covers the queries sent concurrently, if any
+            self._stop_deadline()
+
+    def _check_cancelled(self):
+        if self._timed_out:
+            raise OperationalError(f'Query exceeded timeout of {self.timeout}s')
+        if self._cancelled:
+            raise OperationalError('Query cancelled')
 
     def execute_one_influxdb2(self, operation, schema):
-        # `_stream_query` returns a generator that produces the rows; we need
-        # to consume the first row so that `description` is properly set, so
-        # let's consume it and insert it back.
-        results = self._stream_query(operation, schema)
-        first_row = next(results)
-        self._results = itertools.chain([first_row], results)
-
+        self._start_results(self._stream_query(operation, schema))
         return self._results
 
+    def _start_results(self, results):
+        """
+        Make the `results` generator those of the cursor, once it produced its
+        first row so that `description` is set, read ahead with `prefetch`.
+        """
+        if self.prefetch:
+            self._results = Prefetcher(results, self.prefetch)
+            self._results.wait()
+            return
+        try:
+            first_row = next(results)
+        except StopIteration:
+            self._results = iter([])
+        else:
+            self._results = itertools.chain([first_row], results)
+
     @check_closed
-    def execute(self, operation, parameters=None, schema=None, **kwargs):
+    def execute(self, operation, parameters=None, schema=None, timeout=None,
+                max_points_per_series=None, time_format=None, rowcount_query=None,
+                priority=admission.INTERACTIVE, optimize_flux=None, prefetch=None,
+                **kwargs):
         operation = apply_parameters(operation, parameters or {})
-        # `_stream_query` returns a generator that produces the rows; we need
-        # to consume the first row so that `description` is properly set, so
-        # let's consume it and insert it back.
-        from_sqlite = self._stream_query_sqlite(operation, schema)
-        if not from_sqlite:
-            results = self.execute_one_influxdb2(operation, schema)
+        self._release()
+        self.stats = {}
+        self.priority = priority
+        self._flux_query = None
+        self._rowcount = None
+        if rowcount_query is None:
+            rowcount_query = self.connection.rowcount_query
+        self.rowcount_query = rowcount_query
+        if max_points_per_series is None:
+            max_points_per_series = self.connection.max_points_per_series
+        self.max_points_per_series = max_points_per_series
+        if optimize_flux is None:
+            optimize_flux = self.connection.optimize_flux
+        self.optimize_flux = optimize_flux
+        if prefetch is None:
+            prefetch = self.connection.prefetch
+        self.prefetch = prefetch
+        self.time_format = check_time_format(time_format or self.connection.time_format)
+        self._start_deadline(timeout)
+        explain = EXPLAIN_RE.match(operation)
+        if explain:
+            plan = self._explain(explain.group(2), explain.group(1), schema)
+            self._stop_deadline()
+            self.description = PLAN_DESCRIPTION
+            self._results = iter(plan)
+            self._rowcount = len(plan)
+            return self
+
+        results = self._stream_query_local(operation, schema)
+        if results is None:
+            self._flux_query = self._downsample(self._optimize(operation))
+            results = self._stream_query(self._flux_query, schema)
+        self._start_results(results)
+        return self
+
+    def _explain(self, operation, analyze, schema):
+        """
+        Return the plan of `operation`: the Flux sent to InfluxDB and the SQL,
+        if any, run locally over its results. With `analyze` the query is
+        actually run and each stage reports its real row count and duration.
+        """
+        queries = self._split_query(operation)
+        subqueries, sql = queries if queries else (
+            [(None, self._downsample(self._optimize(operation)))], None)
+        plan = []
+        sql_rows = sql_seconds = None
+        if analyze and sql:
+            start = time.perf_counter()
+            sql_rows = sum(1 for _ in self._stream_query_local(operation, schema))
+            sql_seconds = time.perf_counter() - start - self.stats['flux_seconds']
+            for table, query in subqueries:
+                stats = self.stats['tables'][table]
+                plan.append(PlanRow(
+                    'flux', 'influxdb2', query, stats['rows'], stats['seconds']))
+        elif analyze:
+            _, query = subqueries[0]
+            start = time.perf_counter()
+            flux_rows = sum(1 for _ in self._stream_query(query, schema))
+            plan.append(PlanRow(
+                'flux', 'influxdb2', query, flux_rows,
+                time.perf_counter() - start))
         else:
-            results = self.from_sqlite_engine()
+            for table, query in subqueries:
+                plan.append(PlanRow(
+                    'flux', 'influxdb2', query, self._estimate_rows(query), None))
+
+        if sql:
+            engine = self.stats.get('executor') or (
+                'vectorized' if vectorized.parse(sql) else 'sqlite')
+            plan.append(PlanRow('sql', engine, sql, sql_rows, sql_seconds))
+        return plan
+
+    def _estimate_rows(self, query):
+        """Ask the server how many rows `query` returns, without fetching them."""
+        try:
+            for row in self._stream_query(count_query(query), None):
+                return row.value
+        except OperationalError:
+            raise
+        except Exception:
+            logger.warning('Unable to estimate rows of %s', query, exc_info=True)
+            return None
+        return 0
 
-        first_row = next(results)
-        self._results = itertools.chain([first_row], results)
+    def _count_rows(self):
+        """
+        Count the rows of the last query without fetching them: on the server
+        for Flux, with `SELECT COUNT(*)` for SQL run on SQLite. Return `None`
+        when they can't be counted like that.
+        """
+        if self.sqliteengine is not None:
+            sql = self.query_to_execute_on_db.strip().rstrip(';')
+            try:
+                with self.sqliteengine.connect() as connection:
+                    return connection.execute(
+                        text(f'SELECT COUNT(*) FROM ({self._sqlite_sql(sql)})')).scalar()
+            except Exception:
+                logger.warning('Unable to count rows of %s', sql, exc_info=True)
+                return None
+        if self._flux_query is None:
+            return None
+        try:
+            columns = self._read_columns(count_query(self._flux_query))
+        except OperationalError:
+            raise
+        except Exception:
+            logger.warning('Unable to count rows of %s', self._flux_query, exc_info=True)
+            return None
+        return int(columns['value'][0]) if columns else 0
 
-        return self
+    def _sqlite_sql(self, sql):
+        """Return the outer `sql` with its time literals as SQLite holds times."""
+        return to_sqlite_times(sql, self._model.time_columns if self._model else ())
 
     def from_sqlite_engine(self):
+        """
+        Run the outer SQL on SQLite; times come back in `time_format`, as they
+        do from Flux and the vectorized executor, not as the text SQLite holds.
+        """
+        sql = self._sqlite_sql(self.query_to_execute_on_db)
         with self.sqliteengine.connect() as connection:
-            results = connection.execute(text(self.query_to_execute_on_db))
+            results = connection.execute(text(sql))
             self.description = results.cursor.description
+            Row = namedtuple('Row', [column[0] for column in self.description], rename=True)
+            # columns are told to hold times or not by their first value
+            pending = set(range(len(self.description)))
+            times = []
             for row in results:
-                yield row
+                if pending:
+                    for i in list(pending):
+                        value = row[i]
+                        if value is not None:
+                            pending.discard(i)
+                            if isinstance(value, str) and SQLITE_TIME_RE.match(value):
+                                times.append(i)
+                if times:
+                    row = list(row)
+                    for i in times:
+                        if row[i] is not None:
+                            row[i] = from_sqlite_time(row[i], self.time_format)
+                yield Row(*row)
+
+    @check_closed
+    def follow(self, query, interval=5, watermark_column='_time', timeout=None):
+        """
+        Run the Flux `query`, then poll it every `interval` seconds for newer
+        points; yield rows as they arrive.
+
+        Each poll rewrites the `range(start:)` of `query` to the latest
+        `watermark_column` seen, and skips the rows at that time that were
+        already yielded, by series. The generator ends when the cursor is
+        closed or `cancel` is called; `timeout` applies to each poll.
+        """
+        if self._split_query(query):
+            raise NotSupportedError('Only Flux queries can be followed')
+        if flux.find_range(query) is None:
+            raise ProgrammingError('Only queries with a range() can be followed')
+        return self._follow(query, interval, watermark_column, timeout)
+
+    def _follow(self, query, interval, watermark_column, timeout):
+        time_column = flux.FluxColumn(watermark_column, 'dateTime:RFC3339', False, '')
+        poll = query
+        watermark = None
+        seen = set()  # series of the rows at the watermark
+        # a cancel between polls must end the generator, so only the first
+        # poll clears it
+        self._cancelled = False
+        self._cancel_event.clear()
+        while True:
+            self._start_timer(timeout)
+            try:
+                records = list(self._query_stream(poll, flux.iter_csv))
+            except OperationalError:
+                if self._cancelled and not self._timed_out:
+                    return
+                raise
+
+            layouts = {}
+            keys, cells_list = [], []
+            for columns, cells in records:
+                layout = layouts.get(id(columns))
+                if layout is None:
+                    names = [column.name for column in columns]
+                    if watermark_column not in names:
+                        raise ProgrammingError(f'No {watermark_column} column to follow')
+                    layout = layouts[id(columns)] = (
+                        names.index(watermark_column),
+                        [i for i, column in enumerate(columns)
+                         if column.group and column.name not in ('_start', '_stop')])
+                position, group = layout
+                keys.append(tuple(cells[i] for i in group))
+                cells_list.append(cells[position])
+            times = flux.to_array(cells_list, time_column).astype('int64').tolist()
+
+            fresh = [
+                record for record, key, t in zip(records, keys, times)
+                if watermark is None or t > watermark or (t == watermark and key not in seen)
+            ]
+            if times and (watermark is None or max(times) >= watermark):
+                if watermark is None or max(times) > watermark:
+                    watermark = max(times)
+                    seen = set()
+                seen.update(key for key, t in zip(keys, times) if t == watermark)
+                poll = flux.replace_range(query, watermark)
+
+            if fresh:
+                columns = flux.read_columns(fresh)
+                for row in self._rows_from_arrays(list(columns), list(columns.values())):
+                    if self._cancel_event.is_set():
+                        return
+                    yield row
+            if self.closed or self._cancel_event.wait(interval):
+                return
+
+    @check_closed
+    def fetch_series(self, query, timeout=None, time_format=None):
+        """
+        Run the Flux `query` and yield a `flux.Series` per table of its
+        results, as they arrive: the tags of the table once, rather than on
+        every row, and NumPy arrays of its times and values.
+        """
+        if self._split_query(query):
+            raise NotSupportedError('Only Flux queries can be fetched as series')
+        time_format = check_time_format(time_format or self.connection.time_format)
+        return self._fetch_series(query, timeout, time_format)
+
+    def _fetch_series(self, query, timeout, time_format):
+        self._start_deadline(timeout)
+        records = self._query_stream(query, flux.iter_csv)
+        for series in flux.iter_series(records, time_format):
+            yield series
 
     @check_closed
     def executemany(self, operation, seq_of_parameters=None):
@@ -458,10 +1256,152 @@ class Cursor(object):
 
     @check_closed
     def __next__(self):
-        return next(self._results)
+        try:
+            row = next(self._results)
+        except StopIteration:
+            self._release()
+            raise
+        self._rows += 1
+        return row
 
     next = __next__
 
+    def _post_query(self, query):
+        """
+        Send `query` to a node of the connection and return the unread HTTP
+        response; the nodes it was sent to are listed in `stats['hosts']`.
+        Responses are recorded, or replayed, if the connection says so.
+        """
+        def send(node):
+            self.stats.setdefault('hosts', []).append(node.url)
+            query_api = node.client.query_api()
+            return query_api._query_api.post_query(
+                org=self.connection.org,
+                query=query_api._create_query(query, query_api.default_dialect),
+                async_req=False, _preload_content=False,
+                _request_timeout=self.timeout)
+
+        connection = self.connection
+        leave = self._admit()
+        try:
+            start = time.perf_counter()
+            if connection.replayer is not None:
+                response = connection.replayer.open(query, connection.org)
+            else:
+                response = connection.hosts.post(send, retry=not hosts.writes(query))
+            if connection.recorder is not None:
+                response = connection.recorder.record(
+                    response, query, connection.org, connection.url, start)
+        except BaseException:
+            if leave is not None:
+                leave()
+            raise
+        return hosts.TrackedResponse(response, functools.partial(self._received, response, leave))
+
+    def _received(self, response, leave):
+        """Count the bytes of the closed `response`, and leave the admission queue."""
+        tell = getattr(response, 'tell', None)
+        if tell is not None:
+            metrics.RESPONSE_BYTES.inc(tell())
+        if leave is not None:
+            leave()
+
+    def _admit(self):
+        """
+        Wait for the connection's admission queue, if any, to let a query in;
+        return the function to call once its response is closed. Queries sent
+        while the cursor holds a slot, e.g. its subqueries or the count of its
+        rows, share that slot. The wait is added to `stats['queue_seconds']`.
+        """
+        queue = self.connection.admission
+        if queue is None:
+            return None
+        with self._admission_lock:
+            if not self._admitted:
+                waited = queue.acquire(
+                    self.priority, self.connection.queue_timeout, self._cancel_event)
+                if waited is None:
+                    self._check_cancelled()
+                    raise OperationalError('Query cancelled')
+                self.stats['queue_seconds'] = self.stats.get('queue_seconds', 0) + waited
+            self._admitted += 1
+        return functools.partial(self._leave, queue)
+
+    def _leave(self, queue):
+        with self._admission_lock:
+            self._admitted -= 1
+            if not self._admitted:
+                queue.release()
+
+    def _open_query(self, query):
+        """Send `query`, or serve it from the connection's cache if it has one."""
+        cache = self.connection.cache
+        if cache is not None:
+            response = cache.open(
+                query,
+                lambda query: self._query_stream(query, flux.iter_csv, cached=False))
+            if response is not None:
+                return response
+        return self._send_query(query)
+
+    def _send_query(self, query):
+        """
+        Send `query`, or share the request of the same query if one is already
+        in flight in the process.
+        """
+        connection = self.connection
+        if not connection.single_flight:
+            return self._post_query(query)
+        key = (
+            connection.url, connection.org, connection.influxDb2.token,
+            flux.normalize(query))
+        response, shared = singleflight.open(key, lambda: self._post_query(query))
+        if shared:
+            self.stats['shared'] = self.stats.get('shared', 0) + 1
+        return response
+
+    def _query_stream(self, query, decode=None, cached=True):
+        """
+        Yield the `FluxRecord`s of a query, or what `decode` yields from the
+        response, honouring `cancel` and the deadline.
+        """
+        self._check_cancelled()
+        response = None
+        start = time.perf_counter()
+        metrics.QUERIES.inc()
+        self._enter_query()
+        try:
+            response = self._open_query(query) if cached else self._send_query(query)
+            metrics.TIME_TO_FIRST_BYTE.observe(time.perf_counter() - start)
+            metrics.QUERIES_IN_FLIGHT.inc()
+            self._responses.add(response)
+            if self._cancelled:
+                # cancelled while sending the query
+                response.close()
+            if decode is None:
+                query_api = self.connection.influxDb2.query_api()
+                records = query_api._to_flux_record_stream(
+                    response, query_options=query_api._get_query_options())
+            else:
+                records = decode(response)
+            for record in records:
+                yield record
+        except Exception:
+            if self._cancelled:
+                self._check_cancelled()
+            metrics.QUERY_ERRORS.inc()
+            raise
+        finally:
+            if response is not None:
+                # release the connection, also when the results are abandoned
+                response.close()
+                self._responses.discard(response)
+                metrics.QUERIES_IN_FLIGHT.dec()
+            metrics.QUERY_SECONDS.observe(time.perf_counter() - start)
+            self._leave_query()
+        # closing the response mid-read may just look like the end of data
+        self._check_cancelled()
+
     def _stream_query(self, query, schema):
         """
         Stream rows from a query.
@@ -470,9 +1410,14 @@ class Cursor(object):
         server.
         """
         self.description = None
-        if query:
-            query_api = self.connection.influxDb2.query_api()
-            res = query_api.query_stream( query=query, org=self.connection.org )
+        if query and self.connection.decode_processes:
+            for row in self._stream_query_blocks(query):
+                yield row
+        elif query and self.time_format != 'datetime':
+            for row in self._stream_query_csv(query):
+                yield row
+        elif query:
+            res = self._query_stream(query)
             for record in res:
                 Row = None
                 row = record.row
@@ -548,6 +1493,101 @@ class Cursor(object):
 
             yield Row(*['1'])
 
+    def _stream_query_csv(self, query):
+        """
+        Stream rows from a Flux query, decoding the response with our own
+        parser, which returns times in `time_format`.
+        """
+        layouts = {}
+        for columns, cells in self._query_stream(query, flux.iter_csv):
+            layout = layouts.get(id(columns))
+            if layout is None:
+                names = [column.name for column in columns]
+                if self.description is None:
+                    self.description = get_description_from_rowset(dict.fromkeys(names))
+                layout = layouts[id(columns)] = (
+                    namedtuple('Row', [name.strip('_') for name in names], rename=True),
+                    [flux.get_parser(column, self.time_format) for column in columns])
+            Row, parsers = layout
+            yield Row(*[parse(cell) for parse, cell in zip(parsers, cells)])
+
+    def _stream_query_blocks(self, query):
+        """
+        Stream rows from a Flux query, decoding the response in the
+        connection's pool of processes.
+        """
+        for columns, arrays in self._query_stream(query, self._decode_blocks):
+            names = [column.name.strip('_') for column in columns]
+            for row in self._rows_from_arrays(names, arrays):
+                yield row
+
+    def _decode_blocks(self, response):
+        processes = self.connection.decode_processes
+        return parallel.decode(response, self.connection.decode_pool(), 2 * processes)
+
+    def _stream_query_local(self, query, schema):
+        """
+        Stream rows from a SQL query wrapping Flux, or return `None` if
+        `query` is plain Flux.
+
+        The SQL runs over the Flux results in process when it is simple
+        enough, and on SQLite otherwise.
+        """
+        queries = self._split_query(query)
+        if not queries:
+            return None
+        subqueries, self.query_to_execute_on_db = queries
+        plan = vectorized.parse(self.query_to_execute_on_db)
+        if plan is None:
+            self._stream_query_sqlite(query, schema)
+            return self.from_sqlite_engine()
+        return self._stream_query_vectorized(plan, subqueries)
+
+    def _stream_query_vectorized(self, plan, subqueries):
+        """
+        Stream the rows of `plan` run over the columns of the Flux results,
+        falling back to SQLite if the data needs SQL it does not support.
+        """
+        tables = self._read_tables_within_budget(subqueries)
+        if tables is None:
+            # over the memory budget, the results were moved to SQLite
+            for row in self.from_sqlite_engine():
+                yield row
+            return
+        _, columns, _ = tables[0]
+        try:
+            names, outputs = plan.execute(columns)
+        except vectorized.Unsupported:
+            self._load_tables(tables)
+            for row in self.from_sqlite_engine():
+                yield row
+            return
+
+        self.stats['executor'] = 'vectorized'
+        self.stats['model_bytes'] = sum(
+            get_columns_bytes(columns) for _, columns, _ in tables)
+        self.stats['spill_bytes'] = 0
+        self.stats['peak_rss'] = get_peak_rss()
+        rows = self._rows_from_arrays(names, outputs)
+        if self.rowcount_query:
+            self._rowcount = len(outputs[0]) if outputs else 0
+        for row in rows:
+            yield row
+
+    def _rows_from_arrays(self, names, arrays):
+        """
+        Set `description` and return rows from columns of NumPy arrays;
+        server-side cursors convert them a batch at a time as they are fetched.
+        """
+        self.description = [
+            (name, get_type_from_array(array, self.time_format), None, None, None, None, True)
+            for name, array in zip(names, arrays)
+        ]
+        Row = namedtuple('Row', names, rename=True)
+        if self.server_side:
+            return (Row(*row) for row in vectorized.iter_rows(arrays, self.time_format))
+        return [Row(*row) for row in vectorized.to_rows(arrays, self.time_format)]
+
     def _stream_query_sqlite(self, query, schema):
         """
         Stream rows from a query.
@@ -555,26 +1595,239 @@ class Cursor(object):
         This method will yield rows as the data is returned in chunks from the
         server.
         """
-        if query:
+        queries = self._split_query(query)
+        if queries:
+            subqueries, self.query_to_execute_on_db = queries
+            model = ModelDatabase(self.connection.memory_budget)
+            try:
+                self._read_tables(subqueries, model.load)
+                self._open_model(model)
+            except BaseException:
+                model.close()
+                raise
+            return True
+        return False
+
+    def _read_columns(self, query, datatypes=None):
+        """Fetch the results of a Flux query as a dict of NumPy columns."""
+        if self.connection.decode_processes:
+            return flux.merge_blocks(
+                self._query_stream(query, self._decode_blocks), datatypes)
+        return flux.read_columns(
+            self._query_stream(query, flux.iter_csv), datatypes)
+
+    def _read_batches(self, query):
+        """
+        Fetch the results of a Flux query as `(columns, datatypes)` batches
+        of about `BATCH_ROWS` rows, as they are received.
+        """
+        if self.connection.decode_processes:
+            blocks = self._query_stream(query, self._decode_blocks)
+        else:
+            rows = self._query_stream(query, flux.iter_csv)
+            batches = iter(lambda: list(itertools.islice(rows, BATCH_ROWS)), [])
+            blocks = itertools.chain.from_iterable(
+                flux.read_blocks(batch) for batch in batches)
+        batch, size = [], 0
+        for block in blocks:
+            batch.append(block)
+            size += len(block[1][0]) if block[1] else 0
+            if size >= BATCH_ROWS:
+                datatypes = {}
+                yield flux.merge_blocks(batch, datatypes), datatypes
+                batch, size = [], 0
+        if batch:
+            datatypes = {}
+            yield flux.merge_blocks(batch, datatypes), datatypes
+
+    def _read_tables(self, subqueries, load=None):
+        """
+        Fetch the results of the `(table, flux)` subqueries, concurrently when
+        there are several; return `(table, columns, datatypes)` for each.
+
+        With `load`, results are instead passed to `load(table, columns,
+        datatypes)` in batches as they are received, and not returned.
+        """
+        start = time.perf_counter()
+        self.stats['tables'] = {}
+
+        def read(subquery):
+            table, query = subquery
+            table_start = time.perf_counter()
+            if load is None:
+                datatypes = {}
+                columns = self._read_columns(query, datatypes)
+                rows = len(next(iter(columns.values()))) if columns else 0
+            else:
+                columns = datatypes = None
+                rows = 0
+                for batch, batch_types in self._read_batches(query):
+                    load(table, batch, batch_types)
+                    rows += len(next(iter(batch.values()))) if batch else 0
+            self.stats['tables'][table] = {
+                'rows': rows,
+                'seconds': time.perf_counter() - table_start,
+            }
+            return table, columns, datatypes
+
+        if len(subqueries) == 1:
+            tables = [read(subqueries[0])]
+        else:
+            # keep the deadline running until every subquery is done, not
+            # just the first ones to complete
+            self._enter_query()
+            try:
+                with ThreadPoolExecutor(max_workers=len(subqueries)) as pool:
+                    futures = [pool.submit(read, subquery) for subquery in subqueries]
+                    # fail on the first error, whichever subquery it comes from,
+                    # without waiting for the other queries to complete
+                    done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+                    failed = [future for future in done if future.exception()]
+                    if failed:
+                        self.cancel()
+                        raise failed[0].exception()
+                    tables = [future.result() for future in futures]
+            finally:
+                self._leave_query()
+        self.stats['flux_rows'] = sum(
+            stats['rows'] for stats in self.stats['tables'].values())
+        self.stats['flux_seconds'] = time.perf_counter() - start
+        return tables
+
+    def _read_tables_within_budget(self, subqueries):
+        """
+        Fetch the results of the subqueries like `_read_tables`, as long as
+        they fit in the connection's `memory_budget`. Past it, the results read
+        so far and the rest of them are loaded into a `ModelDatabase`, which
+        the outer SQL runs on next, and `None` is returned.
+        """
+        budget = self.connection.memory_budget
+        if budget is None:
+            return self._read_tables(subqueries)
+
+        batches = {table: [] for table, _ in subqueries}
+        lock = threading.Lock()
+        state = {'bytes': 0, 'model': None}
+
+        def load(table, columns, datatypes):
+            with lock:
+                model = state['model']
+                if model is None:
+                    batches[table].append((columns, datatypes))
+                    state['bytes'] += get_columns_bytes(columns)
+                    if state['bytes'] <= budget:
+                        return
+                    model = state['model'] = ModelDatabase(budget)
+                    for name, loaded in batches.items():
+                        for batch, batch_types in loaded:
+                            model.load(name, batch, batch_types)
+                    batches.clear()
+                    return
+            model.load(table, columns, datatypes)
+
+        try:
+            self._read_tables(subqueries, load)
+            if state['model'] is not None:
+                self._open_model(state['model'])
+                return None
+        except BaseException:
+            if state['model'] is not None:
+                state['model'].close()
+            raise
+
+        tables = []
+        for table, _ in subqueries:
+            datatypes = {}
+            columns = merge_batches(batches[table], datatypes)
+            tables.append((table, columns, datatypes))
+        return tables
+
+    def _load_tables(self, tables):
+        """
+        Load the `(table, columns, datatypes)` Flux results into the tables of
+        a SQLite database.
+
+        Columns are typed after their Flux `datatypes`, and the ones the outer
+        SQL filters, groups, sorts or joins on are indexed once loaded.
+        """
+        model = ModelDatabase(self.connection.memory_budget)
+        try:
+            for table, columns, datatypes in tables:
+                model.load(table, columns, datatypes)
+            self._open_model(model)
+        except BaseException:
+            model.close()
+            raise
+
+    def _open_model(self, model):
+        """Index the loaded `model` database and run the outer SQL on it next."""
+        model.create_indexes(self.query_to_execute_on_db)
+        self._model = model
+        self.sqliteengine = model.engine
+        self.stats['executor'] = 'sqlite'
+        metrics.SQLITE_FALLBACKS.inc()
+        self.stats['model_bytes'] = model.loaded
+        self.stats['spill_bytes'] = model.spill_bytes
+        self.stats['peak_rss'] = get_peak_rss()
+
+    def _optimize(self, query):
+        """
+        Rewrite the Flux `query` for storage to push more of it down, if
+        `optimize_flux` is set; the rewrites are reported in
+        `stats['rewrites']` and what still can't be pushed down in
+        `stats['flux_warnings']`, by query.
+        """
+        if not self.optimize_flux:
+            return query
+        optimized, rewrites, warnings = optimizer.optimize(query)
+        if rewrites:
+            self.stats.setdefault('rewrites', {})[query] = rewrites
+            logger.info('Rewrote %s: %s', query, ', '.join(rewrites))
+        if warnings:
+            self.stats.setdefault('flux_warnings', {})[optimized] = warnings
+            for warning in warnings:
+                logger.warning('%s in %s', warning, optimized)
+        return optimized
+
+    def _downsample(self, query):
+        """
+        Fit the plain Flux `query` within `max_points_per_series`, if set;
+        the windows chosen are reported in `stats['windows']`, by query.
+        """
+        if not self.max_points_per_series:
+            return query
+        downsampled, every = flux.downsample(
+            query, self.max_points_per_series, time.time_ns())
+        if every is not None:
+            self.stats.setdefault('windows', {})[query] = every
+            logger.info('Aggregating %s in windows of %s', query, every)
+        return downsampled
+
+    def _split_query(self, query):
+        """
+        Split a SQL query wrapping Flux into the `(table, flux)` subqueries to
+        run on InfluxDB and the SQL to run locally over their results, where
+        each subquery is replaced by a table named `Model`, `Model1`,
+        `Model2`...; return `None` for plain queries.
+        """
+        # only SQL can wrap Flux, and splitting statements is slow
+        if query and flux.SELECT_RE.match(query):
             statements = sqlparse.split(query)
             if len(statements) > 1:
                 logger.warning("Multiple queries not supported")
             statement = statements[0]
-            parsed = sqlparse.parse(statement)[0]
-            # check if we have a containing unsupported select
-            if not self.is_supported_query(parsed):
-                queries = self.get_supported_query(parsed)
-                if queries:
-                    self.query_to_execute_on_influxdb2 = queries[0]
-                    self.query_to_execute_on_db = queries[1]
-                    results = self.execute_one_influxdb2(self.query_to_execute_on_influxdb2, schema)
-                    self.sqliteengine = create_engine('sqlite:///:memory:', echo=True)
-                    with self.sqliteengine.connect() as connection:
-                        connection.execute(text("drop table if exists model"))
-                    df = pd.DataFrame(results)
-                    df.to_sql('Model', self.sqliteengine.engine)
-                    return True
-        return False
+            subqueries, parts, end = [], [], 0
+            for start, stop in flux.find_subqueries(statement):
+                table = f'Model{len(subqueries) or ""}'
+                subqueries.append(
+                    (table, self._optimize(statement[start:stop].strip())))
+                parts.append(statement[end:start])
+                parts.append(f'SELECT * FROM {table}')
+                end = stop
+            if subqueries:
+                parts.append(statement[end:])
+                return subqueries, ''.join(parts)
+        return None
 
 
 def apply_parameters(operation, parameters):
@@ -0,0 +1,680 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import base64
+import calendar
+import codecs
+from collections import namedtuple
+import csv
+import datetime
+import functools
+import re
+
+import numpy as np
+import pandas as pd
+
+from .exceptions import ProgrammingError
+
+
+YIELD_RE = re.compile(r'\|>\s*yield\s*\([^()]*\)\s*$')
+
+
+def strip_yield(query):
+    """Remove a trailing `yield()` so more stages can be piped after it."""
+    return YIELD_RE.sub('', query.strip()).rstrip()
+
+
+def count_query(query):
+    """
+    Rewrite `query` to return its total number of rows as a single value.
+
+    `count()` skips null values, e.g. those of empty `aggregateWindow()`s, so
+    it counts a `_value` set on every row instead of the original one.
+    """
+    return (
+        f'{strip_yield(query)}\n'
+        '  |> map(fn: (r) => ({r with _value: 1}))\n'
+        '  |> count()\n'
+        '  |> group()\n'
+        '  |> sum()'
+    )
+
+
+FROM_BUCKET_RE = re.compile(r'from\s*\(\s*bucket\s*:', re.I)
+
+SELECT_RE = re.compile(r'^\s*(?:SELECT|WITH)\b', re.I)
+
+
+def skip_string(text, i):
+    """Return the position after the string literal starting at `text[i]`."""
+    quote = text[i]
+    i += 1
+    while i < len(text):
+        if text[i] == '\\':
+            i += 2
+        elif text[i] == quote:
+            return i + 1
+        else:
+            i += 1
+    return i
+
+
+def normalize(query):
+    """
+    Collapse the runs of whitespace outside string literals of `query`, so
+    that queries that only differ in layout compare equal.
+    """
+    parts = []
+    i = 0
+    while i < len(query):
+        char = query[i]
+        if char in '\'"':
+            end = skip_string(query, i)
+            parts.append(query[i:end])
+            i = end
+        elif char.isspace():
+            while i < len(query) and query[i].isspace():
+                i += 1
+            parts.append(' ')
+        else:
+            parts.append(char)
+            i += 1
+    return ''.join(parts).strip()
+
+
+def find_closing(text, i):
+    """Return the position of the parenthesis closing the one at `text[i]`."""
+    depth = 0
+    while i < len(text):
+        char = text[i]
+        if char in '\'"':
+            i = skip_string(text, i)
+            continue
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+            if depth == 0:
+                return i
+        i += 1
+    raise ProgrammingError('Unbalanced parentheses')
+
+
+def find_subqueries(sql):
+    """
+    Return the `(start, end)` spans of the Flux queries that `sql` embeds
+    between parentheses, in order, e.g. `SELECT ... FROM (from(bucket: ...))`.
+
+    Plain Flux queries, that do not start with `SELECT`, embed none.
+    """
+    spans = []
+    if not SELECT_RE.match(sql):
+        return spans
+    i = 0
+    while i < len(sql):
+        char = sql[i]
+        if char in '\'"':
+            i = skip_string(sql, i)
+            continue
+        if char == '(':
+            end = find_closing(sql, i)
+            body = sql[i + 1:end]
+            if FROM_BUCKET_RE.search(body) and not SELECT_RE.match(body):
+                spans.append((i + 1, end))
+                i = end + 1
+                continue
+        i += 1
+    return spans
+
+
+def split_pipeline(query):
+    """
+    Split `query` into the text of its `|>` stages, ignoring pipes nested in
+    function calls or string literals.
+    """
+    stages = []
+    depth = start = i = 0
+    while i < len(query):
+        char = query[i]
+        if char in '\'"':
+            i = skip_string(query, i)
+            continue
+        if char in '([{':
+            depth += 1
+        elif char in ')]}':
+            depth -= 1
+        elif depth == 0 and query.startswith('|>', i):
+            stages.append(query[start:i].strip())
+            start = i + 2
+            i += 1
+        i += 1
+    stages.append(query[start:].strip())
+    return stages
+
+
+def get_function(stage):
+    """Return the name of the function a pipeline stage calls, if any."""
+    match = re.match(r'([A-Za-z_][\w.]*)\s*\(', stage)
+    return match.group(1) if match else None
+
+
+def get_arguments(stage):
+    """Return the named arguments of the call in `stage` as raw text."""
+    start = stage.index('(')
+    body = stage[start + 1:find_closing(stage, start)]
+    arguments = {}
+    depth = begin = i = 0
+    parts = []
+    while i < len(body):
+        char = body[i]
+        if char in '\'"':
+            i = skip_string(body, i)
+            continue
+        if char in '([{':
+            depth += 1
+        elif char in ')]}':
+            depth -= 1
+        elif char == ',' and depth == 0:
+            parts.append(body[begin:i])
+            begin = i + 1
+        i += 1
+    parts.append(body[begin:])
+    for part in parts:
+        if ':' in part:
+            name, value = part.split(':', 1)
+            arguments[name.strip()] = value.strip()
+    return arguments
+
+
+RANGE_RE = re.compile(r'\|>\s*range\s*\(')
+
+
+def find_range(query):
+    """
+    Return the `(start, end)` span of the `|> range(...)` stage of `query`,
+    excluding the pipe, or `None` if it has none.
+    """
+    match = RANGE_RE.search(query)
+    if match is None:
+        return None
+    start = query.index('range', match.start())
+    return start, find_closing(query, match.end() - 1) + 1
+
+
+def replace_range(query, start, stop=None):
+    """
+    Rewrite the `range()` of `query` to run from `start` to `stop`, both in
+    nanoseconds since the epoch; `stop` defaults to now.
+    """
+    span = find_range(query)
+    if span is None:
+        raise ProgrammingError('The query has no range()')
+    arguments = f'start: {format_time(start)}'
+    if stop is not None:
+        arguments += f', stop: {format_time(stop)}'
+    return f'{query[:span[0]]}range({arguments}){query[span[1]:]}'
+
+
+DURATION_RE = re.compile(r'(\d+)(ns|us|µs|ms|s|mo|m|h|d|w|y)')
+
+DURATION_UNITS = {
+    'ns': 1,
+    'us': 10 ** 3,
+    'µs': 10 ** 3,
+    'ms': 10 ** 6,
+    's': 10 ** 9,
+    'm': 60 * 10 ** 9,
+    'h': 3600 * 10 ** 9,
+    'd': 86400 * 10 ** 9,
+    'w': 7 * 86400 * 10 ** 9,
+}
+
+
+def parse_duration(text):
+    """
+    Return the Flux duration literal `text` in nanoseconds, or `None` if it
+    is not one or has calendar units (months or years).
+    """
+    sign = -1 if text.startswith('-') else 1
+    text = text.lstrip('-')
+    parts = DURATION_RE.findall(text)
+    if not parts or ''.join(n + unit for n, unit in parts) != text:
+        return None
+    if any(unit not in DURATION_UNITS for _, unit in parts):
+        return None
+    return sign * sum(int(n) * DURATION_UNITS[unit] for n, unit in parts)
+
+
+def parse_time(text, now):
+    """
+    Return the `range()` bound `text` in nanoseconds since the epoch, given
+    the current time `now`, or `None` if it is not a literal.
+    """
+    text = text.strip()
+    if text == 'now()':
+        return now
+    duration = parse_duration(text)
+    if duration is not None:
+        return now + duration
+    if re.match(r'^\d{4}-\d{2}-\d{2}', text):
+        try:
+            return pd.Timestamp(text).value
+        except ValueError:
+            return None
+    return None
+
+
+def format_time(ns):
+    """Format nanoseconds since the epoch as a Flux time literal."""
+    return f'{np.datetime_as_string(np.datetime64(int(ns), "ns"))}Z'
+
+
+def format_string(text):
+    """Format `text` as a Flux string literal."""
+    escaped = text.replace('\\', '\\\\').replace('"', '\\"').replace('${', '\\${')
+    return f'"{escaped}"'
+
+
+def format_duration(ns):
+    """Format nanoseconds as a Flux duration literal, in the largest unit."""
+    for unit in ('w', 'd', 'h', 'm', 's', 'ms', 'us'):
+        if ns % DURATION_UNITS[unit] == 0:
+            return f'{ns // DURATION_UNITS[unit]}{unit}'
+    return f'{ns}ns'
+
+
+# stages that aggregate or select points, after which rows are no longer raw
+AGGREGATIONS = {
+    'aggregateWindow', 'window', 'mean', 'median', 'sum', 'count', 'min',
+    'max', 'first', 'last', 'quantile', 'reduce', 'integral', 'spread',
+    'stddev', 'mode', 'distinct', 'unique', 'histogram', 'sample', 'limit',
+    'tail', 'top', 'bottom', 'highestMax', 'lowestMin', 'movingAverage',
+    'timedMovingAverage', 'exponentialMovingAverage', 'derivative',
+    'difference', 'elapsed', 'cumulativeSum', 'increase', 'aggregate.rate',
+    'holtWinters', 'stateCount', 'stateDuration', 'timeWeightedAvg',
+}
+
+# stages that may run before the injected `aggregateWindow()`
+ROW_WISE = {'filter', 'keep', 'drop', 'rename', 'map', 'fill'}
+
+# window sizes, in seconds, that make readable chart ticks
+WINDOWS = [
+    1, 2, 5, 10, 15, 30, 60, 120, 300, 600, 900, 1800, 3600, 7200, 10800,
+    21600, 43200, 86400, 172800, 604800,
+]
+
+
+def get_window_size(start, stop, max_points):
+    """
+    Return the smallest readable window, in nanoseconds, that splits the
+    range from `start` to `stop` into at most `max_points` windows.
+    """
+    size = -(-(stop - start) // max_points)
+    if size < 10 ** 9:
+        return -(-size // 10 ** 6) * 10 ** 6  # whole milliseconds
+    for seconds in WINDOWS:
+        if seconds * 10 ** 9 >= size:
+            return seconds * 10 ** 9
+    day = DURATION_UNITS['d']
+    return -(-size // day) * day
+
+
+def downsample(query, max_points, now):
+    """
+    Insert an `aggregateWindow(fn: last)` after the `range()` and row-wise
+    stages of `query`, so that it returns at most `max_points` per series;
+    unlike `mean`, `last` keeps actual points of fields of any type.
+
+    Return the query and the window as a Flux duration, or `query` and
+    `None` if it already aggregates, is not a single pipeline or its range
+    is not made of literals.
+    """
+    try:
+        stages = split_pipeline(query)
+        functions = [get_function(stage) for stage in stages]
+        if functions[0] != 'from' or functions[1:2] != ['range']:
+            return query, None
+        if any(function in AGGREGATIONS for function in functions):
+            return query, None
+        arguments = get_arguments(stages[1])
+    except Exception:
+        return query, None
+    start = parse_time(arguments.get('start', ''), now)
+    stop = parse_time(arguments.get('stop', 'now()'), now)
+    if start is None or stop is None or stop - start <= 0:
+        return query, None
+    size = get_window_size(start, stop, max_points)
+
+    position = 2
+    while position < len(stages) and functions[position] in ROW_WISE:
+        position += 1
+    every = format_duration(size)
+    stages.insert(
+        position, f'aggregateWindow(every: {every}, fn: last, createEmpty: false)')
+    return '\n  |> '.join(stages), every
+
+
+CHUNK_SIZE = 64 * 1024
+
+
+def iter_chunks(response):
+    """
+    Iterate over the bytes of `response` in large chunks when it supports
+    it, like `urllib3.HTTPResponse.stream`.
+    """
+    if hasattr(response, 'stream'):
+        return response.stream(CHUNK_SIZE)
+    return iter(response)
+
+
+def iter_lines(response):
+    """Yield the lines of `response` as text."""
+    chunks = iter_chunks(response)
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    pending = ''
+    for chunk in chunks:
+        # split on newlines only; str.splitlines also breaks on characters
+        # that may appear inside quoted values
+        lines = (pending + decoder.decode(chunk)).split('\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line + '\n'
+    pending += decoder.decode(b'', final=True)
+    if pending:
+        yield pending
+
+
+# a column of a Flux table, as described by the CSV annotations
+FluxColumn = namedtuple('FluxColumn', ['name', 'datatype', 'group', 'default'])
+
+
+def iter_csv(response):
+    """
+    Decode the annotated CSV of a Flux `response`, an iterable of bytes.
+
+    Yield `(columns, cells)` for every data row, where `cells` are the raw
+    strings of the row and `columns` its `FluxColumn`s; rows of tables that
+    share annotations share the same `columns` list.
+    """
+    datatypes = groups = defaults = columns = None
+    error = False
+    for line in csv.reader(iter_lines(response)):
+        if not line:
+            continue  # tables are separated by empty lines
+        token = line[0]
+        if token.startswith('#'):
+            columns = None
+            if token == '#datatype':
+                datatypes = line[1:]
+            elif token == '#group':
+                groups = line[1:]
+            elif token == '#default':
+                defaults = line[1:]
+        elif columns is None:
+            error = line[1:3] == ['error', 'reference']
+            columns = [
+                FluxColumn(
+                    name,
+                    datatypes[i] if datatypes else 'string',
+                    groups[i] == 'true' if groups else False,
+                    defaults[i] if defaults else '',
+                )
+                for i, name in enumerate(line[1:])
+            ]
+        elif error:
+            raise ProgrammingError(line[1])
+        else:
+            yield columns, line[1:]
+
+
+def to_array(cells, column):
+    """
+    Convert the raw `cells` of `column` into a NumPy array.
+
+    Missing values become NaN for doubles, NaT for times and None in object
+    arrays; integer and boolean columns with missing values are object arrays.
+    """
+    if column.default:
+        cells = [cell or column.default for cell in cells]
+    datatype = column.datatype
+    missing = '' in cells
+    if datatype == 'double':
+        if missing:
+            cells = [cell or 'nan' for cell in cells]
+        return np.array(cells, dtype=np.float64)
+    if datatype in ('long', 'unsignedLong', 'duration'):
+        dtype = np.uint64 if datatype == 'unsignedLong' else np.int64
+        if missing:
+            return np.array(
+                [int(cell) if cell else None for cell in cells], dtype=object)
+        return np.array(cells, dtype=dtype)
+    if datatype == 'boolean':
+        if missing:
+            return np.array(
+                [cell == 'true' if cell else None for cell in cells],
+                dtype=object)
+        return np.array(cells, dtype=object) == 'true'
+    if datatype.startswith('dateTime'):
+        # all times are UTC; drop the `Z` that NumPy would warn about
+        return np.array(
+            [cell[:-1] if cell.endswith('Z') else cell for cell in cells],
+            dtype='datetime64[ns]')
+    if datatype == 'base64Binary':
+        return np.array(
+            [base64.b64decode(cell) if cell else None for cell in cells],
+            dtype=object)
+    return np.array([cell or None for cell in cells], dtype=object)
+
+
+# how times are returned: timezone-aware `datetime`s, nanoseconds since the
+# epoch, or NumPy `datetime64[ns]`
+TIME_FORMATS = ('datetime', 'epoch_ns', 'datetime64')
+
+
+@functools.lru_cache(maxsize=65536)
+def hour_seconds(hour):
+    """Return the seconds since the epoch of an hour like `2023-01-01T00`."""
+    return calendar.timegm((
+        int(hour[:4]), int(hour[5:7]), int(hour[8:10]), int(hour[11:13]), 0, 0))
+
+
+def parse_rfc3339(text):
+    """
+    Return the nanoseconds since the epoch of an RFC3339 time, like the
+    `2023-01-01T00:00:00.123456789Z` of Flux results.
+
+    Results share few distinct hours, so everything up to the hour is only
+    parsed once.
+    """
+    seconds = hour_seconds(text[:13]) + int(text[14:16]) * 60 + int(text[17:19])
+    end = len(text)
+    if text[-1] in 'Zz':
+        end -= 1
+    elif text[-6] in '+-':
+        offset = int(text[-5:-3]) * 3600 + int(text[-2:]) * 60
+        seconds -= offset if text[-6] == '+' else -offset
+        end -= 6
+    nanos = int(text[20:end].ljust(9, '0')[:9]) if end > 20 else 0
+    return seconds * 1000000000 + nanos
+
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def epoch_ns_to_datetime(ns):
+    """Convert nanoseconds since the epoch to a UTC `datetime`, to the us."""
+    return EPOCH + datetime.timedelta(microseconds=ns // 1000)
+
+TIME_PARSERS = {
+    'datetime': lambda cell: epoch_ns_to_datetime(parse_rfc3339(cell)),
+    'epoch_ns': parse_rfc3339,
+    'datetime64': lambda cell: np.datetime64(parse_rfc3339(cell), 'ns'),
+}
+
+PARSERS = {
+    'double': float,
+    'long': int,
+    'unsignedLong': int,
+    'duration': int,
+    'boolean': lambda cell: cell == 'true',
+    'base64Binary': base64.b64decode,
+}
+
+
+def get_parser(column, time_format='datetime'):
+    """
+    Return a function converting a raw cell of `column` into a Python value,
+    like the records of `influxdb_client` do, with times in `time_format`;
+    empty cells take the column default, or are `None`.
+    """
+    if column.datatype.startswith('dateTime'):
+        parse = TIME_PARSERS[time_format]
+    else:
+        parse = PARSERS.get(column.datatype, str)
+    default = parse(column.default) if column.default else None
+
+    def parser(cell):
+        return parse(cell) if cell else default
+
+    return parser
+
+
+def read_columns(rows, datatypes=None):
+    """
+    Gather the `(columns, cells)` rows yielded by `iter_csv` into a dict of
+    NumPy arrays, one per column, concatenating all tables. Column names have
+    their leading and trailing underscores stripped, as in the rows returned
+    by the cursor.
+
+    If `datatypes` is a dict, it is filled with the Flux datatype of every
+    column, as first annotated.
+    """
+    return merge_blocks(read_blocks(rows), datatypes)
+
+
+def read_blocks(rows):
+    """
+    Gather the `(columns, cells)` rows yielded by `iter_csv` into a list of
+    `(columns, arrays)`, with a NumPy array per column, for each run of rows
+    that share their `columns`.
+    """
+    blocks = []
+    columns, cells_list = None, []
+    for row_columns, cells in rows:
+        if row_columns is not columns:
+            if cells_list:
+                blocks.append((columns, cells_list))
+            columns, cells_list = row_columns, []
+        cells_list.append(cells)
+    if cells_list:
+        blocks.append((columns, cells_list))
+    return [
+        (columns, [to_array([row[i] for row in rows], column)
+                   for i, column in enumerate(columns)])
+        for columns, rows in blocks
+    ]
+
+
+def merge_blocks(blocks, datatypes=None):
+    """
+    Concatenate the `(columns, arrays)` blocks of `read_blocks` into a dict
+    of arrays, like `read_columns`.
+    """
+    blocks = list(blocks)
+    names = []
+    for columns, _ in blocks:
+        for column in columns:
+            name = column.name.strip('_')
+            if name not in names:
+                names.append(name)
+                if datatypes is not None:
+                    datatypes[name] = column.datatype
+
+    parts = {name: [] for name in names}
+    for columns, arrays in blocks:
+        index = {column.name.strip('_'): i for i, column in enumerate(columns)}
+        for name in names:
+            if name in index:
+                parts[name].append(arrays[index[name]])
+            else:
+                parts[name].append(len(arrays[0]))
+    return {name: concatenate(arrays) for name, arrays in parts.items()}
+
+
+def concatenate(arrays):
+    """
+    Concatenate the arrays of a column; integers stand for runs of missing
+    values, in tables without the column.
+    """
+    kinds = {array.dtype.kind for array in arrays if not isinstance(array, int)}
+    if kinds == {'f'}:
+        missing, dtype = np.nan, np.float64
+    elif kinds == {'M'}:
+        missing, dtype = np.datetime64('NaT'), 'datetime64[ns]'
+    else:
+        missing, dtype = None, object
+    arrays = [
+        np.full(array, missing, dtype=dtype) if isinstance(array, int)
+        else array
+        for array in arrays
+    ]
+    if len(arrays) == 1:
+        return arrays[0]
+    if dtype is object and not kinds <= {'i', 'u', 'f'}:
+        # mixed types; keep times as `datetime64` rather than integers
+        arrays = [
+            datetimes_to_objects(array) if array.dtype.kind == 'M'
+            else array.astype(object)
+            for array in arrays
+        ]
+    return np.concatenate(arrays)
+
+
+# the points of a Flux table: its group key once, as `tags`, then a NumPy
+# array of `times` (`None` without a `_time` column) and one of each other
+# column, by name
+Series = namedtuple('Series', ['tags', 'times', 'columns'])
+
+def iter_series(rows, time_format='datetime'):
+    """
+    Gather the `(columns, cells)` rows yielded by `iter_csv` into a `Series`
+    per Flux table, holding one table in memory at a time. Names have their
+    leading and trailing underscores stripped, as in the rows returned by
+    the cursor; tags are converted like row values, in `time_format`, and
+    times are `datetime64[ns]`, or integers for `epoch_ns`.
+    """
+    columns = table = None
+    cells_list = []
+    for row_columns, cells in rows:
+        row_table = cells[:2]
+        if row_columns is not columns or row_table != table:
+            if cells_list:
+                yield to_series(columns, cells_list, time_format)
+            columns, table, cells_list = row_columns, row_table, []
+        cells_list.append(cells)
+    if cells_list:
+        yield to_series(columns, cells_list, time_format)
+
+
+def to_series(columns, cells_list, time_format):
+    tags, times, values = {}, None, {}
+    for i, column in enumerate(columns):
+        if column.name in ('result', 'table'):
+            continue
+        name = column.name.strip('_')
+        if column.group:
+            tags[name] = get_parser(column, time_format)(cells_list[0][i])
+        elif column.name == '_time':
+            times = to_array([cells[i] for cells in cells_list], column)
+            if time_format == 'epoch_ns':
+                times = times.astype(np.int64)
+        else:
+            values[name] = to_array([cells[i] for cells in cells_list], column)
+    return Series(tags, times, values)
+
+
+def datetimes_to_objects(array):
+    return np.array([
+        None if np.isnat(value) else value for value in array], dtype=object)
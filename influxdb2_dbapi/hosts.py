@@ -0,0 +1,197 @@
+"""
+Spread the queries of a connection over several InfluxDB nodes.
+
+Each query goes to the healthy node with the fewest requests in flight,
+taking turns on ties. A node whose requests fail to connect, or get a
+server error, `EJECT_AFTER` times in a row is ejected; after
+`EJECT_SECONDS` it is probed with `/ping` in the background, and takes
+queries again once it answers. A query that fails on a node is retried on
+the others, unless it writes.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import logging
+import re
+import threading
+import time
+
+import requests
+from influxdb_client.rest import ApiException
+from urllib3.exceptions import HTTPError, TimeoutError
+
+logger = logging.getLogger(__name__)
+
+
+EJECT_AFTER = 2
+EJECT_SECONDS = 30
+PROBE_TIMEOUT = 5
+
+# Flux that writes, and so is not retried
+WRITES_RE = re.compile(r'\|>\s*(?:\w+\.)?to\s*\(|\bhttp\.post\s*\(')
+
+
+def parse_hosts(host, port):
+    """
+    Return the `(host, port)` of each node in `host`, a list or a
+    comma-separated string of `host[:port]`, where `port` is the default.
+    """
+    if isinstance(host, str):
+        host = host.split(',')
+    addresses = []
+    for entry in host:
+        entry = entry.strip()
+        if entry.startswith('['):
+            # [IPv6]:port
+            name, _, rest = entry[1:].partition(']')
+            addresses.append((f'[{name}]', int(rest[1:]) if rest.startswith(':') else port))
+        elif ':' in entry:
+            name, entry_port = entry.rsplit(':', 1)
+            addresses.append((name, int(entry_port)))
+        elif entry:
+            addresses.append((entry, port))
+    return addresses
+
+
+def writes(query):
+    """Tell whether the Flux `query` may write, so that it must not be retried."""
+    return WRITES_RE.search(query) is not None
+
+
+def is_node_error(error):
+    """
+    Tell whether a request failed because of the node rather than the query:
+    it could not connect or the server failed. Timeouts are left to the
+    query's deadline.
+    """
+    if isinstance(error, ApiException):
+        return error.status is not None and error.status >= 500
+    return isinstance(error, HTTPError) and not isinstance(error, TimeoutError)
+
+
+class Node(object):
+    """An InfluxDB node, with the client sending it queries."""
+
+    def __init__(self, url, client):
+        self.url = url
+        self.client = client
+        self.outstanding = 0
+        self.failures = 0
+        # when to probe the node next, while it is ejected
+        self.ejected_until = None
+        self.probing = False
+
+    def __repr__(self):
+        return f'Node({self.url!r})'
+
+
+class TrackedResponse(object):
+    """An HTTP response that calls `done` once closed."""
+
+    def __init__(self, response, done):
+        self.response = response
+        self._done = done
+
+    def __iter__(self):
+        return iter(self.response)
+
+    def stream(self, amt):
+        return self.response.stream(amt)
+
+    def close(self):
+        try:
+            self.response.close()
+        finally:
+            done, self._done = self._done, None
+            if done is not None:
+                done()
+
+    def __getattr__(self, name):
+        return getattr(self.response, name)
+
+
+class HostPool(object):
+    """The nodes of a connection, and the requests in flight on each."""
+
+    def __init__(self, nodes):
+        self.nodes = nodes
+        self._lock = threading.Lock()
+        self._turn = 0
+
+    def healthy(self):
+        """Return the nodes that are not ejected."""
+        with self._lock:
+            return [node for node in self.nodes if node.ejected_until is None]
+
+    def post(self, send, retry=True):
+        """
+        Return the response of `send(node)` for the node to query next; if it
+        fails because of the node, and `retry` is set, try the other nodes.
+        """
+        tried = []
+        while True:
+            node = self._acquire(tried)
+            tried.append(node)
+            try:
+                response = send(node)
+            except Exception as error:
+                self._done(node)
+                if not is_node_error(error):
+                    raise
+                self._failed(node)
+                if not retry or len(tried) == len(self.nodes):
+                    raise
+                logger.warning('Retrying on another node, %s failed: %s', node.url, error)
+                continue
+            with self._lock:
+                node.failures = 0
+            return TrackedResponse(response, lambda: self._done(node))
+
+    def _acquire(self, tried):
+        now = time.monotonic()
+        with self._lock:
+            candidates = [node for node in self.nodes if node not in tried]
+            for node in candidates:
+                if node.ejected_until is not None and not node.probing and now >= node.ejected_until:
+                    node.probing = True
+                    threading.Thread(target=self._probe, args=(node,), daemon=True).start()
+            # when every node is ejected, keep trying them all
+            healthy = [node for node in candidates if node.ejected_until is None] or candidates
+            fewest = min(node.outstanding for node in healthy)
+            least_loaded = [node for node in healthy if node.outstanding == fewest]
+            node = least_loaded[self._turn % len(least_loaded)]
+            self._turn += 1
+            node.outstanding += 1
+            return node
+
+    def _done(self, node):
+        with self._lock:
+            node.outstanding -= 1
+
+    def _failed(self, node):
+        with self._lock:
+            node.failures += 1
+            if node.failures >= EJECT_AFTER and node.ejected_until is None and len(self.nodes) > 1:
+                node.ejected_until = time.monotonic() + EJECT_SECONDS
+                logger.warning('Ejected %s after %d failures', node.url, node.failures)
+
+    def _probe(self, node):
+        try:
+            healthy = requests.get(f'{node.url}/ping', timeout=PROBE_TIMEOUT).ok
+        except requests.RequestException:
+            healthy = False
+        with self._lock:
+            node.probing = False
+            if healthy:
+                node.ejected_until = None
+                node.failures = 0
+                logger.info('%s is back', node.url)
+            else:
+                node.ejected_until = time.monotonic() + EJECT_SECONDS
+
+    def close(self):
+        for node in self.nodes:
+            node.client.close()
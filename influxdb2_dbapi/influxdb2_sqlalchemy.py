@@ -3,12 +3,17 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import datetime
+import re
+
+import pandas as pd
 from sqlalchemy.engine import default
-from sqlalchemy.sql import compiler
+from sqlalchemy.schema import Table
+from sqlalchemy.sql import compiler, elements, expression, functions, operators
 from sqlalchemy import types,util
 
 import influxdb2_dbapi as db
-from influxdb2_dbapi import exceptions
+from influxdb2_dbapi import admission, exceptions, flux
 from influxdb_client import OrganizationsService
 
 RESERVED_SCHEMAS = ['INFORMATION_SCHEMA']
@@ -106,8 +111,427 @@ class Influxdb2IdentifierPreparer(compiler.IdentifierPreparer):
     reserved_words = UniversalSet()
 
 
+# reflected measurement columns that stand for Flux columns starting with `_`
+FLUX_COLUMNS = {'start', 'stop', 'time', 'value', 'field', 'measurement'}
+
+# SQL aggregate functions and the Flux functions computing them
+FLUX_AGGREGATES = {
+    'count': 'count',
+    'sum': 'sum',
+    'avg': 'mean',
+    'mean': 'mean',
+    'median': 'median',
+    'min': 'min',
+    'max': 'max',
+    'first': 'first',
+    'last': 'last',
+}
+
+FLUX_COMPARISONS = {
+    operators.eq: '==',
+    operators.ne: '!=',
+    operators.lt: '<',
+    operators.le: '<=',
+    operators.gt: '>',
+    operators.ge: '>=',
+}
+
+# swap the operands of a comparison
+FLIPPED = {
+    operators.eq: operators.eq,
+    operators.ne: operators.ne,
+    operators.lt: operators.gt,
+    operators.le: operators.ge,
+    operators.gt: operators.lt,
+    operators.ge: operators.le,
+}
+
+# the windows of `date_trunc(unit, time)`
+DATE_TRUNC_UNITS = {
+    'second': '1s',
+    'minute': '1m',
+    'hour': '1h',
+    'day': '1d',
+    'week': '1w',
+    'month': '1mo',
+    'year': '1y',
+}
+
+
+def unwrap(element):
+    """Return the expression behind labels, parentheses and label references."""
+    while True:
+        if isinstance(element, (elements.Label, elements.Grouping, elements._label_reference)):
+            element = element.element
+        elif isinstance(element, elements.ClauseList) and len(element.clauses) == 1:
+            # how GROUP BY wraps functions
+            element = element.clauses[0]
+        else:
+            return element
+
+
+def to_ns(value):
+    """Return a SQL time literal in nanoseconds since the epoch, UTC if naive."""
+    try:
+        timestamp = pd.Timestamp(value)
+    except (TypeError, ValueError):
+        raise exceptions.NotSupportedError(f'Unsupported time {value!r}')
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.tz_convert('UTC').tz_localize(None)
+    return timestamp.value
+
+
+def like_to_regex(pattern, case_insensitive=False):
+    """Translate a LIKE `pattern` into a Flux regular expression literal."""
+    parts = []
+    for char in pattern:
+        if char == '%':
+            parts.append('.*')
+        elif char == '_':
+            parts.append('.')
+        else:
+            parts.append(re.escape(char))
+    regex = ''.join(parts).replace('/', '\\/')
+    return f'/{"(?i)" if case_insensitive else ""}^{regex}$/'
+
+
+class FluxSubquery(expression.TableClause):
+    """A Flux query in the FROM clause of the SQL naming its columns."""
+
+    __visit_name__ = 'flux_subquery'
+
+    def __init__(self, query, names):
+        super(FluxSubquery, self).__init__(
+            'flux', *[expression.column(name) for name in names])
+        self.query = query
+
+
+class FluxSelect(object):
+    """
+    Translate a SELECT over the `table` of a measurement, reflected in the
+    schema named after its bucket, into a Flux pipeline.
+
+    Comparisons of the time column with literals, AND-ed at the top level,
+    become the `range()`; other criteria are `filter()`ed. Aggregates are
+    computed per group of tags, and per window when grouped by
+    `date_trunc(unit, time)` or `time_bucket(duration, time)`. `ORDER BY` and
+    `LIMIT` apply to the whole result. Anything else raises
+    `NotSupportedError`.
+    """
+
+    def __init__(self, select, table):
+        self.select = select
+        self.table = table
+        self.labels = {}
+        for column in select.selected_columns:
+            if isinstance(column, elements.Label):
+                self.labels[column.name] = column.element
+
+    def is_column(self, element):
+        return isinstance(element, expression.ColumnClause) and element.table is self.table
+
+    def is_aggregate(self, element):
+        return (
+            isinstance(element, functions.FunctionElement) and
+            element.name.lower() in FLUX_AGGREGATES)
+
+    def get_window(self, element):
+        """Return the window of a time bucket function, or `None`."""
+        if not isinstance(element, functions.FunctionElement):
+            return None
+        name = element.name.lower()
+        if name not in ('date_trunc', 'time_bucket'):
+            return None
+        arguments = [unwrap(argument) for argument in element.clauses]
+        if (
+            len(arguments) != 2 or
+            not isinstance(arguments[0], elements.BindParameter) or
+            not self.is_column(arguments[1]) or
+            self.get_name(arguments[1]) != '_time'
+        ):
+            raise exceptions.NotSupportedError(f'Unsupported {name}()')
+        unit = str(arguments[0].effective_value).lower()
+        if name == 'date_trunc':
+            if unit not in DATE_TRUNC_UNITS:
+                raise exceptions.NotSupportedError(f'Unsupported date_trunc unit {unit!r}')
+            return DATE_TRUNC_UNITS[unit]
+        if not flux.DURATION_RE.fullmatch(unit):
+            raise exceptions.NotSupportedError(f'Unsupported time_bucket width {unit!r}')
+        return unit
+
+    def get_name(self, column):
+        """Return the Flux name of a reflected measurement `column`."""
+        return f'_{column.name}' if column.name in FLUX_COLUMNS else column.name
+
+    def get_aggregate(self, function):
+        """Return the `(flux function, column)` computing an aggregate."""
+        arguments = [unwrap(argument) for argument in function.clauses]
+        if not arguments or (
+                len(arguments) == 1 and isinstance(arguments[0], elements.ColumnClause)
+                and arguments[0].name == '*'):
+            column = '_value'
+        elif len(arguments) == 1 and self.is_column(arguments[0]):
+            column = self.get_name(arguments[0])
+        else:
+            raise exceptions.NotSupportedError(f'Unsupported {function.name}() arguments')
+        return FLUX_AGGREGATES[function.name.lower()], column
+
+    def resolve(self, element):
+        element = unwrap(element)
+        if isinstance(element, elements._textual_label_reference):
+            if element.element not in self.labels:
+                raise exceptions.NotSupportedError(f'Unknown label {element.element!r}')
+            element = unwrap(self.labels[element.element])
+        return element
+
+    def output(self, element, aggregate):
+        """Return the Flux column holding the values of a selected `element`."""
+        element = self.resolve(element)
+        if self.is_aggregate(element):
+            return self.get_aggregate(element)[1]
+        if self.get_window(element) is not None:
+            return '_time'
+        if self.is_column(element):
+            name = self.get_name(element)
+            if aggregate is not None and name not in self.group + [aggregate[1]]:
+                raise exceptions.NotSupportedError(
+                    f'Column {element.name!r} must be grouped by or aggregated')
+            return name
+        raise exceptions.NotSupportedError(f'Unsupported expression {element}')
+
+    def literal(self, value, time=False):
+        if time or isinstance(value, (datetime.date, pd.Timestamp)):
+            return flux.format_time(to_ns(value))
+        if isinstance(value, bool):
+            return 'true' if value else 'false'
+        if isinstance(value, (int, float)):
+            return repr(value)
+        if isinstance(value, str):
+            return flux.format_string(value)
+        raise exceptions.NotSupportedError(f'Unsupported value {value!r}')
+
+    def operand(self, element, time=False):
+        element = unwrap(element)
+        if self.is_column(element):
+            return f'r.{self.get_name(element)}'
+        if isinstance(element, elements.BindParameter):
+            return self.literal(element.effective_value, time)
+        if isinstance(element, (elements.True_, elements.False_)):
+            return 'true' if isinstance(element, elements.True_) else 'false'
+        raise exceptions.NotSupportedError(f'Unsupported operand {element}')
+
+    def is_time(self, element):
+        element = unwrap(element)
+        return self.is_column(element) and self.get_name(element) == '_time'
+
+    def predicate(self, clause):
+        """Translate a SQL criterion into a Flux predicate on `r`."""
+        clause = unwrap(clause)
+        if isinstance(clause, elements.BooleanClauseList):
+            joiner = {operators.and_: ' and ', operators.or_: ' or '}.get(clause.operator)
+            if joiner is None:
+                raise exceptions.NotSupportedError(f'Unsupported criterion {clause}')
+            return '(' + joiner.join(self.predicate(c) for c in clause.clauses) + ')'
+        if isinstance(clause, elements.UnaryExpression) and clause.operator is operators.inv:
+            return f'not {self.predicate(clause.element)}'
+        if not isinstance(clause, elements.BinaryExpression):
+            raise exceptions.NotSupportedError(f'Unsupported criterion {clause}')
+
+        left, right, op = clause.left, clause.right, clause.operator
+        time = self.is_time(left) or self.is_time(right)
+        if op in FLUX_COMPARISONS:
+            return (
+                f'{self.operand(left, time)} {FLUX_COMPARISONS[op]} '
+                f'{self.operand(right, time)}')
+        if op in (operators.is_, operators.is_not) and isinstance(right, elements.Null):
+            exists = f'exists {self.operand(left)}'
+            return f'not {exists}' if op is operators.is_ else exists
+        if op in (operators.in_op, operators.not_in_op):
+            values = ', '.join(self.literal(value, time) for value in right.effective_value)
+            contains = f'contains(value: {self.operand(left)}, set: [{values}])'
+            return f'not {contains}' if op is operators.not_in_op else contains
+        if op in (operators.between_op, operators.not_between_op):
+            low, high = right.clauses
+            between = (
+                f'({self.operand(left)} >= {self.operand(low, time)} and '
+                f'{self.operand(left)} <= {self.operand(high, time)})')
+            return f'not {between}' if op is operators.not_between_op else between
+        if op in (operators.like_op, operators.not_like_op,
+                  operators.ilike_op, operators.not_ilike_op):
+            if not isinstance(right, elements.BindParameter):
+                raise exceptions.NotSupportedError('Unsupported LIKE pattern')
+            regex = like_to_regex(
+                right.effective_value, op in (operators.ilike_op, operators.not_ilike_op))
+            match = '!~' if op in (operators.not_like_op, operators.not_ilike_op) else '=~'
+            return f'{self.operand(left)} {match} {regex}'
+        raise exceptions.NotSupportedError(f'Unsupported criterion {clause}')
+
+    def criteria(self):
+        """Yield the top-level criteria of the WHERE clause that are AND-ed."""
+        pending = list(self.select._where_criteria)
+        while pending:
+            clause = unwrap(pending.pop(0))
+            if isinstance(clause, elements.BooleanClauseList) and clause.operator is operators.and_:
+                pending[:0] = clause.clauses
+            else:
+                yield clause
+
+    def time_bounds(self, clause):
+        """
+        Return the `[(op, ns)]` bounds that a criterion sets on the time, or
+        `None` when it is not a comparison of the time with literals.
+        """
+        if not isinstance(clause, elements.BinaryExpression):
+            return None
+        left, right, op = unwrap(clause.left), unwrap(clause.right), clause.operator
+        if self.is_time(right) and op in FLIPPED:
+            left, right, op = right, left, FLIPPED[op]
+        if not self.is_time(left):
+            return None
+        if op is operators.between_op:
+            low, high = [unwrap(bound) for bound in right.clauses]
+            if isinstance(low, elements.BindParameter) and isinstance(high, elements.BindParameter):
+                return [
+                    (operators.ge, to_ns(low.effective_value)),
+                    (operators.le, to_ns(high.effective_value))]
+            return None
+        if op in FLUX_COMPARISONS and op is not operators.ne and isinstance(right, elements.BindParameter):
+            if op is operators.eq:
+                value = to_ns(right.effective_value)
+                return [(operators.ge, value), (operators.le, value)]
+            return [(op, to_ns(right.effective_value))]
+        return None
+
+    def compile(self):
+        """Return the Flux query and the Flux column of each selected column."""
+        select = self.select
+        if select._having_criteria or select._distinct or select._offset_clause is not None and select._limit_clause is None:
+            raise exceptions.NotSupportedError('HAVING, DISTINCT and OFFSET without LIMIT are not supported')
+
+        # the range covers [start, stop)
+        start = stop = None
+        filters = []
+        for clause in self.criteria():
+            bounds = self.time_bounds(clause)
+            if bounds is None:
+                filters.append(self.predicate(clause))
+                continue
+            for op, value in bounds:
+                if op in (operators.gt, operators.ge):
+                    value += op is operators.gt
+                    start = value if start is None else max(start, value)
+                else:
+                    value += op is operators.le
+                    stop = value if stop is None else min(stop, value)
+
+        self.group, windows = [], []
+        for element in select._group_by_clauses:
+            element = self.resolve(element)
+            window = self.get_window(element)
+            if window is not None:
+                windows.append(window)
+            elif self.is_column(element):
+                self.group.append(self.get_name(element))
+            else:
+                raise exceptions.NotSupportedError(f'Unsupported GROUP BY {element}')
+        if len(set(windows)) > 1:
+            raise exceptions.NotSupportedError('Only one time bucket is supported')
+
+        aggregates = {
+            self.get_aggregate(element)
+            for element in map(self.resolve, select.selected_columns)
+            if self.is_aggregate(element)}
+        if len(aggregates) > 1:
+            raise exceptions.NotSupportedError('Only one aggregate is supported')
+        aggregate = aggregates.pop() if aggregates else None
+        if aggregate is None and (self.group or windows):
+            raise exceptions.NotSupportedError('GROUP BY needs an aggregate')
+
+        outputs = [self.output(element, aggregate) for element in select.selected_columns]
+        order = []
+        for element in select._order_by_clauses:
+            descending = False
+            element = unwrap(element)
+            if isinstance(element, elements.UnaryExpression) and element.modifier in (
+                    operators.desc_op, operators.asc_op):
+                descending = element.modifier is operators.desc_op
+                element = element.element
+            order.append((self.output(element, aggregate), descending))
+        if len({descending for _, descending in order}) > 1:
+            raise exceptions.NotSupportedError('ORDER BY must sort all columns the same way')
+
+        bounds = f'start: {flux.format_time(start or 0)}'
+        if stop is not None:
+            bounds += f', stop: {flux.format_time(stop)}'
+        stages = [
+            f'from(bucket: {flux.format_string(self.table.schema)})',
+            f'range({bounds})',
+            f'filter(fn: (r) => r._measurement == {flux.format_string(self.table.name)})',
+        ]
+        stages.extend(f'filter(fn: (r) => {predicate})' for predicate in filters)
+
+        keep = [name for name in outputs + [name for name, _ in order] if name not in ('result', 'table')]
+        if aggregate is not None:
+            function, column = aggregate
+            keep = self.group + [column] + (['_start', '_stop', '_time'] if windows else [])
+        stages.append(f'keep(columns: {format_list(dict.fromkeys(keep))})')
+        if aggregate is not None:
+            stages.append(f'group(columns: {format_list(self.group)})')
+            if windows:
+                stages.append(
+                    f'aggregateWindow(every: {windows[0]}, fn: {function}, '
+                    f'column: {flux.format_string(column)}, timeSrc: "_start", createEmpty: false)')
+            else:
+                stages.append(f'{function}(column: {flux.format_string(column)})')
+
+        limit = select._limit
+        if order or limit is not None:
+            # sort and limit all the series as one table
+            stages.append('group()')
+        if order:
+            stages.append(
+                f'sort(columns: {format_list(dict.fromkeys(name for name, _ in order))}, '
+                f'desc: {"true" if order[0][1] else "false"})')
+        if limit is not None:
+            stages.append(f'limit(n: {limit}, offset: {select._offset or 0})')
+        return '\n  |> '.join(stages), outputs
+
+
+def format_list(names):
+    """Format `names` as a Flux array of strings."""
+    return '[' + ', '.join(flux.format_string(name) for name in names) + ']'
+
+
 class Influxdb2Compiler(compiler.SQLCompiler):
-    pass
+    """
+    Compiles SELECTs over a single measurement, reflected in the schema named
+    after its bucket, to Flux that filters, aggregates, sorts and limits in
+    InfluxDB, wrapped in SQL that only names its columns, which the cursor
+    runs over the results in process. Other statements compile to SQL.
+
+    Literals are rendered in the Flux, which is why the dialect does not
+    enable the statement cache.
+    """
+
+    def translate_select_structure(self, select_stmt, asfrom=False, **kwargs):
+        if self.stack or asfrom:
+            return select_stmt
+        froms = select_stmt.get_final_froms()
+        if len(froms) != 1 or not isinstance(froms[0], Table) or froms[0].schema is None:
+            return select_stmt
+        query, outputs = FluxSelect(select_stmt, froms[0]).compile()
+        subquery = FluxSubquery(query, dict.fromkeys(name.strip('_') for name in outputs))
+        columns = [
+            subquery.c[output.strip('_')].label(name or fallback_label_name)
+            for output, (name, _, fallback_label_name, _, _) in zip(
+                outputs, select_stmt._generate_columns_plus_names(True))
+        ]
+        return expression.select(*columns).select_from(subquery)
+
+    def visit_flux_subquery(self, subquery, asfrom=False, **kwargs):
+        # the DB API applies parameters with `%`
+        query = subquery.query.replace('%', '%%')
+        return f'({query}) AS {self.preparer.quote(subquery.name)}'
 
 
 class Influxdb2TypeCompiler(compiler.GenericTypeCompiler):
@@ -155,6 +579,12 @@ class Influxdb2TypeCompiler(compiler.GenericTypeCompiler):
         raise exceptions.NotSupportedError('Type NCBLOB is not supported')
 
 
+class Influxdb2ExecutionContext(default.DefaultExecutionContext):
+
+    def create_server_side_cursor(self):
+        return self._dbapi_connection.cursor(server_side=True)
+
+
 class Influxdb2Dialect(default.DefaultDialect):
 
     name = 'influxdb2'
@@ -162,6 +592,7 @@ class Influxdb2Dialect(default.DefaultDialect):
     driver = 'rest'
     preparer = Influxdb2IdentifierPreparer
     statement_compiler = Influxdb2Compiler
+    execution_ctx_cls = Influxdb2ExecutionContext
     type_compiler = Influxdb2TypeCompiler
     supports_alter = False
     supports_pk_autoincrement = False
@@ -172,6 +603,10 @@ class Influxdb2Dialect(default.DefaultDialect):
     returns_unicode_strings = True
     description_encoding = None
     supports_native_boolean = True
+    supports_server_side_cursors = True
+    # statements compile to Flux with their parameters inlined, which the
+    # cache keys do not account for
+    supports_statement_cache = False
     _has_events = True
 
     @classmethod
@@ -190,6 +625,39 @@ class Influxdb2Dialect(default.DefaultDialect):
             'password': url.password,
             'trusted_connection': url.query.get("trusted_connection") == "yes"
         }
+        if 'hosts' in url.query:
+            # nodes with different ports, which the netloc can't list
+            kwargs['host'] = url.query['hosts']
+        if 'timeout' in url.query:
+            kwargs['timeout'] = float(url.query['timeout'])
+        if 'cache' in url.query:
+            kwargs['cache'] = url.query['cache']
+        if 'max_points_per_series' in url.query:
+            kwargs['max_points_per_series'] = int(url.query['max_points_per_series'])
+        if 'single_flight' in url.query:
+            kwargs['single_flight'] = url.query['single_flight'] == 'yes'
+        if 'time_format' in url.query:
+            kwargs['time_format'] = url.query['time_format']
+        if 'rowcount_query' in url.query:
+            kwargs['rowcount_query'] = url.query['rowcount_query'] == 'yes'
+        if 'decode_processes' in url.query:
+            kwargs['decode_processes'] = int(url.query['decode_processes'])
+        if 'memory_budget' in url.query:
+            kwargs['memory_budget'] = int(url.query['memory_budget'])
+        if 'max_concurrent_queries' in url.query:
+            kwargs['max_concurrent_queries'] = int(url.query['max_concurrent_queries'])
+        if 'queue_timeout' in url.query:
+            kwargs['queue_timeout'] = float(url.query['queue_timeout'])
+        if 'optimize_flux' in url.query:
+            kwargs['optimize_flux'] = url.query['optimize_flux'] == 'yes'
+        if 'record' in url.query:
+            kwargs['record'] = url.query['record']
+        if 'replay' in url.query:
+            kwargs['replay'] = url.query['replay']
+        if 'replay_speed' in url.query:
+            kwargs['replay_speed'] = float(url.query['replay_speed'])
+        if 'prefetch' in url.query:
+            kwargs['prefetch'] = int(url.query['prefetch'])
         return ([], kwargs)
 
     def get_schema_names(self, connection, **kwargs):
@@ -217,7 +685,7 @@ class Influxdb2Dialect(default.DefaultDialect):
         curs.execute(f""" 
                     import "influxdata/influxdb/schema"
                     buckets() 
-                """)
+                """, priority=admission.BACKGROUND)
         return [row.name  for row in curs ]
 
     def has_table(self, connection, table_name, schema=None):
@@ -242,7 +710,7 @@ class Influxdb2Dialect(default.DefaultDialect):
         curs.execute(f""" 
                             import "influxdata/influxdb/schema"
                             schema.measurements(bucket: "collectd") 
-                        """)
+                        """, priority=admission.BACKGROUND)
         return [row.value  for row in curs ]
     def get_view_names(self, connection, schema=None, **kwargs):
         return []
@@ -263,7 +731,7 @@ class Influxdb2Dialect(default.DefaultDialect):
 
             )as qry
              LIMIT 10
-        """)
+        """, priority=admission.BACKGROUND)
         for row in curs:
             return [
                 {
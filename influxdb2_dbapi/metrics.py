@@ -0,0 +1,179 @@
+"""
+Metrics about the driver, kept in the process.
+
+`render` returns them in the Prometheus text format, e.g. to serve on a
+`/metrics` endpoint; other systems can be fed with `add_exporter`, whose
+exporters are called with the `collect`ed metrics on every `export`.
+
+Updates take a lock and a few additions, and are made per query rather than
+per row, so that they don't slow queries down.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import bisect
+from collections import namedtuple
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+PREFIX = 'influxdb2_dbapi_'
+
+# bounds of the buckets of latency histograms, in seconds
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# a metric as collected: `samples` are `(name, labels, value)`, where
+# `labels` is a tuple of `(label, value)`
+Metric = namedtuple('Metric', ['name', 'kind', 'help', 'samples'])
+
+
+class Counter(object):
+    """A value that only goes up."""
+
+    kind = 'counter'
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def collect(self):
+        return Metric(self.name, self.kind, self.help, [(self.name, (), self.value)])
+
+
+class Gauge(Counter):
+    """A value that goes up and down."""
+
+    kind = 'gauge'
+
+    def dec(self, amount=1):
+        with self._lock:
+            self.value -= amount
+
+
+class Histogram(object):
+    """Counts of observations, by bucket, with their sum."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        # the last count is for observations over every bound
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def collect(self):
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), counts):
+            cumulative += count
+            samples.append((f'{self.name}_bucket', (('le', format_value(bound)),), cumulative))
+        samples.append((f'{self.name}_sum', (), total))
+        samples.append((f'{self.name}_count', (), cumulative))
+        return Metric(self.name, self.kind, self.help, samples)
+
+
+def format_value(value):
+    return value if isinstance(value, str) else repr(value)
+
+
+class Registry(object):
+    """The metrics of the process, and the exporters they are pushed to."""
+
+    def __init__(self):
+        self.metrics = []
+        self.exporters = []
+
+    def counter(self, name, help):
+        return self.register(Counter(PREFIX + name, help))
+
+    def gauge(self, name, help):
+        return self.register(Gauge(PREFIX + name, help))
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(PREFIX + name, help, buckets))
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def collect(self):
+        """Return a `Metric` for each metric."""
+        return [metric.collect() for metric in self.metrics]
+
+    def render(self):
+        """Return the metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self.collect():
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in metric.samples:
+                if labels:
+                    name += '{%s}' % ','.join(f'{label}="{text}"' for label, text in labels)
+                lines.append(f'{name} {format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+    def add_exporter(self, exporter):
+        """Call `exporter` with the `collect`ed metrics on every `export`."""
+        self.exporters.append(exporter)
+
+    def remove_exporter(self, exporter):
+        self.exporters.remove(exporter)
+
+    def export(self):
+        """Push the metrics to every exporter; failing exporters are logged."""
+        metrics = self.collect()
+        for exporter in list(self.exporters):
+            try:
+                exporter(metrics)
+            except Exception:
+                logger.warning('Metrics exporter %r failed', exporter, exc_info=True)
+
+
+REGISTRY = Registry()
+
+collect = REGISTRY.collect
+render = REGISTRY.render
+add_exporter = REGISTRY.add_exporter
+remove_exporter = REGISTRY.remove_exporter
+export = REGISTRY.export
+
+QUERIES = REGISTRY.counter('queries_total', 'Flux queries run.')
+QUERY_ERRORS = REGISTRY.counter(
+    'query_errors_total', 'Flux queries that failed, other than cancelled or timed out.')
+CANCELLATIONS = REGISTRY.counter('cancellations_total', 'Queries cancelled in flight.')
+TIMEOUTS = REGISTRY.counter('timeouts_total', 'Queries that exceeded their timeout.')
+QUERIES_IN_FLIGHT = REGISTRY.gauge('queries_in_flight', 'Flux responses being read.')
+QUERY_SECONDS = REGISTRY.histogram(
+    'query_seconds', 'Seconds from sending a Flux query to the end of its results.')
+TIME_TO_FIRST_BYTE = REGISTRY.histogram(
+    'time_to_first_byte_seconds', 'Seconds from sending a Flux query to its response.')
+ROWS = REGISTRY.counter('rows_total', 'Rows fetched from cursors.')
+RESPONSE_BYTES = REGISTRY.counter('response_bytes_total', 'Bytes received from InfluxDB.')
+SQLITE_FALLBACKS = REGISTRY.counter(
+    'sqlite_fallbacks_total', 'SQL wrapping Flux that was run on SQLite.')
+CURSORS = REGISTRY.counter('cursors_total', 'Cursors created.')
+CURSORS_OPEN = REGISTRY.gauge('cursors_open', 'Cursors not closed yet.')
+CONNECTIONS_OPEN = REGISTRY.gauge('connections_open', 'Connections not closed yet.')
@@ -0,0 +1,333 @@
+"""
+Rewrite Flux pipelines so that InfluxDB can push their work down to storage.
+
+`from() |> range() |> filter()` only reads the matching series, but a
+`filter()` written after a `map()` or a `pivot()`, or a `range()` written
+after a `filter()`, runs over every point of the bucket. `optimize` moves
+`range`, `filter`, `keep` and `drop` stages up past the stages they provably
+commute with, judging from the columns each one reads and writes; filters
+are split on their top-level `and`s so that the parts that can move do, and
+the filters that end up next to each other are merged. Anything it can't
+reason about stays where it is.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from collections import namedtuple
+import re
+
+from . import flux
+
+
+IDENTIFIER_RE = re.compile(r'[A-Za-z_]\w*')
+NUMBER_RE = re.compile(r'[\w.]+')
+# a regex literal may start after these operators
+REGEX_OPERATOR_RE = re.compile(r'[=!]~\s*$')
+# `.name` or `["name"]`, after a record
+MEMBER_RE = re.compile(r'\s*(?:\.\s*([A-Za-z_]\w*)|\[\s*"((?:[^"\\]|\\.)*)"\s*\])')
+FUNCTION_RE = re.compile(r'^\(\s*([A-Za-z_]\w*)\s*\)\s*=>\s*(.*)$', re.S)
+WITH_RE = re.compile(r'^\(?\s*\{\s*([A-Za-z_]\w*)\s+with\s+(.*)\}\s*\)?$', re.S)
+STRING_RE = re.compile(r'"((?:[^"\\]|\\.)*)"')
+KEY_RE = re.compile(r'^\s*(?:([A-Za-z_]\w*)|"((?:[^"\\]|\\.)*)")\s*$')
+
+# columns that `range()` reads or writes
+TIME_COLUMNS = frozenset(['_time', '_start', '_stop'])
+
+# a stage of the pipeline: `columns` are those `keep` or `drop` list, those
+# `map` writes, `fill` fills or `rename` renames from and to, and `reads`
+# those `map` reads; `None` when unknown
+Stage = namedtuple('Stage', ['function', 'text', 'columns', 'reads'])
+
+# a conjunct of a `filter()`, with the columns it reads (`None` if unknown),
+# the other arguments of the filter and the stage it comes from
+Filter = namedtuple('Filter', ['param', 'predicate', 'columns', 'extra', 'origin'])
+
+
+def skip_regex(text, i):
+    """Return the position after the regex literal starting at `text[i]`."""
+    i += 1
+    while i < len(text):
+        if text[i] == '\\':
+            i += 2
+        elif text[i] == '/':
+            return i + 1
+        else:
+            i += 1
+    return i
+
+
+def iter_tokens(text):
+    """
+    Yield `(start, end, depth)` for the identifiers and punctuation of the
+    Flux `text`, outside string and regex literals, with their nesting depth.
+    """
+    depth = i = 0
+    while i < len(text):
+        char = text[i]
+        if char == '"':
+            i = flux.skip_string(text, i)
+        elif char == '/' and REGEX_OPERATOR_RE.search(text, 0, i):
+            i = skip_regex(text, i)
+        elif char.isalpha() or char == '_':
+            end = IDENTIFIER_RE.match(text, i).end()
+            yield i, end, depth
+            i = end
+        elif char.isdigit():
+            i = NUMBER_RE.match(text, i).end()
+        elif char.isspace():
+            i += 1
+        else:
+            if char in ')]}':
+                depth -= 1
+            yield i, i + 1, depth
+            if char in '([{':
+                depth += 1
+            i += 1
+
+
+def split_top(text, separator):
+    """Split `text` on the `separator` words or characters at depth 0."""
+    parts, begin = [], 0
+    for start, end, depth in iter_tokens(text):
+        if depth == 0 and text[start:end] == separator:
+            parts.append(text[begin:start])
+            begin = end
+    parts.append(text[begin:])
+    return [part.strip() for part in parts]
+
+
+def is_loose(predicate):
+    """Tell whether `predicate` needs parentheses to be `and`-ed."""
+    return any(
+        depth == 0 and predicate[start:end] in ('or', 'if')
+        for start, end, depth in iter_tokens(predicate))
+
+
+def get_references(body, param):
+    """
+    Return the columns that the Flux `body` reads from the record `param`,
+    or `None` if it uses the record otherwise, e.g. passes it to a function.
+    """
+    columns = set()
+    for start, end, _ in iter_tokens(body):
+        if body[start:end] != param or (start and body[start - 1] == '.'):
+            continue
+        match = MEMBER_RE.match(body, end)
+        if match is None:
+            return None
+        columns.add(match.group(1) or match.group(2))
+    return columns
+
+
+def get_strings(text):
+    """Return the strings of a Flux array literal of strings, or `None`."""
+    text = text.strip()
+    if not (text.startswith('[') and text.endswith(']')):
+        return None
+    if STRING_RE.sub('', text[1:-1]).replace(',', '').strip():
+        return None
+    return set(STRING_RE.findall(text[1:-1]))
+
+
+def parse_stage(text, origin):
+    """Parse a stage of the pipeline into a `Stage`, or `Filter`s."""
+    function = flux.get_function(text)
+    if function not in ('filter', 'keep', 'drop', 'map', 'rename', 'fill'):
+        return [Stage(function, text, None, None)]
+    arguments = flux.get_arguments(text)
+    if function in ('keep', 'drop'):
+        return [Stage(function, text, get_strings(arguments.get('columns', '')), None)]
+    if function == 'rename':
+        return [Stage(function, text, get_renamed(arguments.get('columns', '')), None)]
+    if function == 'fill':
+        column = None
+        if arguments.get('usePrevious', 'false') == 'false':
+            column = STRING_RE.findall(arguments.get('column', '"_value"'))[:1]
+        return [Stage(function, text, set(column) if column else None, None)]
+
+    match = FUNCTION_RE.match(arguments.get('fn', ''))
+    if match is None:
+        return [Stage(function, text, None, None)]
+    param, body = match.groups()
+    if function == 'map':
+        return [parse_map(text, param, body)]
+    extra = tuple(sorted(
+        (name, value) for name, value in arguments.items() if name != 'fn'))
+    predicates = [body.strip()] if is_loose(body) else split_top(body, 'and')
+    return [
+        Filter(param, predicate, get_references(predicate, param), extra, origin)
+        for predicate in predicates
+    ]
+
+
+def get_renamed(text):
+    """Return the columns a `rename(columns: {...})` renames from and to."""
+    text = text.strip()
+    if not (text.startswith('{') and text.endswith('}')):
+        return None
+    columns = set()
+    for part in split_top(text[1:-1], ','):
+        if not part:
+            continue
+        key, _, value = part.partition(':')
+        key, value = KEY_RE.match(key), STRING_RE.fullmatch(value.strip())
+        if key is None or value is None:
+            return None
+        columns.update([key.group(1) or key.group(2), value.group(1)])
+    return columns
+
+
+def parse_map(text, param, body):
+    """Parse a `map()` of the `{r with ...}` form, that only sets columns."""
+    match = WITH_RE.match(body.strip())
+    if match is None or match.group(1) != param:
+        return Stage('map', text, None, None)
+    columns, reads = set(), set()
+    for part in split_top(match.group(2), ','):
+        if not part:
+            continue
+        key, _, value = part.partition(':')
+        key = KEY_RE.match(key)
+        references = get_references(value, param)
+        if key is None or references is None:
+            return Stage('map', text, None, None)
+        columns.add(key.group(1) or key.group(2))
+        reads |= references
+    return Stage('map', text, columns, reads)
+
+
+def is_movable(stage):
+    if isinstance(stage, Filter):
+        return stage.columns is not None
+    return stage.function == 'range' or (
+        stage.function in ('keep', 'drop') and stage.columns is not None)
+
+
+def can_cross(stage, barrier):
+    """Tell whether the movable `stage` gives the same results before `barrier`."""
+    if isinstance(stage, Filter):
+        columns = stage.columns
+        if isinstance(barrier, Filter):
+            return barrier.extra == stage.extra
+        if barrier.columns is None:
+            return barrier.function == 'pivot' and columns <= {'_measurement'} \
+                and '_measurement' not in barrier.text
+        if barrier.function == 'keep':
+            return columns <= barrier.columns
+        return barrier.function in ('drop', 'map', 'rename', 'fill') \
+            and not columns & barrier.columns
+    if stage.function == 'range':
+        if isinstance(barrier, Filter):
+            return barrier.columns is not None and not barrier.columns & TIME_COLUMNS
+        return barrier.function == 'drop' and barrier.columns is not None \
+            and not barrier.columns & TIME_COLUMNS
+    if isinstance(barrier, Filter) or barrier.function != 'map' or barrier.reads is None:
+        return False
+    if stage.function == 'keep':
+        return barrier.columns | barrier.reads <= stage.columns
+    return not stage.columns & (barrier.columns | barrier.reads)
+
+
+def get_name(stage):
+    return 'filter' if isinstance(stage, Filter) else stage.function
+
+
+def render(group, stages):
+    """Return the text of a run of `Filter`s, merged into one stage."""
+    first = group[0]
+    origin = first.origin
+    if all(part.origin == origin for part in group) and \
+            [part.predicate for part in group] == \
+            [part.predicate for part in stages if isinstance(part, Filter) and part.origin == origin]:
+        return None
+    predicates = ' and '.join(
+        f'({part.predicate})' if is_loose(part.predicate) else part.predicate
+        for part in group)
+    extra = ''.join(f', {name}: {value}' for name, value in first.extra)
+    return f'filter(fn: ({first.param}) => {predicates}{extra})'
+
+
+def optimize(query):
+    """
+    Rewrite the Flux `query` so that more of it is pushed down to storage.
+
+    Return the query, the rewrites applied and warnings about what still
+    can't be pushed down, e.g. `filter()` after `pivot()`; the query is
+    returned as is if it is not a single pipeline from `from()`.
+    """
+    try:
+        texts = flux.split_pipeline(query)
+        if flux.get_function(texts[0]) != 'from':
+            return query, [], []
+        original = [
+            stage for origin, text in enumerate(texts[1:])
+            for stage in parse_stage(text, origin)]
+    except Exception:
+        return query, [], []
+
+    stages = list(original)
+    rewrites = []
+    for stage in original:
+        if not is_movable(stage):
+            continue
+        position = target = next(i for i, other in enumerate(stages) if other is stage)
+        while target > 0 and can_cross(stage, stages[target - 1]):
+            target -= 1
+        # stay after the filters it lands next to, rather than reorder them
+        while target < position and isinstance(stage, Filter) \
+                and isinstance(stages[target], Filter):
+            target += 1
+        for barrier in stages[target:position]:
+            if not (isinstance(stage, Filter) and isinstance(barrier, Filter)):
+                rewrite = f'moved {get_name(stage)}() before {get_name(barrier)}()'
+                if rewrite not in rewrites:
+                    rewrites.append(rewrite)
+        stages[target:position + 1] = [stage] + stages[target:position]
+
+    # merge the runs of filters with the same parameter and arguments
+    output = [texts[0]]
+    i = 0
+    while i < len(stages):
+        stage = stages[i]
+        if not isinstance(stage, Filter):
+            output.append(stage.text)
+            i += 1
+            continue
+        group = [stage]
+        while i + len(group) < len(stages):
+            following = stages[i + len(group)]
+            if not isinstance(following, Filter) or following.param != stage.param \
+                    or following.extra != stage.extra:
+                break
+            group.append(following)
+        origins = {part.origin for part in group}
+        if len(origins) > 1:
+            rewrites.append(f'merged {len(origins)} filter()s')
+        text = render(group, original)
+        output.append(text if text is not None else texts[stage.origin + 1])
+        i += len(group)
+
+    if output == texts:
+        return query, [], get_warnings(texts)
+    return '\n  |> '.join(output), rewrites, get_warnings(output)
+
+
+def get_warnings(texts):
+    """Return warnings about the stages of a pipeline that storage can't run."""
+    functions = [flux.get_function(text) for text in texts]
+    warnings = []
+    if 'range' not in functions:
+        warnings.append('from() without range() reads the whole bucket')
+    elif functions[1] != 'range':
+        warnings.append('range() does not follow from(), so storage reads the whole bucket')
+    barrier = None
+    for function in functions[1:]:
+        if barrier is None and function not in ('range', 'filter'):
+            barrier = function
+        elif barrier is not None and function == 'filter':
+            warnings.append(f'filter() after {barrier}() runs over every point read')
+            break
+    return warnings
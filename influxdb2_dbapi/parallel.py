@@ -0,0 +1,132 @@
+"""
+Decode large Flux responses in a pool of processes.
+
+The annotated CSV of a response is cut into segments of a few megabytes, at
+row boundaries, and each segment is prefixed with the annotations and the
+header row of the table it starts in, so that it can be decoded on its own.
+Segments are decoded into NumPy arrays by `flux.read_blocks` in the pool,
+while the response is still being read, and the blocks are returned in
+order.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from collections import deque
+import itertools
+
+from . import flux
+
+
+SEGMENT_SIZE = 4 * 1024 * 1024
+
+
+def is_row_end(data, i):
+    """Tell whether the newline at `data[i]` ends a row, outside quotes."""
+    return data.count(b'"', 0, i) % 2 == 0
+
+
+def find_row_end(data, end):
+    """Return the position of the last newline before `end` ending a row, or -1."""
+    i = data.rfind(b'\n', 0, end)
+    while i != -1 and not is_row_end(data, i):
+        i = data.rfind(b'\n', 0, i)
+    return i
+
+
+def find_cut(data):
+    """
+    Return the position of the last row boundary of `data` that does not
+    separate the annotations of a table from its header row, or `None`.
+    """
+    end = find_row_end(data, len(data))
+    if end == -1:
+        return None
+    start = find_row_end(data, end) + 1
+    while data.startswith(b'#', start):
+        if start == 0:
+            return None
+        end = start - 1
+        start = find_row_end(data, end) + 1
+    return end + 1
+
+
+def find_header(data):
+    """
+    Return the annotations and header row of the last table that starts in
+    `data`, or `None`.
+    """
+    i = data.rfind(b'\n#')
+    while i != -1 and not is_row_end(data, i):
+        i = data.rfind(b'\n#', 0, i)
+    start = i + 1
+    if start == 0 and not data.startswith(b'#'):
+        return None
+    while start > 0:
+        previous = find_row_end(data, start - 1) + 1
+        if not data.startswith(b'#', previous):
+            break
+        start = previous
+    end = start
+    while data.startswith(b'#', end):
+        end = data.index(b'\n', end) + 1
+    return data[start:data.index(b'\n', end) + 1]
+
+
+def iter_segments(chunks, size=SEGMENT_SIZE):
+    """
+    Split the annotated CSV `chunks` into segments of about `size` bytes that
+    can be decoded on their own.
+    """
+    buffer = bytearray()
+    header = b''
+    for chunk in chunks:
+        buffer += chunk
+        if len(buffer) < size:
+            continue
+        cut = find_cut(buffer)
+        if cut is None:
+            continue
+        segment = bytes(buffer[:cut])
+        del buffer[:cut]
+        yield header + segment
+        header = find_header(segment) or header
+    if buffer:
+        yield header + bytes(buffer)
+
+
+def decode_segment(segment):
+    """Decode a segment into the `(columns, arrays)` blocks of its tables."""
+    return flux.read_blocks(flux.iter_csv([segment]))
+
+
+def decode(response, pool, window):
+    """
+    Yield the `(columns, arrays)` blocks of a Flux `response`, decoding up to
+    `window` segments at a time in the `pool` of processes.
+
+    Responses that fit in a segment are decoded in this process.
+    """
+    segments = iter_segments(flux.iter_chunks(response))
+    head = list(itertools.islice(segments, 2))
+    if len(head) < 2:
+        for segment in head:
+            for block in decode_segment(segment):
+                yield block
+        return
+
+    pending = deque()
+    try:
+        for segment in itertools.chain(head, segments):
+            pending.append(pool.submit(decode_segment, segment))
+            if len(pending) >= window:
+                for block in pending.popleft().result():
+                    yield block
+        while pending:
+            for block in pending.popleft().result():
+                yield block
+    finally:
+        for future in pending:
+            future.cancel()
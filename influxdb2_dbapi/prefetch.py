@@ -0,0 +1,110 @@
+"""
+Read and decode the rows of a query ahead of the application.
+
+A `Prefetcher` drains the row generator of a query in a background thread,
+into a bounded queue of chunks of rows, so that waiting on the network and
+decoding overlap with whatever the application does with the rows it has.
+Chunks start at a single row, so that the first row is not held back, and
+double up to `CHUNK_ROWS`.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import itertools
+import queue
+import threading
+
+
+CHUNK_ROWS = 1000
+
+# how often a thread blocked on a full queue checks whether it was closed
+POLL_SECONDS = 0.1
+
+
+class Prefetcher(object):
+    """
+    Iterate over `rows`, read by a background thread up to `depth` chunks
+    ahead; errors raised by `rows` are raised by `next` in turn.
+    """
+
+    def __init__(self, rows, depth, chunk_rows=CHUNK_ROWS):
+        self._queue = queue.Queue(depth)
+        self._closed = threading.Event()
+        self._chunk = iter(())
+        self._done = False
+        self._thread = threading.Thread(
+            target=self._read, args=(rows, chunk_rows), daemon=True)
+        self._thread.start()
+
+    def _read(self, rows, chunk_rows):
+        size = 1
+        try:
+            while not self._closed.is_set():
+                chunk = list(itertools.islice(rows, size))
+                if not chunk:
+                    break
+                self._put((chunk, None))
+                size = min(size * 2, chunk_rows)
+            self._put((None, None))
+        except BaseException as error:
+            self._put((None, error))
+        finally:
+            # generators can only be closed by the thread running them
+            close = getattr(rows, 'close', None)
+            if close is not None:
+                close()
+
+    def _put(self, item):
+        while not self._closed.is_set():
+            try:
+                self._queue.put(item, timeout=POLL_SECONDS)
+                return
+            except queue.Full:
+                pass
+
+    def wait(self):
+        """Wait for the first rows, or the end of the results."""
+        if not self._done:
+            self._next_chunk()
+
+    def _next_chunk(self):
+        chunk, error = self._queue.get()
+        if chunk is None:
+            self._done = True
+            if error is not None:
+                raise error
+        else:
+            self._chunk = iter(chunk)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while True:
+            for row in self._chunk:
+                return row
+            if self._done:
+                raise StopIteration
+            self._next_chunk()
+
+    next = __next__
+
+    def close(self):
+        """
+        Stop reading ahead and wait for the thread to finish; rows already
+        read are dropped. What `rows` reads from should be aborted first.
+        """
+        self._closed.set()
+        self._done = True
+        self._chunk = iter(())
+        # make room for a chunk being queued, so that the thread sees it's
+        # closed right away
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+        self._thread.join()
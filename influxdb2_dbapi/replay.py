@@ -0,0 +1,178 @@
+"""
+Record the responses of real Flux queries to disk, and replay them offline.
+
+A `Recorder` saves the raw annotated CSV of every response read to the end,
+as `<key>.csv` in its directory, next to `<key>.json` holding the query,
+org, server and timings; `key` is a hash of the org and the query, ignoring
+layout. A `Replayer` serves those files back instead of sending the
+queries, so that decoding and the SQL run over results can be profiled and
+tested on production-shaped data without a server, optionally at the pace
+they were recorded.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+from . import flux
+from .exceptions import OperationalError
+
+
+def get_key(org, query):
+    """Return the name of the files recording `query` for `org`."""
+    text = f'{org}\n{flux.normalize(query)}'
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class RecordingResponse(object):
+    """A response that copies what is read from it to a file."""
+
+    def __init__(self, response, recorder, metadata, start):
+        self.response = response
+        self._recorder = recorder
+        self._metadata = metadata
+        self._start = start
+        self._first_byte = time.perf_counter() - start
+        self._file = tempfile.NamedTemporaryFile(
+            dir=recorder.directory, suffix='.part', delete=False)
+        self._complete = False
+
+    def __iter__(self):
+        return self._record(iter(self.response))
+
+    def stream(self, amt):
+        return self._record(self.response.stream(amt))
+
+    def _record(self, chunks):
+        for chunk in chunks:
+            self._file.write(chunk)
+            yield chunk
+        self._complete = True
+
+    def close(self):
+        try:
+            self.response.close()
+        finally:
+            if not self._file.closed:
+                self._file.close()
+                if self._complete:
+                    self._metadata['first_byte_seconds'] = self._first_byte
+                    self._metadata['seconds'] = time.perf_counter() - self._start
+                    self._recorder.save(self._metadata, self._file.name)
+                else:
+                    # abandoned midway; the recording would be truncated
+                    os.remove(self._file.name)
+
+    def __getattr__(self, name):
+        return getattr(self.response, name)
+
+
+class Recorder(object):
+    """Records the responses of queries in `directory`."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def record(self, response, query, org, url, start):
+        """
+        Return `response`, to `query` sent at `perf_counter()` time `start`,
+        wrapped to be recorded once read to the end and closed.
+        """
+        metadata = {
+            'query': query,
+            'org': org,
+            'url': url,
+            'recorded_at': time.time(),
+        }
+        return RecordingResponse(response, self, metadata, start)
+
+    def save(self, metadata, body_path):
+        key = get_key(metadata['org'], metadata['query'])
+        metadata['bytes'] = os.path.getsize(body_path)
+        os.replace(body_path, os.path.join(self.directory, f'{key}.csv'))
+        # write the metadata last, so that replays never see it without data
+        path = os.path.join(self.directory, f'{key}.json')
+        with open(f'{path}.part', 'w') as file:
+            json.dump(metadata, file, indent=2)
+        os.replace(f'{path}.part', path)
+
+
+class ReplayedResponse(object):
+    """
+    A recorded response, read like a `urllib3.HTTPResponse`; with a `rate`,
+    in bytes per second, it is delivered no faster than that.
+    """
+
+    def __init__(self, data, rate=None):
+        self.data = data
+        self.rate = rate
+        self._read = 0
+        self._closed = threading.Event()
+
+    @property
+    def closed(self):
+        return self._closed.is_set()
+
+    def __iter__(self):
+        return self._deliver(self.data.splitlines(True))
+
+    def stream(self, amt=flux.CHUNK_SIZE):
+        return self._deliver(
+            self.data[start:start + amt] for start in range(0, len(self.data), amt))
+
+    def _deliver(self, chunks):
+        start = time.perf_counter()
+        for chunk in chunks:
+            if self.closed:
+                return
+            if self.rate:
+                delay = start + (self._read + len(chunk)) / self.rate - time.perf_counter()
+                if delay > 0 and self._closed.wait(delay):
+                    return
+            self._read += len(chunk)
+            yield chunk
+
+    def tell(self):
+        return self._read
+
+    def close(self):
+        self._closed.set()
+
+
+class Replayer(object):
+    """
+    Serves the responses recorded in `directory`. With `speed`, they are
+    delivered at that multiple of the pace they were recorded at, first byte
+    included; otherwise as fast as they are read.
+    """
+
+    def __init__(self, directory, speed=None):
+        self.directory = directory
+        self.speed = speed
+
+    def open(self, query, org):
+        """Return the recorded response to `query`, or raise `OperationalError`."""
+        path = os.path.join(self.directory, get_key(org, query))
+        try:
+            with open(f'{path}.json') as file:
+                metadata = json.load(file)
+            with open(f'{path}.csv', 'rb') as file:
+                data = file.read()
+        except FileNotFoundError:
+            raise OperationalError(f'No recorded response to {query}')
+        rate = None
+        if self.speed:
+            time.sleep(metadata['first_byte_seconds'] / self.speed)
+            transfer = metadata['seconds'] - metadata['first_byte_seconds']
+            if transfer > 0:
+                rate = len(data) / transfer * self.speed
+        return ReplayedResponse(data, rate)
@@ -0,0 +1,251 @@
+"""
+Share one HTTP request between concurrent executions of the same query.
+
+When a dashboard loads, many threads send the same Flux at the same moment,
+each through its own connection. The first one sends the query; the others
+that arrive while it is in flight subscribe to its response instead of
+sending their own. A thread reads the response into a buffer that every
+subscriber iterates over independently, from the start, at its own pace.
+
+Only the first `MAX_BUFFER` bytes are kept for subscribers that join late:
+past that the flight stops accepting new ones and drops the chunks every
+subscriber has read. The response is never read slower than its fastest
+subscriber: chunks that would take the buffer past `MAX_BUFFER`, because a
+subscriber lags behind or stopped reading, are spilled to a temporary file
+instead, so large results are still streamed in bounded memory.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import tempfile
+import threading
+
+from . import flux
+
+
+MAX_BUFFER = 16 * 1024 * 1024
+
+# the flights accepting subscribers, by key
+_flights = {}
+_lock = threading.Lock()
+
+
+class Flight(object):
+    """A query in flight and the part of its response read so far."""
+
+    def __init__(self, key):
+        self.key = key
+        self.response = None
+        self.condition = threading.Condition()
+        # chunks[0] is chunk number `offset` of the response; spilled ones
+        # are `(position, length)` in `spill`
+        self.chunks = []
+        self.offset = 0
+        self.size = 0
+        self.spill = None
+        self.spilled = 0
+        # the number of the next chunk of each subscriber
+        self.positions = {}
+        self.joinable = True
+        self.done = False
+        self.error = None
+
+    def subscribe(self):
+        """Return a new `SharedResponse`, or None if it's too late to join."""
+        with self.condition:
+            if not self.joinable:
+                return None
+            subscriber = SharedResponse(self)
+            self.positions[subscriber] = 0
+            return subscriber
+
+    def start(self, send):
+        """Send the query with `send` and read its response in a thread."""
+        try:
+            response = send()
+        except Exception as e:
+            self._finish(e)
+            raise
+        with self.condition:
+            self.response = response
+            aborted = not self.positions
+        if aborted:
+            # every subscriber left while the query was being sent
+            response.close()
+            self._finish(None)
+            return
+        thread = threading.Thread(target=self._pump, daemon=True)
+        thread.start()
+
+    def _pump(self):
+        error = None
+        try:
+            for chunk in flux.iter_chunks(self.response):
+                if not self._append(chunk):
+                    break
+        except Exception as e:
+            error = e
+        finally:
+            # release the connection
+            self.response.close()
+        self._finish(error)
+
+    def _append(self, chunk):
+        """Buffer `chunk`; return False when no subscriber is left."""
+        with self.condition:
+            if not self.positions:
+                return False
+            if self.joinable and self.size + len(chunk) > MAX_BUFFER:
+                self.joinable = False
+                self._release()
+                unregister = True
+            else:
+                unregister = False
+            if self.size + len(chunk) > MAX_BUFFER:
+                self.chunks.append(self._spill(chunk))
+            else:
+                self.chunks.append(chunk)
+                self.size += len(chunk)
+            self.condition.notify_all()
+        if unregister:
+            _unregister(self)
+        return True
+
+    def _spill(self, chunk):
+        if self.spill is None:
+            self.spill = tempfile.TemporaryFile()
+        position = self.spill.seek(0, 2)
+        self.spill.write(chunk)
+        self.spilled += len(chunk)
+        return position, len(chunk)
+
+    def _unspill(self, chunk):
+        if isinstance(chunk, tuple):
+            position, length = chunk
+            self.spill.seek(position)
+            chunk = self.spill.read(length)
+        return chunk
+
+    def _close_spill(self):
+        """Delete the spilled chunks, once nobody is left to read them."""
+        if self.spill is not None and not self.positions:
+            self.spill.close()
+            self.spill = None
+
+    def _finish(self, error):
+        with self.condition:
+            self.joinable = False
+            self.done = True
+            self.error = error
+            self.condition.notify_all()
+        _unregister(self)
+
+    def _release(self):
+        """Drop the chunks every subscriber has read, once none can join."""
+        if self.joinable or not self.positions:
+            return
+        read = min(self.positions.values()) - self.offset
+        if read > 0:
+            self.size -= sum(
+                len(chunk) for chunk in self.chunks[:read] if not isinstance(chunk, tuple))
+            del self.chunks[:read]
+            self.offset += read
+            self.condition.notify_all()
+
+    def read(self, subscriber):
+        """Return the next chunk of `subscriber`, or None at the end."""
+        with self.condition:
+            while subscriber in self.positions:
+                position = self.positions[subscriber]
+                if position < self.offset + len(self.chunks):
+                    chunk = self._unspill(self.chunks[position - self.offset])
+                    self.positions[subscriber] = position + 1
+                    self._release()
+                    return chunk
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return None
+                self.condition.wait()
+            return None
+
+    def leave(self, subscriber):
+        """Unsubscribe; abort the request when nobody is left to read it."""
+        with self.condition:
+            if self.positions.pop(subscriber, None) is None:
+                return
+            abort = not self.positions and not self.done
+            if abort:
+                self.joinable = False
+                response = self.response
+            else:
+                self._release()
+            self._close_spill()
+            self.condition.notify_all()
+        if abort:
+            _unregister(self)
+            if response is not None:
+                response.close()
+
+
+class SharedResponse(object):
+    """
+    One subscriber's view of a `Flight`, with the part of the interface of
+    `urllib3.HTTPResponse` that the cursor reads responses with.
+    """
+
+    def __init__(self, flight):
+        self.flight = flight
+        self.closed = False
+
+    def stream(self, amt=None):
+        while not self.closed:
+            chunk = self.flight.read(self)
+            if chunk is None:
+                return
+            yield chunk
+
+    def __iter__(self):
+        pending = b''
+        for chunk in self.stream():
+            lines = (pending + chunk).split(b'\n')
+            pending = lines.pop()
+            for line in lines:
+                yield line + b'\n'
+        if pending:
+            yield pending
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.flight.leave(self)
+
+
+def _unregister(flight):
+    with _lock:
+        if _flights.get(flight.key) is flight:
+            del _flights[flight.key]
+
+
+def open(key, send):
+    """
+    Return a response to the query identified by `key`: a share of the one
+    in flight if there is one, else of a new one sent with `send`.
+
+    Returns a `(response, shared)` tuple, where `shared` tells whether the
+    query was already in flight.
+    """
+    with _lock:
+        flight = _flights.get(key)
+        if flight is not None:
+            response = flight.subscribe()
+            if response is not None:
+                return response, True
+        flight = Flight(key)
+        response = flight.subscribe()
+        _flights[key] = flight
+    flight.start(send)
+    return response, False
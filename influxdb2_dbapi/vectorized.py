@@ -0,0 +1,676 @@
+"""
+Run the SQL that wraps a Flux query directly over the columns of its result.
+
+Only the shapes generated by Superset and friends are supported:
+
+    SELECT cols, agg(col) FROM (SELECT * FROM Model) WHERE ... GROUP BY ...
+    ORDER BY ... LIMIT n
+
+with `col op literal` predicates joined by `AND`. `parse` returns `None` for
+anything else, and `Plan.execute` raises `Unsupported` when the data does
+not fit (e.g. summing strings), so that the caller can fall back to SQLite.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from collections import namedtuple
+import datetime
+import operator
+import re
+
+import numpy as np
+import pandas as pd
+
+from .exceptions import ProgrammingError
+
+
+class Unsupported(Exception):
+    """The query or its data needs SQL that is not implemented here."""
+
+
+AGGREGATES = {'COUNT', 'SUM', 'AVG', 'MIN', 'MAX'}
+
+KEYWORDS = {
+    'SELECT', 'ALL', 'DISTINCT', 'FROM', 'AS', 'WHERE', 'AND', 'OR', 'NOT',
+    'IN', 'IS', 'NULL', 'BETWEEN', 'LIKE', 'GROUP', 'BY', 'HAVING', 'ORDER',
+    'ASC', 'DESC', 'LIMIT', 'OFFSET', 'TRUE', 'FALSE', 'JOIN', 'ON', 'UNION',
+    'CASE',
+}
+
+TOKEN_RE = re.compile(r'''
+    (?P<number>\d+\.?\d*(?:[eE][-+]?\d+)?|\.\d+(?:[eE][-+]?\d+)?)
+    |(?P<string>'(?:[^']|'')*')
+    |(?P<quoted>"(?:[^"]|"")*"|`[^`]*`|\[[^\]]*\])
+    |(?P<name>[A-Za-z_][A-Za-z_0-9]*)
+    |(?P<op><=|>=|<>|!=|==|[=<>(),*.-])
+''', re.X)
+
+COMPARISONS = {
+    '=': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+
+# a date or a time, optionally with a zone, as written in SQL literals
+TIME_RE = re.compile(
+    r'\d{4}-\d{2}-\d{2}(?:[ T]\d{2}:\d{2}(?::\d{2}(?:\.\d{1,9})?)?)?'
+    r'(?:Z|[+-]\d{2}:?\d{2})?$')
+
+# swap the operands of a comparison
+FLIPPED = {'=': '=', '!=': '!=', '<': '>', '<=': '>=', '>': '<', '>=': '<='}
+
+Token = namedtuple('Token', ['kind', 'value', 'start', 'end'])
+
+Column = namedtuple('Column', ['name'])
+Star = namedtuple('Star', [])
+# `column` is None for `COUNT(*)`
+Aggregate = namedtuple('Aggregate', ['function', 'column', 'distinct'])
+Item = namedtuple('Item', ['expression', 'name'])
+# `op` is a comparison, 'in', 'not in', 'is null' or 'is not null'
+Predicate = namedtuple('Predicate', ['column', 'op', 'value'])
+# `expression` is a `Column`, an `Aggregate` or a 1-based position
+Order = namedtuple('Order', ['expression', 'descending'])
+
+
+def tokenize(sql):
+    tokens = []
+    pos = 0
+    while True:
+        while pos < len(sql) and sql[pos].isspace():
+            pos += 1
+        if pos == len(sql):
+            return tokens
+        match = TOKEN_RE.match(sql, pos)
+        if not match:
+            raise Unsupported(f'Unexpected {sql[pos:pos + 10]!r}')
+        kind = match.lastgroup
+        text = match.group(kind)
+        value = text
+        if kind == 'name' and text.upper() in KEYWORDS:
+            kind, value = 'keyword', text.upper()
+        elif kind == 'quoted':
+            value = text[1:-1].replace('""', '"')
+        elif kind == 'string':
+            value = text[1:-1].replace("''", "'")
+        elif kind == 'number':
+            value = float(text) if set(text) & set('.eE') else int(text)
+        tokens.append(Token(kind, value, match.start(), match.end()))
+        pos = match.end()
+
+
+class Parser(object):
+    """Recursive descent parser for the supported SQL subset."""
+
+    def __init__(self, sql):
+        self.sql = sql.strip().rstrip(';')
+        self.tokens = tokenize(self.sql)
+        self.pos = 0
+
+    def peek(self, offset=0):
+        if self.pos + offset < len(self.tokens):
+            return self.tokens[self.pos + offset]
+        return None
+
+    def next(self):
+        token = self.peek()
+        if token is None:
+            raise Unsupported('Unexpected end of query')
+        self.pos += 1
+        return token
+
+    def accept(self, *values):
+        token = self.peek()
+        if token and token.kind in ('keyword', 'op') and token.value in values:
+            self.pos += 1
+            return token
+        return None
+
+    def expect(self, *values):
+        token = self.accept(*values)
+        if token is None:
+            raise Unsupported(f'Expected {" or ".join(values)}')
+        return token
+
+    def parse(self):
+        self.expect('SELECT')
+        self.accept('ALL')
+        items = [self.item()]
+        while self.accept(','):
+            items.append(self.item())
+
+        self.expect('FROM')
+        for value in ('(', 'SELECT', '*', 'FROM'):
+            self.expect(value)
+        if self.identifier().lower() != 'model':
+            raise Unsupported('Only the Flux results can be queried')
+        self.expect(')')
+        if self.accept('AS') or self.peek() and self.peek().kind in ('name', 'quoted'):
+            self.identifier()
+
+        where = []
+        if self.accept('WHERE'):
+            where.extend(self.predicate())
+            while self.accept('AND'):
+                where.extend(self.predicate())
+
+        group = []
+        if self.accept('GROUP'):
+            self.expect('BY')
+            group.append(self.column())
+            while self.accept(','):
+                group.append(self.column())
+
+        order = []
+        if self.accept('ORDER'):
+            self.expect('BY')
+            order.append(self.order())
+            while self.accept(','):
+                order.append(self.order())
+
+        limit = offset = None
+        if self.accept('LIMIT'):
+            limit = self.integer()
+            if self.accept(','):
+                offset, limit = limit, self.integer()
+            elif self.accept('OFFSET'):
+                offset = self.integer()
+
+        if self.peek() is not None:
+            raise Unsupported(f'Unexpected {self.peek().value!r}')
+        return Plan(items, where, group, order, limit, offset or 0)
+
+    def identifier(self):
+        token = self.next()
+        if token.kind not in ('name', 'quoted'):
+            raise Unsupported(f'Expected a name, got {token.value!r}')
+        return token.value
+
+    def integer(self):
+        token = self.next()
+        if token.kind != 'number' or not isinstance(token.value, int):
+            raise Unsupported('Expected an integer')
+        return token.value
+
+    def column(self):
+        name = self.identifier()
+        if self.accept('.'):
+            # there is a single table, so qualifiers can be dropped
+            name = self.identifier()
+        return Column(name)
+
+    def expression(self):
+        token = self.peek()
+        if token is None:
+            raise Unsupported('Unexpected end of query')
+        following = self.peek(1)
+        if (
+            token.kind == 'name' and token.value.upper() in AGGREGATES and
+            following is not None and following.value == '('
+        ):
+            function = token.value.upper()
+            self.pos += 2
+            if function == 'COUNT' and self.accept('*'):
+                self.expect(')')
+                return Aggregate(function, None, False)
+            distinct = self.accept('DISTINCT') is not None
+            if distinct and function != 'COUNT':
+                raise Unsupported(f'{function}(DISTINCT ...)')
+            column = self.column()
+            self.expect(')')
+            return Aggregate(function, column, distinct)
+        return self.column()
+
+    def item(self):
+        if self.accept('*'):
+            return Item(Star(), None)
+        start = self.peek()
+        expression = self.expression()
+        end = self.tokens[self.pos - 1]
+        if self.accept('AS') or self.peek() and self.peek().kind in ('name', 'quoted'):
+            name = self.identifier()
+        elif isinstance(expression, Column):
+            name = expression.name
+        else:
+            # SQLite names unaliased expressions after their text
+            name = self.sql[start.start:end.end]
+        return Item(expression, name)
+
+    def literal(self):
+        token = self.next()
+        if token.kind in ('number', 'string'):
+            return token.value
+        if token.value == '-':
+            number = self.next()
+            if number.kind == 'number':
+                return -number.value
+        if token.kind == 'keyword' and token.value in ('TRUE', 'FALSE'):
+            return token.value == 'TRUE'
+        raise Unsupported(f'Unsupported value {token.value!r}')
+
+    def predicate(self):
+        token = self.peek()
+        if token is not None and token.kind in ('number', 'string'):
+            value = self.literal()
+            op = self.expect(*COMPARISONS, '==', '<>').value
+            op = {'==': '=', '<>': '!='}.get(op, op)
+            return [Predicate(self.column(), FLIPPED[op], value)]
+
+        column = self.column()
+        op = self.accept(*COMPARISONS, '==', '<>')
+        if op:
+            op = {'==': '=', '<>': '!='}.get(op.value, op.value)
+            return [Predicate(column, op, self.literal())]
+        if self.accept('IS'):
+            negated = self.accept('NOT')
+            self.expect('NULL')
+            return [Predicate(column, 'is not null' if negated else 'is null', None)]
+        negated = self.accept('NOT')
+        if self.accept('IN'):
+            self.expect('(')
+            values = [self.literal()]
+            while self.accept(','):
+                values.append(self.literal())
+            self.expect(')')
+            return [Predicate(column, 'not in' if negated else 'in', values)]
+        if self.accept('BETWEEN') and not negated:
+            low = self.literal()
+            self.expect('AND')
+            high = self.literal()
+            return [Predicate(column, '>=', low), Predicate(column, '<=', high)]
+        raise Unsupported('Unsupported predicate')
+
+    def order(self):
+        token = self.peek()
+        if token is not None and token.kind == 'number' and isinstance(token.value, int):
+            self.pos += 1
+            expression = token.value
+        else:
+            expression = self.expression()
+        descending = self.accept('DESC') is not None
+        if not descending:
+            self.accept('ASC')
+        return Order(expression, descending)
+
+
+def parse(sql):
+    """Return the `Plan` of `sql`, or `None` if it is not supported."""
+    try:
+        return Parser(sql).parse()
+    except Unsupported:
+        return None
+
+
+def isnull(array):
+    kind = array.dtype.kind
+    if kind == 'f':
+        return np.isnan(array)
+    if kind == 'M':
+        return np.isnat(array)
+    if kind == 'O':
+        return pd.isna(array)
+    return np.zeros(len(array), dtype=bool)
+
+
+def factorize(array):
+    """
+    Return codes ranking the values of `array`, where nulls get -1, and the
+    sorted distinct values.
+    """
+    try:
+        return pd.factorize(array, sort=True)
+    except TypeError:
+        raise Unsupported('Values of mixed types')
+
+
+def to_numbers(array, null):
+    """Return `array` as a numeric NumPy array, or raise `Unsupported`."""
+    kind = array.dtype.kind
+    if kind in 'fiu':
+        return array
+    if kind == 'b':
+        return array.astype(np.int64)
+    if kind == 'O' and pd.api.types.infer_dtype(array, skipna=True) in (
+            'integer', 'floating', 'mixed-integer-float', 'empty'):
+        return np.where(null, np.nan, array).astype(np.float64)
+    raise Unsupported('Arithmetic on non numeric values')
+
+
+def parse_time(value):
+    """
+    Return the SQL time literal `value` as a naive UTC `pd.Timestamp`, times
+    without a zone being UTC, or `None` if it is not a time.
+    """
+    if not TIME_RE.match(value.strip()):
+        return None
+    try:
+        time = pd.Timestamp(value.strip())
+    except ValueError:
+        return None
+    if time.tzinfo is not None:
+        time = time.tz_convert('UTC').tz_localize(None)
+    return time
+
+
+def to_time(value):
+    """Parse a SQL time literal as a UTC `datetime64`."""
+    time = parse_time(value)
+    if time is None:
+        raise Unsupported(f'Unsupported time {value!r}')
+    return time.to_datetime64()
+
+
+def coerce(array, value):
+    """
+    Return `array` and `value` in types that compare like SQLite compares
+    the column with the literal, or raise `Unsupported`.
+    """
+    kind = array.dtype.kind
+    if kind == 'M' and isinstance(value, str):
+        return array, to_time(value)
+    if kind in 'fiub' and not isinstance(value, str):
+        return array, value
+    if kind == 'O':
+        inferred = pd.api.types.infer_dtype(array, skipna=True)
+        if inferred in ('string', 'empty') and isinstance(value, str):
+            return array, value
+        if not isinstance(value, str) and inferred in (
+                'integer', 'floating', 'mixed-integer-float', 'boolean'):
+            return array, value
+    raise Unsupported('Comparison between different types')
+
+
+def evaluate(predicate, array):
+    """Return the rows of `array` where `predicate` is true."""
+    null = isnull(array)
+    if predicate.op == 'is null':
+        return null
+    if predicate.op == 'is not null':
+        return ~null
+
+    result = np.zeros(len(array), dtype=bool)
+    valid = ~null
+    values = array[valid] if null.any() else array
+    if predicate.op in ('in', 'not in'):
+        targets = [coerce(values, value)[1] for value in predicate.value]
+        hits = pd.Series(values, copy=False).isin(targets).to_numpy()
+        if predicate.op == 'not in':
+            hits = ~hits
+    else:
+        values, target = coerce(values, predicate.value)
+        hits = np.asarray(COMPARISONS[predicate.op](values, target), dtype=bool)
+    result[valid] = hits
+    return result
+
+
+def sort_indices(keys, descending, top=None):
+    """
+    Return the indices that sort rows by `keys`, nulls first, or only the
+    first `top` of them.
+    """
+    n = len(keys[0]) if keys else 0
+    if top is not None and top <= 0:
+        return np.arange(0)
+    if len(keys) == 1 and top is not None and top < n:
+        key = keys[0]
+        if key.dtype.kind == 'M' and not np.isnat(key).any():
+            key = key.view(np.int64)
+        if key.dtype.kind in 'fiu' and not (key.dtype.kind == 'f' and np.isnan(key).any()):
+            # top-N: partition, then sort only the first N rows; keys keep
+            # their type, as int64 times don't all fit in a float64
+            if descending[0]:
+                kth = np.partition(key, n - top)[n - top]
+                better = np.flatnonzero(key > kth)
+            else:
+                kth = np.partition(key, top - 1)[top - 1]
+                better = np.flatnonzero(key < kth)
+            # ties at the cut, first ones first, like the full sort
+            ties = np.flatnonzero(key == kth)[:top - len(better)]
+            indices = np.sort(np.concatenate([better, ties]))
+            if not descending[0]:
+                return indices[np.argsort(key[indices], kind='stable')]
+            # descending, ties in order: sort the reversed rows, then reverse
+            indices = indices[::-1]
+            return indices[np.argsort(key[indices], kind='stable')][::-1]
+
+    columns = []
+    for key, desc in zip(keys, descending):
+        codes, _ = factorize(key)
+        columns.append(-codes if desc else codes)
+    indices = np.lexsort(columns[::-1]) if columns else np.arange(n)
+    return indices if top is None else indices[:top]
+
+
+def reduce(aggregate, array, order, starts, sizes):
+    """Compute `aggregate` over `array` for each group, as a NumPy array."""
+    if aggregate.column is None:
+        return sizes
+
+    values = array[order]
+    null = isnull(values)
+    counts = np.add.reduceat((~null).astype(np.int64), starts) if len(values) else sizes
+    function = aggregate.function
+    if function == 'COUNT':
+        if not aggregate.distinct:
+            return counts
+        groups = np.repeat(np.arange(len(starts)), sizes)
+        codes, _ = factorize(values)
+        pairs = np.unique(np.stack([groups, codes])[:, codes >= 0], axis=1)
+        return np.bincount(pairs[0], minlength=len(starts))
+
+    if function in ('SUM', 'AVG'):
+        numbers = to_numbers(values, null)
+        zero = numbers.dtype.type(0)
+        totals = np.add.reduceat(np.where(null, zero, numbers), starts)
+        if function == 'AVG':
+            with np.errstate(invalid='ignore', divide='ignore'):
+                totals = totals / counts
+        result = totals
+    else:
+        codes, uniques = factorize(values)
+        uniques = np.asarray(uniques)
+        if not len(uniques):
+            return np.full(len(starts), None, dtype=object)
+        if function == 'MIN':
+            codes = np.where(codes < 0, len(uniques) - 1, codes)
+            best = np.minimum.reduceat(codes, starts)
+        else:
+            best = np.maximum.reduceat(codes, starts)
+        result = uniques[best]
+
+    if (counts == 0).any():
+        result = result.astype(object)
+        result[counts == 0] = None
+    return result
+
+
+def empty_aggregate(aggregate):
+    """The value of `aggregate` over no rows."""
+    return 0 if aggregate.function == 'COUNT' else None
+
+
+class Plan(object):
+    """A parsed query, executed over a dict of NumPy columns."""
+
+    def __init__(self, items, where, group, order, limit, offset):
+        self.items = items
+        self.where = where
+        self.group = group
+        self.order = order
+        self.limit = limit
+        self.offset = offset
+        self.aggregated = bool(group) or any(
+            isinstance(item.expression, Aggregate) for item in items)
+
+    def execute(self, columns):
+        """
+        Run the plan over `columns`; return the names and the NumPy arrays of
+        the output columns.
+        """
+        self.columns = columns
+        self.n = len(next(iter(columns.values()))) if columns else 0
+
+        mask = np.ones(self.n, dtype=bool)
+        for predicate in self.where:
+            mask &= evaluate(predicate, self.get(predicate.column.name))
+        rows = np.flatnonzero(mask) if not mask.all() else np.arange(self.n)
+
+        if self.aggregated:
+            return self.execute_aggregated(rows)
+        return self.execute_projection(rows)
+
+    def get(self, name):
+        """Return the column called `name`, matched like SQLite does."""
+        if name in self.columns:
+            return self.columns[name]
+        for key, array in self.columns.items():
+            if key.lower() == name.lower():
+                return array
+        if self.n == 0:
+            return np.zeros(0, dtype=object)
+        raise ProgrammingError(f'no such column: {name}')
+
+    def top(self):
+        if self.limit is None or self.limit < 0:
+            return None
+        return self.limit + self.offset
+
+    def window(self, indices):
+        if self.limit is None or self.limit < 0:
+            return indices[self.offset:]
+        return indices[self.offset:self.offset + self.limit]
+
+    def execute_projection(self, rows):
+        items = []
+        for item in self.items:
+            if isinstance(item.expression, Star):
+                items.extend(Item(Column(name), name) for name in self.columns)
+            else:
+                items.append(item)
+
+        if self.order:
+            keys, descending = [], []
+            for order in self.order:
+                expression = order.expression
+                if isinstance(expression, int):
+                    expression = items[expression - 1].expression
+                else:
+                    for item in items:
+                        if item.name == expression.name:
+                            expression = item.expression
+                            break
+                keys.append(self.get(expression.name)[rows])
+                descending.append(order.descending)
+            rows = rows[sort_indices(keys, descending, self.top())]
+        rows = self.window(rows)
+
+        names = [item.name for item in items]
+        return names, [self.get(item.expression.name)[rows] for item in items]
+
+    def execute_aggregated(self, rows):
+        group = [self.get(column.name)[rows] for column in self.group]
+        n = len(rows)
+        if group:
+            codes = np.zeros(n, dtype=np.int64)
+            for key in group:
+                key_codes = factorize(key)[0] + 1  # nulls first
+                codes = codes * (key_codes.max(initial=0) + 1) + key_codes
+            codes, _ = pd.factorize(codes, sort=True)
+            order = np.argsort(codes, kind='stable')
+            boundaries = np.flatnonzero(np.diff(codes[order])) + 1
+            starts = np.r_[0, boundaries] if n else np.arange(0)
+        else:
+            order = np.arange(n)
+            starts = np.zeros(1, dtype=np.int64)
+        sizes = np.diff(np.r_[starts, n])
+        first = order[starts] if n else starts
+
+        def evaluate_expression(expression):
+            if isinstance(expression, Column):
+                for column, key in zip(self.group, group):
+                    if column.name.lower() == expression.name.lower():
+                        return key[first]
+                raise Unsupported(f'{expression.name} is not grouped')
+            if n == 0 and not self.group:
+                return np.array([empty_aggregate(expression)], dtype=object)
+            array = None
+            if expression.column is not None:
+                array = self.get(expression.column.name)[rows]
+            return reduce(expression, array, order, starts, sizes)
+
+        names, outputs = [], []
+        for item in self.items:
+            if isinstance(item.expression, Star):
+                raise Unsupported('SELECT * with aggregates')
+            names.append(item.name)
+            outputs.append(evaluate_expression(item.expression))
+
+        indices = np.arange(len(starts))
+        if self.order:
+            keys, descending = [], []
+            for order_by in self.order:
+                expression = order_by.expression
+                if isinstance(expression, int):
+                    keys.append(outputs[expression - 1])
+                else:
+                    for item, output in zip(self.items, outputs):
+                        if item.expression == expression or (
+                                isinstance(expression, Column) and
+                                item.name == expression.name):
+                            keys.append(output)
+                            break
+                    else:
+                        keys.append(evaluate_expression(expression))
+                descending.append(order_by.descending)
+            indices = sort_indices(keys, descending, self.top())
+        indices = self.window(indices)
+        return names, [output[indices] for output in outputs]
+
+
+def to_python(array, time_format='datetime'):
+    """
+    Convert an output column into Python values, with `None` for nulls and
+    times in `time_format`.
+    """
+    kind = array.dtype.kind
+    if kind == 'M':
+        null = np.isnat(array)
+        if time_format == 'epoch_ns':
+            values = array.astype('int64').tolist()
+        elif time_format == 'datetime64':
+            values = list(array)
+        else:
+            # NaT becomes None
+            values = [
+                value and value.replace(tzinfo=datetime.timezone.utc)
+                for value in array.astype('datetime64[us]').tolist()
+            ]
+        return [None if is_null else value for value, is_null in zip(values, null)]
+    if kind == 'f':
+        null = np.isnan(array)
+        if null.any():
+            return [None if is_null else value
+                    for value, is_null in zip(array.tolist(), null)]
+    return array.tolist()
+
+
+def to_rows(outputs, time_format='datetime'):
+    return list(zip(*[to_python(output, time_format) for output in outputs]))
+
+
+# rows converted at a time by `iter_rows`
+ROWS_PER_BATCH = 10000
+
+
+def iter_rows(outputs, time_format='datetime', size=None):
+    """Like `to_rows`, converting `size` rows at a time as they are consumed."""
+    size = size or ROWS_PER_BATCH
+    n = len(outputs[0]) if outputs else 0
+    for start in range(0, n, size):
+        for row in to_rows([output[start:start + size] for output in outputs], time_format):
+            yield row
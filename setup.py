@@ -28,6 +28,7 @@ REQUIRED = [
     'SQLAlchemy',
     'sqlalchemy',
     'influxdb-client',
+    'numpy',
     'pandas',
     'requests-ntlm',
     'sqlparse',
@@ -116,7 +117,7 @@ setup(
 
     entry_points={
         'console_scripts': [
-            'influxdb2_db = influxdb2.console:main',
+            'influxdb2_db = influxdb2_dbapi.console:main',
         ],
         'sqlalchemy.dialects': [
             'influxdb2 = influxdb2_dbapi.influxdb2_sqlalchemy:Influxdb2HTTPDialect',
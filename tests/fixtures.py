@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""Canned Flux responses so the cursor can be exercised without a server."""
+
+import datetime
+import threading
+import time
+
+
+HEADER = (
+    '#datatype,string,long,dateTime:RFC3339,dateTime:RFC3339,'
+    'dateTime:RFC3339,double,string,string,string\r\n'
+    '#group,false,false,true,true,false,false,true,true,true\r\n'
+    '#default,_result,,,,,,,,\r\n'
+    ',result,table,_start,_stop,_time,_value,_field,_measurement,host\r\n'
+)
+
+START = '2023-01-01T00:00:00Z'
+STOP = '2023-01-02T00:00:00Z'
+
+
+def flux_csv(series, points=3, measurement='cpu', nulls=0):
+    """
+    Build an annotated CSV response with one table per host in `series`.
+
+    Each table holds `points` rows of `measurement`, one per second, valued
+    0, 1, 2..., except the first `nulls`, which have no value, like empty
+    windows.
+    """
+    start = datetime.datetime(2023, 1, 1)
+    times = [
+        (start + datetime.timedelta(seconds=i)).strftime('%Y-%m-%dT%H:%M:%SZ')
+        for i in range(points)
+    ]
+    lines = [HEADER]
+    for table, host in enumerate(series):
+        for i in range(points):
+            lines.append(
+                f',,{table},{START},{STOP},{times[i]},'
+                f'{float(i) if i >= nulls else ""},usage,{measurement},{host}\r\n'
+            )
+    return ''.join(lines).encode('utf-8')
+
+
+class FakeResponse(object):
+    """
+    A stand-in for `urllib3.HTTPResponse` that serves `data` line by line, or
+    in chunks of `chunk_size` bytes when streamed, if set.
+    """
+
+    def __init__(self, data, delay=0, chunk_size=None):
+        self.data = data
+        self.delay = delay
+        self.chunk_size = chunk_size
+        self.closed = False
+        self.released = threading.Event()
+        self.bytes_read = 0
+
+    def __iter__(self):
+        for line in self.data.splitlines(True):
+            if self.delay:
+                time.sleep(self.delay)
+            if self.closed:
+                return
+            self.bytes_read += len(line)
+            yield line
+
+    def stream(self, amt):
+        amt = self.chunk_size or amt
+        for start in range(0, len(self.data), amt):
+            if self.delay:
+                time.sleep(self.delay)
+            if self.closed:
+                return
+            chunk = self.data[start:start + amt]
+            self.bytes_read += len(chunk)
+            yield chunk
+
+    def tell(self):
+        return self.bytes_read
+
+    def close(self):
+        self.closed = True
+        self.released.set()
+
+
+def count_csv(value):
+    """Build the response of a query rewritten by `flux.count_query`."""
+    return (
+        '#datatype,string,long,long\r\n'
+        '#group,false,false,false\r\n'
+        '#default,_result,,\r\n'
+        ',result,table,_value\r\n'
+        f',,0,{value}\r\n'
+    ).encode('utf-8')
+
+
+def serve(cursor, data, delay=0, responses=None):
+    """
+    Make `cursor` answer every query with `data`, or with `data(query)` when
+    it is callable; return the list of responses served.
+    """
+    responses = [] if responses is None else responses
+
+    def post_query(query):
+        body = data(query) if callable(data) else data
+        response = FakeResponse(body, delay)
+        responses.append(response)
+        return response
+
+    cursor._post_query = post_query
+    return responses
+
+
+def serve_connection(connection, data, delay=0):
+    """Like `serve`, for every cursor that `connection` creates."""
+    responses = []
+    cursor = connection.cursor
+
+    def served_cursor(*args, **kwargs):
+        served = cursor(*args, **kwargs)
+        serve(served, data, delay, responses)
+        return served
+
+    connection.cursor = served_cursor
+    return responses
+
+
+def wait_for(condition, timeout=5):
+    """Wait for `condition()` to hold, polling it, or fail the test."""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError('timed out')
+        time.sleep(0.001)
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+
+from .context import influxdb2_dbapi
+from .fixtures import FakeResponse, flux_csv, wait_for
+
+import threading
+import unittest
+from sqlalchemy.engine.url import make_url
+
+from influxdb2_dbapi import admission
+from influxdb2_dbapi.exceptions import OperationalError
+from influxdb2_dbapi.influxdb2_sqlalchemy import Influxdb2Dialect
+
+
+QUERY = 'from(bucket: "b") |> range(start: -1h)'
+
+DATA = flux_csv(['a', 'b'])
+
+
+class AdmissionQueueTestSuite(unittest.TestCase):
+
+    def admit_in_thread(self, queue, priority, admitted):
+        thread = threading.Thread(
+            target=lambda: admitted.append((priority, queue.acquire(priority))))
+        thread.start()
+        return thread
+
+    def test_priority_then_arrival(self):
+        queue = admission.AdmissionQueue(1)
+        self.assertEqual(queue.acquire(), 0.0)
+        admitted = []
+        threads = []
+        for priority in [admission.BACKGROUND, admission.INTERACTIVE, admission.INTERACTIVE]:
+            threads.append(self.admit_in_thread(queue, priority, admitted))
+            wait_for(lambda: queue.waiting == len(threads))
+        for count in range(1, 4):
+            queue.release()
+            wait_for(lambda: len(admitted) == count)
+        for thread in threads:
+            thread.join()
+        self.assertEqual(
+            [priority for priority, _ in admitted],
+            [admission.INTERACTIVE, admission.INTERACTIVE, admission.BACKGROUND])
+        self.assertTrue(all(waited > 0 for _, waited in admitted))
+        queue.release()
+        self.assertEqual(queue.running, 0)
+
+    def test_timeout(self):
+        queue = admission.AdmissionQueue(1)
+        queue.acquire()
+        with self.assertRaises(OperationalError):
+            queue.acquire(timeout=0.1)
+        self.assertEqual(queue.waiting, 0)
+        queue.release()
+        self.assertEqual(queue.running, 0)
+
+    def test_cancelled_while_waiting(self):
+        queue = admission.AdmissionQueue(1)
+        queue.acquire()
+        cancelled = threading.Event()
+        cancelled.set()
+        self.assertIsNone(queue.acquire(cancelled=cancelled))
+        self.assertEqual(queue.waiting, 0)
+
+    def test_shared_per_hosts_and_limit(self):
+        queue = admission.get_queue(('u', 'shared'), 2)
+        self.assertIs(admission.get_queue(('u', 'shared'), 2), queue)
+        # another limit gets its own queue, rather than changing this one's
+        self.assertIsNot(admission.get_queue(('u', 'shared'), 3), queue)
+        self.assertEqual(queue.limit, 2)
+        self.assertIsNot(admission.get_queue(('v', 'shared'), 2), queue)
+
+
+class AdmissionConnectionTestSuite(unittest.TestCase):
+
+    def connect(self, org, **kwargs):
+        connection = influxdb2_dbapi.connect(
+            org=org, token='token', single_flight=False, max_concurrent_queries=1, **kwargs)
+        self.responses = []
+
+        def post(send, retry=True):
+            response = FakeResponse(DATA)
+            self.responses.append(response)
+            return response
+
+        connection.hosts.post = post
+        return connection
+
+    def test_queries_wait_for_a_slot(self):
+        connection = self.connect('waits', queue_timeout=5)
+        first = connection.cursor().execute(QUERY)
+        self.assertEqual(first.stats['queue_seconds'], 0)
+        second = connection.cursor()
+        thread = threading.Thread(target=lambda: second.execute(QUERY))
+        thread.start()
+        wait_for(lambda: connection.admission.waiting == 1)
+        first.fetchall()
+        thread.join()
+        self.assertGreater(second.stats['queue_seconds'], 0)
+        self.assertEqual(len(second.fetchall()), 6)
+        self.assertEqual(connection.admission.running, 0)
+
+    def test_timeout(self):
+        connection = self.connect('times-out', queue_timeout=0.1)
+        first = connection.cursor().execute(QUERY)
+        with self.assertRaises(OperationalError):
+            connection.cursor().execute(QUERY)
+        first.close()
+        self.assertEqual(connection.admission.running, 0)
+
+    def test_cancel_while_queued(self):
+        connection = self.connect('cancels')
+        first = connection.cursor().execute(QUERY)
+        second = connection.cursor()
+        errors = []
+
+        def execute():
+            try:
+                second.execute(QUERY)
+            except OperationalError as error:
+                errors.append(error)
+
+        thread = threading.Thread(target=execute)
+        thread.start()
+        wait_for(lambda: connection.admission.waiting == 1)
+        second.cancel()
+        thread.join()
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(len(self.responses), 1)
+        first.close()
+        self.assertEqual(connection.admission.running, 0)
+
+    def test_subqueries_share_the_slot(self):
+        connection = self.connect('nested', queue_timeout=1)
+        cursor = connection.cursor().execute(f"""
+            SELECT a.host FROM ({QUERY}) AS a JOIN ({QUERY}) AS b
+            ON a.host = b.host AND a.time = b.time
+        """)
+        self.assertEqual(len(cursor.fetchall()), 6)
+        self.assertEqual(len(self.responses), 2)
+        cursor = connection.cursor().execute(QUERY, rowcount_query=True)
+        cursor.rowcount
+        self.assertEqual(connection.admission.running, 1)
+        cursor.close()
+        self.assertEqual(connection.admission.running, 0)
+
+    def test_url(self):
+        _, kwargs = Influxdb2Dialect().create_connect_args(make_url(
+            'influxdb2://influx/?org=o&token=t&max_concurrent_queries=4&queue_timeout=2.5'))
+        self.assertEqual(kwargs['max_concurrent_queries'], 4)
+        self.assertEqual(kwargs['queue_timeout'], 2.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
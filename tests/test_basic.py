@@ -5,54 +5,65 @@ from .context import influxdb2_dbapi
 import unittest
 
 
+def table(*names):
+    """Build an annotated CSV table with a `name` column holding `names`."""
+    lines = [
+        '#datatype,string,long,string\r\n',
+        '#group,false,false,false\r\n',
+        '#default,_result,,\r\n',
+        ',result,table,name\r\n',
+    ]
+    lines.extend(f',,0,{name}\r\n' for name in names)
+    return ''.join(lines).encode('utf-8')
+
+
+def names_from_chunks(chunks):
+    return [
+        cells[-1] for columns, cells in influxdb2_dbapi.flux.iter_csv(chunks)
+    ]
+
+
 class BasicTestSuite(unittest.TestCase):
 
     def test_rows_from_chunks_empty(self):
         chunks = []
         expected = []
-        result = list(influxdb2_dbapi.db.rows_from_chunks(chunks))
-        self.assertEquals(result, expected)
+        result = names_from_chunks(chunks)
+        self.assertEqual(result, expected)
 
     def test_rows_from_chunks_single_chunk(self):
-        chunks = ['[{"name": "alice"}, {"name": "bob"}, {"name": "charlie"}]']
-        expected = [
-            {'name': 'alice'},
-            {'name': 'bob'},
-            {'name': 'charlie'},
-        ]
-        result = list(influxdb2_dbapi.db.rows_from_chunks(chunks))
-        self.assertEquals(result, expected)
+        chunks = [table('alice', 'bob', 'charlie')]
+        expected = ['alice', 'bob', 'charlie']
+        result = names_from_chunks(chunks)
+        self.assertEqual(result, expected)
 
     def test_rows_from_chunks_multiple_chunks(self):
-        chunks = [
-            '[{"name": "alice"}, {"name": "b',
-            'ob"}, {"name": "charlie"}]',
-        ]
-        expected = [
-            {'name': 'alice'},
-            {'name': 'bob'},
-            {'name': 'charlie'},
-        ]
-        result = list(influxdb2_dbapi.db.rows_from_chunks(chunks))
-        self.assertEquals(result, expected)
-
-    def test_rows_from_chunks_bracket_in_string(self):
-        chunks = ['[{"name": "ali{ce"}, {"name": "bob"}]']
-        expected = [
-            {'name': 'ali{ce'},
-            {'name': 'bob'},
-        ]
-        result = list(influxdb2_dbapi.db.rows_from_chunks(chunks))
-        self.assertEquals(result, expected)
+        data = table('alice', 'bob', 'charlie')
+        split = data.index(b'bob') + 1
+        chunks = [data[:split], data[split:]]
+        expected = ['alice', 'bob', 'charlie']
+        result = names_from_chunks(chunks)
+        self.assertEqual(result, expected)
+
+    def test_rows_from_chunks_comma_in_string(self):
+        chunks = [table('"ali,ce"', 'bob')]
+        expected = ['ali,ce', 'bob']
+        result = names_from_chunks(chunks)
+        self.assertEqual(result, expected)
 
     def test_rows_from_chunks_quote_in_string(self):
-        chunks = [r'[{"name": "ali\"ce"}, {"name": "bob"}]']
-        expected = [
-            {'name': 'ali"ce'},
-            {'name': 'bob'},
-        ]
-        result = list(influxdb2_dbapi.db.rows_from_chunks(chunks))
-        self.assertEquals(result, expected)
+        chunks = [table('"ali""ce"', 'bob')]
+        expected = ['ali"ce', 'bob']
+        result = names_from_chunks(chunks)
+        self.assertEqual(result, expected)
+
+    def test_rows_from_chunks_character_across_chunks(self):
+        data = table('alicé', 'bob')
+        split = data.index('é'.encode('utf-8')) + 1
+        chunks = [data[:split], data[split:]]
+        expected = ['alicé', 'bob']
+        result = names_from_chunks(chunks)
+        self.assertEqual(result, expected)
 
 
 if __name__ == '__main__':
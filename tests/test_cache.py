@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+from .context import influxdb2_dbapi
+from .fixtures import HEADER, count_csv, serve_connection
+
+import os
+import re
+import shutil
+import tempfile
+import unittest
+
+from influxdb2_dbapi import flux
+from influxdb2_dbapi.cache import get_window
+
+
+QUERY = '''from(bucket: "b")
+  |> range(start: -1m)
+  |> filter(fn: (r) => r._measurement == "cpu")'''
+
+SECOND = 10 ** 9
+
+# 2023-01-01T00:10:00Z
+NOW = 1672531800 * SECOND
+
+
+def respond(query):
+    """Serve one point every 10s, valued after its time, for hosts a and b."""
+    if '|> count()' in query:
+        return count_csv(0)
+    bounds = re.search(r'range\(start: (\S+), stop: (\S+)\)', query)
+    if bounds is None:
+        return HEADER.encode('utf-8')
+    start, stop = (flux.parse_time(bound, None) for bound in bounds.groups())
+    lines = [HEADER]
+    for table, host in enumerate(['a', 'b']):
+        first = -(-start // (10 * SECOND)) * 10 * SECOND
+        for t in range(first, stop, 10 * SECOND):
+            lines.append(
+                f',,{table},{bounds.group(1)},{bounds.group(2)},'
+                f'{flux.format_time(t)},{float(t // SECOND % 3600)},usage,cpu,{host}\r\n')
+    return ''.join(lines).encode('utf-8')
+
+
+class CacheTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.connection = influxdb2_dbapi.connect(
+            org='org', token='token', cache=os.path.join(self.dir, 'cache.db'))
+        self.addCleanup(self.connection.close)
+        self.responses = serve_connection(self.connection, respond)
+        self.cache = self.connection.cache
+        self.cache.clock = lambda: NOW
+        self.cache.overlap = 10 * SECOND
+
+    def execute(self, query=QUERY):
+        cursor = self.connection.cursor()
+        sent = []
+        served = cursor._post_query
+        cursor._post_query = lambda query: sent.append(query) or served(query)
+        rows = cursor.execute(query).fetchall()
+        return sent, [(row.host, row.time.isoformat(), row.value) for row in rows]
+
+    def test_window(self):
+        key, start, stop = get_window(QUERY, NOW)
+        self.assertEqual((start, stop), (NOW - 60 * SECOND, NOW))
+        self.assertIn('range()', key)
+        self.assertIn('filter(', key)
+        for query in [
+            'from(bucket: "b") |> range(start: -1h) |> mean()',
+            'from(bucket: "b") |> range(start: v.timeRangeStart)',
+            'from(bucket: "b") |> range(start: -1mo)',
+            'import "strings"\nfrom(bucket: "b") |> range(start: -1h)',
+            QUERY + ' |> fill(usePrevious: true)',
+            QUERY + ' |> map(fn: (r) => ({r with _time: date.truncate(t: r._time, unit: 1m)}))',
+            QUERY + ' |> map(fn: (r) => ({_value: r._value, _time: r._stop}))',
+        ]:
+            with self.subTest(query=query):
+                self.assertIsNone(get_window(query, NOW))
+        for query in [
+            QUERY + ' |> fill(value: 0.0)',
+            QUERY + ' |> map(fn: (r) => ({r with _value: r._value * 2.0}))',
+            QUERY + ' |> map(fn: (r) => ({_time: r._time, _value: r._value}))',
+        ]:
+            with self.subTest(query=query):
+                self.assertIsNotNone(get_window(query, NOW))
+
+    def test_only_missing_time_is_fetched(self):
+        sent, rows = self.execute()
+        self.assertEqual(len(sent), 1)
+        self.assertIn('range(start: 2023-01-01T00:09:00.000000000Z', sent[0])
+        self.assertEqual(len(rows), 12)
+
+        self.cache.clock = lambda: NOW + 20 * SECOND
+        sent, rows = self.execute()
+        # the new 20 seconds and the overlap
+        self.assertEqual(len(sent), 1)
+        self.assertIn(
+            'range(start: 2023-01-01T00:09:50.000000000Z, '
+            'stop: 2023-01-01T00:10:20.000000000Z)', sent[0])
+        self.assertEqual(len(rows), 12)
+        self.assertEqual(rows[0], ('a', '2023-01-01T00:09:20+00:00', 560.0))
+        self.assertEqual(rows[-1], ('b', '2023-01-01T00:10:10+00:00', 610.0))
+
+        # expired points were trimmed
+        count, = self.cache.db.execute('SELECT COUNT(*) FROM points').fetchone()
+        self.assertEqual(count, 12)
+
+    def test_same_results_as_uncached(self):
+        self.execute()
+        self.cache.clock = lambda: NOW + 30 * SECOND
+        _, cached = self.execute()
+        self.connection.cache = None
+        uncached = self.execute(flux.replace_range(
+            QUERY, NOW - 30 * SECOND, NOW + 30 * SECOND))[1]
+        self.assertEqual(cached, uncached)
+
+    def test_cache_persists(self):
+        self.execute()
+        path = self.cache.path
+        connection = influxdb2_dbapi.connect(org='org', token='token', cache=path)
+        self.addCleanup(connection.close)
+        serve_connection(connection, respond)
+        connection.cache.clock = lambda: NOW
+        connection.cache.overlap = 10 * SECOND
+        self.connection = connection
+        sent, rows = self.execute()
+        self.assertEqual(len(rows), 12)
+        # only the overlap was fetched again
+        self.assertEqual(len(sent), 1)
+        self.assertIn('range(start: 2023-01-01T00:09:50.000000000Z', sent[0])
+
+    def test_uncacheable_query(self):
+        query = QUERY + '\n  |> mean()'
+        sent, _ = self.execute(query)
+        self.assertEqual(sent, [query])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+
+from .fixtures import flux_csv, serve_connection
+
+import datetime
+import unittest
+
+from sqlalchemy import (
+    Column, DateTime, Float, MetaData, String, Table, create_engine, event,
+    func, literal_column, or_, select,
+)
+from sqlalchemy.dialects import registry
+from sqlalchemy.orm import Session, declarative_base
+
+from influxdb2_dbapi.exceptions import NotSupportedError
+from influxdb2_dbapi.influxdb2_sqlalchemy import Influxdb2Dialect
+
+
+registry.register('influxdb2', 'influxdb2_dbapi.influxdb2_sqlalchemy', 'Influxdb2HTTPDialect')
+
+metadata = MetaData()
+
+cpu = Table(
+    'cpu', metadata,
+    Column('time', DateTime, primary_key=True),
+    Column('value', Float),
+    Column('field', String),
+    Column('host', String, primary_key=True),
+    schema='telegraf',
+)
+
+Base = declarative_base()
+
+
+class Cpu(Base):
+    __table__ = cpu
+
+
+def compile(statement):
+    return str(statement.compile(dialect=Influxdb2Dialect()))
+
+
+def flux_of(statement):
+    sql = compile(statement)
+    return sql[sql.index('(from(') + 1:sql.rindex(') AS')]
+
+
+class CompilerTestSuite(unittest.TestCase):
+
+    def test_raw_rows(self):
+        query = flux_of(
+            select(cpu.c.time, cpu.c.value)
+            .where(
+                cpu.c.time >= datetime.datetime(2023, 1, 1),
+                cpu.c.time < '2023-01-02',
+                cpu.c.host.in_(['a', 'b']),
+                cpu.c.field == 'usage')
+            .order_by(cpu.c.time.desc())
+            .limit(10))
+        self.assertEqual(query.split('\n  |> '), [
+            'from(bucket: "telegraf")',
+            'range(start: 2023-01-01T00:00:00.000000000Z, stop: 2023-01-02T00:00:00.000000000Z)',
+            'filter(fn: (r) => r._measurement == "cpu")',
+            'filter(fn: (r) => contains(value: r.host, set: ["a", "b"]))',
+            'filter(fn: (r) => r._field == "usage")',
+            'keep(columns: ["_time", "_value"])',
+            'group()',
+            'sort(columns: ["_time"], desc: true)',
+            'limit(n: 10, offset: 0)',
+        ])
+
+    def test_aggregates(self):
+        minute = func.date_trunc('minute', cpu.c.time)
+        query = flux_of(
+            select(cpu.c.host, minute.label('t'), func.avg(cpu.c.value))
+            .where(cpu.c.time.between(
+                datetime.datetime(2023, 1, 1), datetime.datetime(2023, 1, 2)))
+            .group_by(cpu.c.host, minute))
+        self.assertIn('stop: 2023-01-02T00:00:00.000000001Z', query)
+        self.assertIn('|> group(columns: ["host"])', query)
+        self.assertIn(
+            '|> aggregateWindow(every: 1m, fn: mean, column: "_value", '
+            'timeSrc: "_start", createEmpty: false)', query)
+
+        query = flux_of(select(func.count()).select_from(cpu))
+        self.assertIn('range(start: 1970-01-01T00:00:00.000000000Z)', query)
+        self.assertTrue(query.endswith('|> group(columns: [])\n  |> count(column: "_value")'))
+
+    def test_predicates(self):
+        query = flux_of(select(cpu).where(or_(
+            cpu.c.host.like('web-%'), cpu.c.value > 1, cpu.c.field.is_(None))))
+        self.assertIn(
+            'filter(fn: (r) => (r.host =~ /^web\\-.*$/ or r._value > 1 or not exists r._field))',
+            query)
+        # literals are escaped, and survive the DB API's parameters
+        query = flux_of(select(cpu).where(cpu.c.host == 'a "b" 100%'))
+        self.assertIn('r.host == "a \\"b\\" 100%%"', query)
+
+    def test_unsupported(self):
+        for statement in [
+            select(cpu.c.host).group_by(cpu.c.host),
+            select(func.min(cpu.c.value), func.max(cpu.c.value)),
+            select(cpu.c.host, func.avg(cpu.c.value)),
+            select(cpu.c.host).distinct(),
+            select(func.upper(cpu.c.host)),
+            select(cpu.c.host).order_by(cpu.c.host, cpu.c.time.desc()),
+        ]:
+            with self.subTest(statement=str(statement)):
+                with self.assertRaises(NotSupportedError):
+                    compile(statement)
+
+    def test_other_statements_are_sql(self):
+        self.assertEqual(compile(select(literal_column('1'))), 'SELECT 1')
+
+
+class EngineTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.sent = []
+        self.engine = create_engine('influxdb2://influx:8086/?org=o&token=t')
+
+        def respond(query):
+            self.sent.append(query)
+            return flux_csv(['a', 'b'], points=2)
+
+        @event.listens_for(self.engine, 'connect')
+        def connect(dbapi_connection, connection_record):
+            serve_connection(dbapi_connection, respond)
+
+    def test_core(self):
+        with self.engine.connect() as connection:
+            rows = connection.execute(
+                select(cpu.c.host, cpu.c.value).order_by(cpu.c.value.desc())).fetchall()
+        self.assertEqual(len(self.sent), 1)
+        self.assertIn('|> sort(columns: ["_value"], desc: true)', self.sent[0])
+        self.assertEqual([row.host for row in rows], ['a', 'a', 'b', 'b'])
+        self.assertEqual(rows[0]._mapping[cpu.c.value], 0.0)
+
+    def test_orm(self):
+        with Session(self.engine) as session:
+            points = session.query(Cpu).filter(Cpu.host == 'a').all()
+        self.assertIn('|> filter(fn: (r) => r.host == "a")', self.sent[0])
+        self.assertEqual(len(points), 4)
+        self.assertEqual(points[1].value, 1.0)
+        self.assertEqual(
+            points[1].time,
+            datetime.datetime(2023, 1, 1, 0, 0, 1, tzinfo=datetime.timezone.utc))
+
+
+if __name__ == '__main__':
+    unittest.main()
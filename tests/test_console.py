@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+from .context import influxdb2_dbapi
+from .fixtures import flux_csv, serve, serve_connection
+
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from influxdb2_dbapi import console, vectorized
+
+
+QUERY = 'from(bucket: "b") |> range(start: -1h)'
+
+
+def schema_csv(column, values):
+    lines = [
+        '#datatype,string,long,string\r\n',
+        '#group,false,false,false\r\n',
+        '#default,_result,,\r\n',
+        f',result,table,{column}\r\n',
+    ]
+    lines.extend(f',,0,{value}\r\n' for value in values)
+    return ''.join(lines).encode('utf-8')
+
+
+def respond(query):
+    if 'buckets()' in query:
+        return schema_csv('name', ['telegraf'])
+    if 'schema.measurements' in query:
+        return schema_csv('_value', ['cpu', 'mem'])
+    return schema_csv('_value', ['usage_idle'])
+
+
+class ConsoleTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.connection = influxdb2_dbapi.connect(org='org', token='token')
+
+    def test_print_results_in_pages(self):
+        cursor = self.connection.cursor()
+        serve(cursor, flux_csv(['a', 'b'], points=5))
+        out = io.StringIO()
+        rows = console.print_results(cursor.execute(QUERY), page_size=4, out=out)
+        self.assertEqual(rows, 10)
+        # headers are printed with the first page only
+        self.assertEqual(out.getvalue().count('measurement'), 1)
+
+    def test_print_results_stops_at_max_rows(self):
+        cursor = self.connection.cursor()
+        responses = serve(cursor, flux_csv(['a', 'b'], points=5))
+        out = io.StringIO()
+        rows = console.print_results(cursor.execute(QUERY), max_rows=3, out=out)
+        self.assertEqual(rows, 3)
+        self.assertIn('stopped after 3 rows', out.getvalue())
+        self.assertTrue(responses[0].closed)
+
+    def test_format_timing(self):
+        self.assertEqual(
+            console.format_timing(0.5, 2.0, 1000),
+            'Time: 0.500s to first row, 2.000s total, 1000 rows, 500 rows/s')
+
+    def test_load_autocomplete_in_background(self):
+        serve_connection(self.connection, respond)
+        completer = console.WordCompleter(['SELECT'])
+        console.load_autocomplete(self.connection, completer).join()
+        self.assertEqual(
+            completer.words,
+            ['SELECT', 'cpu', 'mem', 'telegraf', 'usage_idle'])
+
+
+
+class ExportTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.connection = influxdb2_dbapi.connect(org='org', token='token')
+        serve_connection(self.connection, flux_csv(['a', 'b'], points=50))
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.paths = []
+        for name in ('cpu', 'mem', 'disk'):
+            path = os.path.join(self.dir, f'{name}.flux')
+            with open(path, 'w') as f:
+                f.write(QUERY)
+            self.paths.append(path)
+
+    def test_export_csv_in_parallel(self):
+        out_dir = os.path.join(self.dir, 'out')
+        report = io.StringIO()
+        failed = console.export(
+            self.connection, self.paths, 'csv', out_dir, parallel=3, out=report)
+        self.assertEqual(failed, 0)
+        with open(os.path.join(out_dir, 'mem.csv')) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(len(lines), 101)
+        self.assertTrue(lines[0].startswith('result,table,start,stop,time'))
+        self.assertEqual(report.getvalue().count('100 rows in'), 3)
+
+    def test_export_jsonl(self):
+        console.export(
+            self.connection, self.paths[:1], 'jsonl', self.dir, out=io.StringIO())
+        with open(os.path.join(self.dir, 'cpu.jsonl')) as f:
+            rows = [json.loads(line) for line in f]
+        self.assertEqual(len(rows), 100)
+        self.assertEqual(rows[0]['host'], 'a')
+        self.assertEqual(rows[0]['time'], '2023-01-01 00:00:00+00:00')
+
+    def test_export_streams_sql_results(self):
+        path = os.path.join(self.dir, 'sql.flux')
+        with open(path, 'w') as f:
+            f.write(f'SELECT host, value FROM ({QUERY}) WHERE value >= 0')
+        to_rows = mock.Mock(wraps=vectorized.to_rows)
+        with mock.patch.object(vectorized, 'ROWS_PER_BATCH', 7), \
+                mock.patch.object(vectorized, 'to_rows', to_rows):
+            failed = console.export(self.connection, [path], 'csv', self.dir, out=io.StringIO())
+        self.assertEqual(failed, 0)
+        with open(os.path.join(self.dir, 'sql.csv')) as f:
+            self.assertEqual(len(f.read().splitlines()), 101)
+        self.assertEqual(to_rows.call_count, 15)
+        self.assertTrue(all(len(call.args[0][0]) <= 7 for call in to_rows.call_args_list))
+
+    def test_connection_kwargs_from_url(self):
+        kwargs = console.get_connection_kwargs(
+            'https://influx:8086/?org=acme&token=secret')
+        self.assertEqual(kwargs['port'], 8086)
+        self.assertEqual(kwargs['org'], 'acme')
+        self.assertEqual(kwargs['token'], 'secret')
+
+
+if __name__ == '__main__':
+    unittest.main()
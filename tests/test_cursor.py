@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+from .context import influxdb2_dbapi
+from .fixtures import flux_csv, serve
+
+import threading
+import unittest
+
+from influxdb2_dbapi.exceptions import OperationalError
+
+
+QUERY = 'from(bucket: "b") |> range(start: -1h)'
+
+
+class CursorTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.connection = influxdb2_dbapi.connect(org='org', token='token')
+
+    def test_execute_streams_rows(self):
+        cursor = self.connection.cursor()
+        serve(cursor, flux_csv(['a', 'b']))
+        rows = cursor.execute(QUERY).fetchall()
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(rows[0].host, 'a')
+        self.assertEqual(rows[-1].value, 2.0)
+
+    def test_cancel_from_another_thread(self):
+        cursor = self.connection.cursor()
+        responses = serve(cursor, flux_csv(['a'], points=1000), delay=0.001)
+        cursor.execute(QUERY)
+        threading.Timer(0.05, cursor.cancel).start()
+        with self.assertRaises(OperationalError):
+            cursor.fetchall()
+        self.assertTrue(responses[0].closed)
+
+    def test_execute_timeout(self):
+        cursor = self.connection.cursor()
+        serve(cursor, flux_csv(['a'], points=1000), delay=0.001)
+        with self.assertRaisesRegex(OperationalError, 'timeout'):
+            cursor.execute(QUERY, timeout=0.05).fetchall()
+
+    def test_connection_timeout_is_default(self):
+        connection = influxdb2_dbapi.connect(org='org', token='token', timeout=0.05)
+        cursor = connection.cursor()
+        serve(cursor, flux_csv(['a'], points=1000), delay=0.001)
+        with self.assertRaisesRegex(OperationalError, 'timeout'):
+            cursor.execute(QUERY).fetchall()
+
+    def test_close_connection_cancels_cursors(self):
+        cursor = self.connection.cursor()
+        responses = serve(cursor, flux_csv(['a'], points=100))
+        cursor.execute(QUERY)
+        self.connection.close()
+        self.assertTrue(responses[0].released.is_set())
+
+
+if __name__ == '__main__':
+    unittest.main()
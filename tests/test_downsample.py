@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+from .context import influxdb2_dbapi
+from .fixtures import flux_csv, serve
+
+import unittest
+
+from sqlalchemy.engine.url import make_url
+
+from influxdb2_dbapi import flux
+from influxdb2_dbapi.influxdb2_sqlalchemy import Influxdb2Dialect
+
+
+QUERY = '''from(bucket: "b")
+  |> range(start: -30d)
+  |> filter(fn: (r) => r._measurement == "cpu")
+  |> yield(name: "cpu")'''
+
+DAY = 86400 * 10 ** 9
+
+
+class DownsampleTestSuite(unittest.TestCase):
+
+    def test_window_size(self):
+        self.assertEqual(flux.get_window_size(0, 30 * DAY, 2000), 1800 * 10 ** 9)
+        self.assertEqual(flux.get_window_size(0, 60 * 10 ** 9, 2000), 30 * 10 ** 6)
+        self.assertEqual(flux.get_window_size(0, 3650 * DAY, 100), 37 * DAY)
+        self.assertEqual(flux.format_duration(1800 * 10 ** 9), '30m')
+        self.assertEqual(flux.format_duration(37 * DAY), '37d')
+
+    def test_downsample(self):
+        query, every = flux.downsample(QUERY, 2000, 0)
+        self.assertEqual(every, '30m')
+        self.assertEqual(flux.split_pipeline(query), [
+            'from(bucket: "b")',
+            'range(start: -30d)',
+            'filter(fn: (r) => r._measurement == "cpu")',
+            'aggregateWindow(every: 30m, fn: last, createEmpty: false)',
+            'yield(name: "cpu")',
+        ])
+
+    def test_queries_left_alone(self):
+        for query in [
+            QUERY.replace('yield(name: "cpu")', 'aggregateWindow(every: 1h, fn: max)'),
+            QUERY.replace('yield(name: "cpu")', 'last()'),
+            QUERY.replace('-30d', 'v.timeRangeStart'),
+            'buckets()',
+        ]:
+            with self.subTest(query=query):
+                self.assertEqual(flux.downsample(query, 2000, 0), (query, None))
+
+    def test_execute(self):
+        connection = influxdb2_dbapi.connect(
+            org='org', token='token', max_points_per_series=100)
+        cursor = connection.cursor()
+        sent = []
+        serve(cursor, lambda query: sent.append(query) or flux_csv(['a']))
+        cursor.execute(QUERY).fetchall()
+        self.assertIn('aggregateWindow(every: 12h, fn: last', sent[-1])
+        self.assertEqual(cursor.stats['windows'], {QUERY: '12h'})
+
+        cursor.execute(QUERY, max_points_per_series=30).fetchall()
+        self.assertIn('aggregateWindow(every: 1d, fn: last', sent[-1])
+
+        cursor.execute(QUERY, max_points_per_series=0).fetchall()
+        self.assertEqual(sent[-1], QUERY)
+        self.assertNotIn('windows', cursor.stats)
+
+    def test_subqueries_left_alone(self):
+        connection = influxdb2_dbapi.connect(
+            org='org', token='token', max_points_per_series=100)
+        cursor = connection.cursor()
+        sent = []
+        serve(cursor, lambda query: sent.append(query) or flux_csv(['a']))
+        rows = cursor.execute(f'SELECT COUNT(*) FROM ({QUERY})').fetchall()
+        self.assertEqual(sent, [QUERY])
+        self.assertEqual(rows[0][0], 3)
+        self.assertNotIn('windows', cursor.stats)
+
+    def test_explain_shows_rewritten_query(self):
+        connection = influxdb2_dbapi.connect(
+            org='org', token='token', max_points_per_series=100)
+        cursor = connection.cursor()
+        serve(cursor, flux_csv(['a']))
+        plan = cursor.execute(f'EXPLAIN ANALYZE {QUERY}').fetchall()
+        self.assertIn('aggregateWindow(every: 12h', plan[0].query)
+
+    def test_url(self):
+        _, kwargs = Influxdb2Dialect().create_connect_args(make_url(
+            'influxdb2://influx:8086/?org=o&token=t&max_points_per_series=2000'))
+        self.assertEqual(kwargs['max_points_per_series'], 2000)
+
+
+if __name__ == '__main__':
+    unittest.main()
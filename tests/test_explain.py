@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+from .context import influxdb2_dbapi
+from .fixtures import count_csv, flux_csv, serve
+
+import unittest
+
+
+FLUX = '''from(bucket: "b")
+  |> range(start: -1h)
+'''
+
+WRAPPED = f'''SELECT host, AVG(value) AS avg FROM (
+{FLUX}
+) AS "virtual_table" GROUP BY host'''
+
+
+def respond(query):
+    if '|> count()' in query:
+        return count_csv(6)
+    return flux_csv(['a', 'b'])
+
+
+class ExplainTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.cursor = influxdb2_dbapi.connect(org='org', token='token').cursor()
+        self.responses = serve(self.cursor, respond)
+
+    def test_explain_plain_flux(self):
+        plan = self.cursor.execute(f'EXPLAIN {FLUX}').fetchall()
+        self.assertEqual(len(plan), 1)
+        self.assertEqual(plan[0].engine, 'influxdb2')
+        self.assertEqual(plan[0].rows, 6)
+        self.assertIsNone(plan[0].seconds)
+        self.assertEqual(self.cursor.description[0][0], 'stage')
+
+    def test_explain_wrapped_sql(self):
+        plan = self.cursor.execute(f'EXPLAIN {WRAPPED}').fetchall()
+        self.assertEqual([stage.engine for stage in plan], ['influxdb2', 'vectorized'])
+        self.assertIn('range(start: -1h)', plan[0].query)
+        self.assertIn('FROM (SELECT * FROM Model)', plan[1].query)
+        self.assertEqual(plan[0].rows, 6)
+        # only the count query was sent
+        self.assertEqual(len(self.responses), 1)
+
+    def test_explain_sqlite_fallback(self):
+        query = WRAPPED.replace('host, AVG', 'UPPER(host), AVG')
+        plan = self.cursor.execute(f'EXPLAIN ANALYZE {query}').fetchall()
+        self.assertEqual(plan[1].engine, 'sqlite')
+        self.assertEqual(plan[1].rows, 2)
+
+    def test_explain_analyze(self):
+        plan = self.cursor.execute(f'EXPLAIN ANALYZE {WRAPPED}').fetchall()
+        self.assertEqual(plan[0].rows, 6)
+        self.assertEqual(plan[1].rows, 2)
+        self.assertTrue(all(stage.seconds >= 0 for stage in plan))
+
+
+if __name__ == '__main__':
+    unittest.main()
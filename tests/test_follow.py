@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+from .context import influxdb2_dbapi
+from .fixtures import HEADER, serve
+
+import re
+import threading
+import unittest
+
+from influxdb2_dbapi import flux
+from influxdb2_dbapi.exceptions import NotSupportedError, ProgrammingError
+
+
+QUERY = 'from(bucket: "b") |> range(start: -30s)'
+
+SECOND = 10 ** 9
+
+
+class Server(object):
+    """Serve a point every 10s for hosts a and b; time advances 20s per query."""
+
+    def __init__(self):
+        self.now = 1672531800 * SECOND
+        self.queries = []
+
+    def __call__(self, query):
+        self.queries.append(query)
+        self.now += 20 * SECOND
+        bound = re.search(r'range\(start: ([^,)]+)', query).group(1)
+        start = flux.parse_time(bound, self.now)
+        first = -(-start // (10 * SECOND)) * 10 * SECOND
+        lines = [HEADER]
+        for table, host in enumerate(['a', 'b']):
+            for t in range(first, self.now + 1, 10 * SECOND):
+                lines.append(
+                    f',,{table},{flux.format_time(start)},{flux.format_time(self.now)},'
+                    f'{flux.format_time(t)},{float(t // SECOND % 3600)},usage,cpu,{host}\r\n')
+        return ''.join(lines).encode('utf-8')
+
+
+class FollowTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.cursor = influxdb2_dbapi.connect(org='org', token='token').cursor()
+        self.server = Server()
+        serve(self.cursor, self.server)
+
+    def follow(self, polls):
+        rows = []
+        for row in self.cursor.follow(QUERY, interval=0):
+            rows.append((row.host, row.value))
+            if len(self.server.queries) == polls and len(rows) % 2 == 0:
+                self.cursor.cancel()
+        return rows
+
+    def test_follow(self):
+        rows = self.follow(polls=3)
+        self.assertEqual(len(self.server.queries), 3)
+        # polls start at the last point seen
+        self.assertIn('range(start: 2023-01-01T00:10:20.000000000Z)', self.server.queries[1])
+        self.assertIn('range(start: 2023-01-01T00:10:40.000000000Z)', self.server.queries[2])
+        # each point is yielded once, in order for every host
+        self.assertEqual(len(rows), len(set(rows)))
+        values = [value for host, value in rows if host == 'a']
+        self.assertEqual(values, [float(v) for v in range(590, 661, 10)])
+        self.assertEqual(self.cursor.description[0][0], 'result')
+
+    def test_cancel_between_polls(self):
+        cursor, queries = self.cursor, self.server.queries
+
+        class Event(threading.Event):
+            def wait(self, timeout=None):
+                # cancelled right after the interval, before the next poll;
+                # stop after a few polls should the cancel be lost
+                cursor.cancel()
+                return len(queries) > 3
+
+        cursor._cancel_event = Event()
+        rows = list(cursor.follow(QUERY, interval=0))
+        self.assertEqual(len(self.server.queries), 1)
+        self.assertEqual(len(rows), 8)
+
+    def test_unsupported_queries(self):
+        with self.assertRaises(NotSupportedError):
+            self.cursor.follow(f'SELECT * FROM ({QUERY})')
+        with self.assertRaises(ProgrammingError):
+            self.cursor.follow('buckets()')
+
+    def test_close_stops_following(self):
+        rows = self.cursor.follow(QUERY, interval=0)
+        next(rows)
+        self.cursor.close()
+        self.assertEqual(list(rows), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
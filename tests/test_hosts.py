@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+
+from .context import influxdb2_dbapi
+from .fixtures import FakeResponse, flux_csv
+
+import time
+import unittest
+from unittest import mock
+
+from influxdb_client.rest import ApiException
+from sqlalchemy.engine.url import make_url
+from urllib3.exceptions import ProtocolError, ReadTimeoutError
+
+from influxdb2_dbapi import hosts
+from influxdb2_dbapi.console import get_connection_kwargs
+from influxdb2_dbapi.influxdb2_sqlalchemy import Influxdb2Dialect
+
+
+QUERY = 'from(bucket: "b") |> range(start: -1h)'
+
+
+def make_pool(count=3):
+    return hosts.HostPool([
+        hosts.Node(f'http://node{i}:8086', mock.Mock()) for i in range(count)])
+
+
+class HostPoolTestSuite(unittest.TestCase):
+
+    def test_parse_hosts(self):
+        self.assertEqual(hosts.parse_hosts('localhost', 8086), [('localhost', 8086)])
+        self.assertEqual(
+            hosts.parse_hosts('a, b:9999,[::1]:8087,[::2]', 8086),
+            [('a', 8086), ('b', 9999), ('[::1]', 8087), ('[::2]', 8086)])
+        self.assertEqual(hosts.parse_hosts(['a', 'b:1'], 80), [('a', 80), ('b', 1)])
+
+    def test_least_outstanding(self):
+        pool = make_pool()
+        responses = [pool.post(lambda node: FakeResponse(node.url.encode())) for _ in range(3)]
+        # one request on each node
+        self.assertEqual(sorted(r.data for r in responses), [
+            b'http://node0:8086', b'http://node1:8086', b'http://node2:8086'])
+        responses[1].close()
+        responses[1].close()
+        again = pool.post(lambda node: FakeResponse(node.url.encode()))
+        self.assertEqual(again.data, responses[1].data)
+        self.assertEqual([node.outstanding for node in pool.nodes], [1, 1, 1])
+
+    def test_failover_and_ejection(self):
+        pool = make_pool()
+        down = pool.nodes[0]
+        sent = []
+
+        def send(node):
+            sent.append(node)
+            if node is down:
+                raise ProtocolError('Connection reset')
+            return FakeResponse(b'')
+
+        for _ in range(6):
+            pool.post(send).close()
+        # the node failed twice, then was ejected
+        self.assertEqual(sent.count(down), hosts.EJECT_AFTER)
+        self.assertEqual(len([node for node in sent if node is not down]), 6)
+        self.assertEqual(pool.healthy(), pool.nodes[1:])
+        self.assertEqual([node.outstanding for node in pool.nodes], [0, 0, 0])
+
+    def test_query_errors_are_not_retried(self):
+        pool = make_pool()
+        for error in [ApiException(status=400), ReadTimeoutError(None, None, 'slow')]:
+            sent = []
+
+            def send(node):
+                sent.append(node)
+                raise error
+
+            with self.subTest(error=error):
+                with self.assertRaises(type(error)):
+                    pool.post(send)
+                self.assertEqual(len(sent), 1)
+        self.assertEqual(pool.healthy(), pool.nodes)
+
+    def test_writes_are_not_retried(self):
+        self.assertTrue(hosts.writes(f'{QUERY} |> to(bucket: "copy")'))
+        self.assertTrue(hosts.writes(f'{QUERY} |> experimental.to(bucket: "copy")'))
+        self.assertFalse(hosts.writes(f'{QUERY} |> toFloat()'))
+        pool = make_pool()
+        send = mock.Mock(side_effect=ApiException(status=503))
+        with self.assertRaises(ApiException):
+            pool.post(send, retry=False)
+        self.assertEqual(send.call_count, 1)
+
+    def test_ejected_nodes_are_probed(self):
+        pool = make_pool(2)
+        down = pool.nodes[0]
+        send = mock.Mock(side_effect=ApiException(status=502))
+        with mock.patch.object(hosts, 'EJECT_SECONDS', 0):
+            for _ in range(hosts.EJECT_AFTER):
+                with self.assertRaises(ApiException):
+                    pool.post(send)
+            # both nodes failed, and were ejected
+            self.assertEqual(pool.healthy(), [])
+            with mock.patch.object(hosts.requests, 'get') as get:
+                get.return_value.ok = True
+                pool.post(lambda node: FakeResponse(b'')).close()
+                for _ in range(100):
+                    if pool.healthy() == pool.nodes:
+                        break
+                    time.sleep(0.01)
+        get.assert_any_call(f'{down.url}/ping', timeout=hosts.PROBE_TIMEOUT)
+        self.assertEqual(pool.healthy(), pool.nodes)
+
+
+class MultiHostConnectionTestSuite(unittest.TestCase):
+
+    def test_queries_fail_over(self):
+        connection = influxdb2_dbapi.connect(
+            host='a,b:9999', org='org', token='token', single_flight=False)
+        self.assertEqual(connection.url, 'http://a:8086,http://b:9999')
+        first, second = connection.hosts.nodes
+        first.client = mock.Mock()
+        first.client.query_api.return_value._query_api.post_query.side_effect = ProtocolError('reset')
+        second.client = mock.Mock()
+        second.client.query_api.return_value._query_api.post_query.side_effect = (
+            lambda **kwargs: FakeResponse(flux_csv(['a'])))
+
+        cursor = connection.cursor()
+        rows = cursor.execute(QUERY).fetchall()
+        self.assertEqual(len(rows), 3)
+        self.assertIn(cursor.stats['hosts'], [
+            ['http://a:8086', 'http://b:9999'], ['http://b:9999']])
+        self.assertEqual([node.outstanding for node in connection.hosts.nodes], [0, 0])
+
+    def test_urls(self):
+        dialect = Influxdb2Dialect()
+        _, kwargs = dialect.create_connect_args(make_url(
+            'influxdb2://a,b,c:8086/?org=o&token=t'))
+        self.assertEqual(hosts.parse_hosts(kwargs['host'], kwargs['port']), [
+            ('a', 8086), ('b', 8086), ('c', 8086)])
+        _, kwargs = dialect.create_connect_args(make_url(
+            'influxdb2://influx/?org=o&token=t&hosts=a:8086,b:8087'))
+        self.assertEqual(kwargs['host'], 'a:8086,b:8087')
+
+        kwargs = get_connection_kwargs('http://a:8086,b:8087/?org=o')
+        self.assertEqual(hosts.parse_hosts(kwargs['host'], kwargs['port']), [
+            ('a', 8086), ('b', 8087)])
+
+
+if __name__ == '__main__':
+    unittest.main()
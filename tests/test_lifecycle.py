@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+from .context import influxdb2_dbapi
+from .fixtures import flux_csv, serve
+
+import gc
+import os
+import threading
+import unittest
+
+from influxdb2_dbapi.exceptions import Error
+
+
+QUERY = 'from(bucket: "b") |> range(start: -1h)'
+
+# UPPER is not vectorized, so this runs on SQLite
+SQL = f'SELECT UPPER(host) FROM ({QUERY})'
+
+DATA = flux_csv(['a', 'b'], points=2)
+
+# run with SOAK_QUERIES=100000 for the full soak
+SOAK_QUERIES = int(os.environ.get('SOAK_QUERIES', 2000))
+SOAK_THREADS = 8
+SOAK_ROUNDS = 10
+
+
+def live_objects():
+    gc.collect()
+    return len(gc.get_objects())
+
+
+class LifecycleTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.connection = influxdb2_dbapi.connect(org='org', token='token')
+
+    def cursor(self):
+        cursor = self.connection.cursor()
+        serve(cursor, DATA)
+        return cursor
+
+    def test_cursors_are_not_retained(self):
+        for _ in range(10):
+            self.cursor().execute(QUERY).fetchall()
+        gc.collect()
+        self.assertEqual(len(self.connection.cursors), 0)
+
+    def test_exhaustion_releases_results(self):
+        cursor = self.cursor()
+        cursor.execute(SQL)
+        self.assertIsNotNone(cursor.sqliteengine)
+        self.assertEqual(len(cursor.fetchall()), 4)
+        self.assertIsNone(cursor.sqliteengine)
+        self.assertEqual(cursor.fetchall(), [])
+
+    def test_close_releases_results(self):
+        cursor = self.cursor()
+        cursor.execute(SQL)
+        cursor.close()
+        self.assertIsNone(cursor.sqliteengine)
+        self.assertEqual(list(cursor._results), [])
+
+    def test_close_connection_closes_open_cursors(self):
+        cursor = self.cursor()
+        cursor.execute(QUERY)
+        self.connection.close()
+        self.assertTrue(cursor.closed)
+        with self.assertRaises(Error):
+            self.connection.cursor()
+
+    def test_concurrent_cursors_and_close(self):
+        cursors = []
+        started = threading.Barrier(SOAK_THREADS + 1)
+
+        def create():
+            started.wait()
+            while True:
+                try:
+                    cursors.append(self.connection.cursor())
+                except Error:
+                    return
+
+        threads = [threading.Thread(target=create) for _ in range(SOAK_THREADS)]
+        for thread in threads:
+            thread.start()
+        started.wait()
+        self.connection.close()
+        for thread in threads:
+            thread.join()
+        # every cursor created before the connection closed was closed with it
+        self.assertTrue(all(cursor.closed for cursor in cursors))
+
+    def test_memory_is_flat(self):
+        """Run `SOAK_QUERIES` queries from threads sharing one connection."""
+        errors = []
+
+        def run(queries):
+            try:
+                for i in range(queries):
+                    cursor = self.cursor()
+                    cursor.execute(SQL if i % 100 == 0 else QUERY)
+                    if i % 3 == 0:
+                        cursor.fetchone()  # abandoned mid-results
+                    else:
+                        cursor.fetchall()
+                    if i % 2 == 0:
+                        cursor.close()
+            except Exception as e:
+                errors.append(e)
+
+        counts = []
+        per_thread = SOAK_QUERIES // SOAK_ROUNDS // SOAK_THREADS
+        for _ in range(SOAK_ROUNDS):
+            threads = [
+                threading.Thread(target=run, args=(per_thread,))
+                for _ in range(SOAK_THREADS)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            counts.append(live_objects())
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(self.connection.cursors), 0)
+        # the first round warms up caches of the libraries
+        self.assertLess(max(counts[1:]) - counts[1], 1000, counts)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+
+from .context import influxdb2_dbapi
+from .fixtures import FakeResponse, flux_csv, serve
+
+import gc
+import time
+import unittest
+
+from influxdb2_dbapi import metrics
+from influxdb2_dbapi.exceptions import OperationalError
+
+
+QUERY = 'from(bucket: "b") |> range(start: -1h)'
+
+DATA = flux_csv(['a', 'b'], points=5)
+
+
+def values():
+    return {metric.name: metric.samples for metric in metrics.collect()}
+
+
+def value(name):
+    return values()[metrics.PREFIX + name][-1][2]
+
+
+class RegistryTestSuite(unittest.TestCase):
+
+    def test_render(self):
+        registry = metrics.Registry()
+        counter = registry.counter('things_total', 'Things.')
+        histogram = registry.histogram('wait_seconds', 'Waits.', buckets=(0.1, 1))
+        counter.inc(3)
+        for seconds in [0.05, 0.5, 0.5, 5]:
+            histogram.observe(seconds)
+        self.assertEqual(registry.render(), '\n'.join([
+            '# HELP influxdb2_dbapi_things_total Things.',
+            '# TYPE influxdb2_dbapi_things_total counter',
+            'influxdb2_dbapi_things_total 3',
+            '# HELP influxdb2_dbapi_wait_seconds Waits.',
+            '# TYPE influxdb2_dbapi_wait_seconds histogram',
+            'influxdb2_dbapi_wait_seconds_bucket{le="0.1"} 1',
+            'influxdb2_dbapi_wait_seconds_bucket{le="1"} 3',
+            'influxdb2_dbapi_wait_seconds_bucket{le="+Inf"} 4',
+            'influxdb2_dbapi_wait_seconds_sum 6.05',
+            'influxdb2_dbapi_wait_seconds_count 4',
+        ]) + '\n')
+
+    def test_exporters(self):
+        registry = metrics.Registry()
+        registry.counter('things_total', 'Things.').inc()
+        exported = []
+
+        def failing(collected):
+            raise ValueError('down')
+
+        registry.add_exporter(failing)
+        registry.add_exporter(exported.append)
+        with self.assertLogs(metrics.logger, 'WARNING'):
+            registry.export()
+        self.assertEqual(exported, [[metrics.Metric(
+            'influxdb2_dbapi_things_total', 'counter', 'Things.',
+            [('influxdb2_dbapi_things_total', (), 1)])]])
+        registry.remove_exporter(exported.append)
+        registry.remove_exporter(failing)
+        registry.export()
+        self.assertEqual(len(exported), 1)
+
+
+class DriverMetricsTestSuite(unittest.TestCase):
+
+    def test_queries(self):
+        before = values()
+        connection = influxdb2_dbapi.connect(org='org', token='token', single_flight=False)
+        responses = []
+
+        def post(send, retry=True):
+            responses.append(FakeResponse(DATA))
+            return responses[-1]
+
+        connection.hosts.post = post
+        cursor = connection.cursor()
+        self.assertEqual(value('cursors_open'), before[metrics.PREFIX + 'cursors_open'][0][2] + 1)
+        self.assertEqual(len(cursor.execute(QUERY).fetchall()), 10)
+        cursor.execute(f'SELECT host, SUM(value) FROM ({QUERY}) GROUP BY host HAVING SUM(value) > 0')
+        self.assertEqual(len(cursor.fetchall()), 2)
+        connection.close()
+
+        after = values()
+
+        def delta(name):
+            name = metrics.PREFIX + name
+            return after[name][-1][2] - before[name][-1][2]
+
+        self.assertEqual(delta('queries_total'), 2)
+        self.assertEqual(delta('query_seconds'), 2)
+        self.assertEqual(delta('time_to_first_byte_seconds'), 2)
+        self.assertEqual(delta('rows_total'), 12)
+        self.assertEqual(delta('response_bytes_total'), 2 * len(DATA))
+        self.assertEqual(delta('sqlite_fallbacks_total'), 1)
+        self.assertEqual(delta('cursors_total'), 1)
+        self.assertEqual(delta('cursors_open'), 0)
+        self.assertEqual(delta('connections_open'), 0)
+        self.assertEqual(delta('queries_in_flight'), 0)
+
+    def test_cancellations_and_errors(self):
+        connection = influxdb2_dbapi.connect(org='org', token='token')
+        cursor = connection.cursor()
+        serve(cursor, DATA, delay=0.01)
+        cancellations = value('cancellations_total')
+        cursor.execute(QUERY)
+        cursor.cancel()
+        with self.assertRaises(OperationalError):
+            cursor.fetchall()
+        self.assertEqual(value('cancellations_total'), cancellations + 1)
+
+        errors = value('query_errors_total')
+        cursor._post_query = lambda query: FakeResponse(b',result,table,error,reference\r\n,,0,bad,\r\n')
+        with self.assertRaises(Exception):
+            cursor.execute(QUERY)
+        self.assertEqual(value('query_errors_total'), errors + 1)
+
+    def test_garbage_collected_cursors(self):
+        connection = influxdb2_dbapi.connect(org='org', token='token')
+        open_cursors = value('cursors_open')
+        connection.cursor()
+        gc.collect()
+        self.assertEqual(value('cursors_open'), open_cursors)
+
+    def test_overhead(self):
+        # the updates made per query, against the cost of a query served from
+        # memory, let alone one sent over the network
+        connection = influxdb2_dbapi.connect(org='org', token='token')
+        cursor = connection.cursor()
+        serve(cursor, DATA)
+        start = time.perf_counter()
+        for _ in range(20):
+            cursor.execute(QUERY).fetchall()
+        query_seconds = (time.perf_counter() - start) / 20
+
+        count = 10000
+        start = time.perf_counter()
+        for _ in range(count):
+            metrics.QUERIES.inc()
+            metrics.TIME_TO_FIRST_BYTE.observe(0.01)
+            metrics.QUERIES_IN_FLIGHT.inc()
+            metrics.QUERIES_IN_FLIGHT.dec()
+            metrics.QUERY_SECONDS.observe(0.1)
+            metrics.RESPONSE_BYTES.inc(1000)
+            metrics.ROWS.inc(10)
+        update_seconds = (time.perf_counter() - start) / count
+        self.assertLess(update_seconds, query_seconds / 20)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+from .context import influxdb2_dbapi
+from .fixtures import flux_csv, serve
+
+import unittest
+
+from sqlalchemy import text
+
+from influxdb2_dbapi.db import get_indexed_columns
+
+
+FLUX = '''from(bucket: "b")
+  |> range(start: -1h)
+'''
+
+# UPPER is not vectorized, so this runs on SQLite
+QUERY = f'''SELECT UPPER(host), AVG(value) FROM (
+{FLUX}
+) AS "virtual_table" WHERE time > '2023-01-01 00:00:00.000000' GROUP BY host ORDER BY 2'''
+
+
+class ModelTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.cursor = influxdb2_dbapi.connect(org='org', token='token').cursor()
+        serve(self.cursor, flux_csv(['a', 'b'], points=3))
+        # the two rows, without exhausting the cursor, which drops the model
+        self.rows = self.cursor.execute(QUERY).fetchmany(2)
+
+    def query_model(self, sql):
+        with self.cursor.sqliteengine.connect() as connection:
+            return connection.execute(text(sql)).fetchall()
+
+    def test_results(self):
+        self.assertEqual(self.cursor.stats['executor'], 'sqlite')
+        self.assertEqual([tuple(row) for row in self.rows], [('A', 1.5), ('B', 1.5)])
+
+    def test_columns_are_typed(self):
+        columns = {
+            row[1]: row[2] for row in self.query_model('PRAGMA table_info(Model)')}
+        self.assertNotIn('index', columns)
+        self.assertEqual(columns['value'], 'FLOAT')
+        self.assertEqual(columns['table'], 'BIGINT')
+        self.assertEqual(columns['time'], 'DATETIME')
+        self.assertEqual(columns['host'], 'TEXT')
+
+    def test_indexes(self):
+        indexed = [
+            row[0] for row in self.query_model(
+                "SELECT sql FROM sqlite_master WHERE type = 'index'")]
+        self.assertEqual(len(indexed), 2)
+        self.assertIn('("time")', indexed[0])
+        self.assertIn('("host")', indexed[1])
+        plan = self.query_model(
+            "EXPLAIN QUERY PLAN SELECT * FROM Model WHERE host = 'a'")
+        self.assertIn('USING INDEX', plan[0][-1])
+
+    def test_pragmas(self):
+        self.assertEqual(self.query_model('PRAGMA synchronous')[0][0], 0)
+        self.assertEqual(self.query_model('PRAGMA temp_store')[0][0], 2)
+
+    def test_indexed_columns(self):
+        names = ['time', 'value', 'host', 'table', 'result']
+        self.assertEqual(get_indexed_columns(
+            'SELECT host, value FROM (SELECT * FROM Model) AS a '
+            'JOIN (SELECT * FROM Model) AS b ON a."table" = b."table" '
+            "WHERE a.time > 'host' AND VALUE IN (1, 2) "
+            'GROUP BY result HAVING COUNT(host) > 1 ORDER BY 1',
+            names), ['table', 'time', 'value', 'result'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+from .context import influxdb2_dbapi
+from .fixtures import flux_csv, serve
+
+import unittest
+
+from sqlalchemy.engine.url import make_url
+
+from influxdb2_dbapi import flux, optimizer
+from influxdb2_dbapi.influxdb2_sqlalchemy import Influxdb2Dialect
+
+
+FROM = 'from(bucket: "b")'
+RANGE = 'range(start: -1h)'
+
+
+def pipeline(*stages):
+    return ' |> '.join((FROM,) + stages)
+
+
+class OptimizerTestSuite(unittest.TestCase):
+
+    def assertOptimized(self, query, stages, rewrites):
+        optimized, applied, _ = optimizer.optimize(query)
+        self.assertEqual(flux.split_pipeline(optimized), [FROM] + stages)
+        self.assertEqual(applied, rewrites)
+
+    def test_filter_moves_before_map(self):
+        self.assertOptimized(
+            pipeline(
+                RANGE,
+                'map(fn: (r) => ({r with v: r._value * 2.0}))',
+                'filter(fn: (r) => r.host == "a" and r.v > 1.0)'),
+            [RANGE,
+             'filter(fn: (r) => r.host == "a")',
+             'map(fn: (r) => ({r with v: r._value * 2.0}))',
+             'filter(fn: (r) => r.v > 1.0)'],
+            ['moved filter() before map()'])
+
+    def test_filter_moves_before_pivot_on_measurement(self):
+        pivot = 'pivot(rowKey: ["_time"], columnKey: ["_field"], valueColumn: "_value")'
+        self.assertOptimized(
+            pipeline(RANGE, pivot, 'filter(fn: (r) => r._measurement == "cpu" and r.user > 50)'),
+            [RANGE, 'filter(fn: (r) => r._measurement == "cpu")', pivot,
+             'filter(fn: (r) => r.user > 50)'],
+            ['moved filter() before pivot()'])
+
+    def test_range_moves_next_to_from(self):
+        self.assertOptimized(
+            pipeline('filter(fn: (r) => r._measurement == "cpu")', RANGE),
+            [RANGE, 'filter(fn: (r) => r._measurement == "cpu")'],
+            ['moved range() before filter()'])
+
+    def test_adjacent_filters_merge(self):
+        self.assertOptimized(
+            pipeline(
+                RANGE,
+                'filter(fn: (r) => r._measurement == "cpu")',
+                'filter(fn: (r) => r.host == "a" or r.host == "b")'),
+            [RANGE, 'filter(fn: (r) => r._measurement == "cpu" and (r.host == "a" or r.host == "b"))'],
+            ['merged 2 filter()s'])
+
+    def test_drop_moves_before_map(self):
+        self.assertOptimized(
+            pipeline(RANGE, 'map(fn: (r) => ({r with v: r._value}))', 'drop(columns: ["host"])'),
+            [RANGE, 'drop(columns: ["host"])', 'map(fn: (r) => ({r with v: r._value}))'],
+            ['moved drop() before map()'])
+
+    def test_stages_that_do_not_commute_stay(self):
+        for query in [
+            # the filter reads what the map writes
+            pipeline(RANGE, 'map(fn: (r) => ({r with host: "x"}))', 'filter(fn: (r) => r.host == "a")'),
+            # the map replaces the record
+            pipeline(RANGE, 'map(fn: (r) => ({_value: r._value}))', 'filter(fn: (r) => r.host == "a")'),
+            # the filter reads the record as a whole
+            pipeline(RANGE, 'map(fn: (r) => ({r with v: 1}))', 'filter(fn: (r) => check(r: r))'),
+            # renamed columns, and values filled from the previous row
+            pipeline(RANGE, 'rename(columns: {host: "h"})', 'filter(fn: (r) => r.h == "a")'),
+            pipeline(RANGE, 'fill(usePrevious: true)', 'filter(fn: (r) => r.host == "a")'),
+            # the drop removes what the map reads
+            pipeline(RANGE, 'map(fn: (r) => ({r with v: r.host}))', 'drop(columns: ["host"])'),
+            pipeline(RANGE, 'limit(n: 10)', 'filter(fn: (r) => r.host == "a")'),
+            'buckets()',
+        ]:
+            with self.subTest(query=query):
+                self.assertEqual(optimizer.optimize(query)[:2], (query, []))
+
+    def test_string_and_regex_literals(self):
+        optimized, _, _ = optimizer.optimize(pipeline(
+            RANGE,
+            'map(fn: (r) => ({r with v: "r.host and"}))',
+            'filter(fn: (r) => r.host =~ /and|or/ and r["_field"] == "a or b")'))
+        self.assertEqual(flux.split_pipeline(optimized)[2],
+                         'filter(fn: (r) => r.host =~ /and|or/ and r["_field"] == "a or b")')
+
+    def test_warnings(self):
+        self.assertEqual(optimizer.optimize(pipeline('filter(fn: (r) => true)'))[2], [
+            'from() without range() reads the whole bucket'])
+        _, _, warnings = optimizer.optimize(pipeline(
+            RANGE, 'map(fn: (r) => ({r with host: "x"}))', 'filter(fn: (r) => r.host == "a")'))
+        self.assertEqual(warnings, ['filter() after map() runs over every point read'])
+
+    def test_execute(self):
+        query = pipeline(
+            RANGE, 'map(fn: (r) => ({r with v: 1}))', 'filter(fn: (r) => r.host == "a")')
+        connection = influxdb2_dbapi.connect(org='org', token='token', optimize_flux=True)
+        cursor = connection.cursor()
+        sent = []
+        serve(cursor, lambda query: sent.append(query) or flux_csv(['a']))
+        cursor.execute(query).fetchall()
+        self.assertEqual(flux.get_function(flux.split_pipeline(sent[-1])[2]), 'filter')
+        self.assertEqual(cursor.stats['rewrites'], {query: ['moved filter() before map()']})
+
+        cursor.execute(query, optimize_flux=False).fetchall()
+        self.assertEqual(sent[-1], query)
+        self.assertNotIn('rewrites', cursor.stats)
+
+    def test_url(self):
+        _, kwargs = Influxdb2Dialect().create_connect_args(make_url(
+            'influxdb2://influx/?org=o&token=t&optimize_flux=yes'))
+        self.assertTrue(kwargs['optimize_flux'])
+
+
+if __name__ == '__main__':
+    unittest.main()
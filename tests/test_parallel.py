@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+from .context import influxdb2_dbapi
+from .fixtures import flux_csv, serve
+
+import unittest
+from unittest import mock
+
+from influxdb2_dbapi import flux, parallel
+
+
+QUERY = 'from(bucket: "b") |> range(start: -1h)'
+
+# a table of multi-line values that look like annotations
+MESSAGES = (
+    '#datatype,string,long,string\r\n'
+    '#group,false,false,true\r\n'
+    '#default,_result,,\r\n'
+    ',result,table,msg\r\n'
+    + ''.join(f',,3,"line {i}\n#not, ""an"" annotation"\r\n' for i in range(20))
+).encode('utf-8')
+
+DATA = flux_csv(['a', 'b'], points=50) + b'\r\n' + MESSAGES + b'\r\n' + flux_csv(['c'], points=20)
+
+
+def chunked(data, size=13):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+class ParallelTestSuite(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.connection = influxdb2_dbapi.connect(
+            org='org', token='token', decode_processes=2)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.connection.close()
+
+    def test_segments_decode_on_their_own(self):
+        expected = flux.read_columns(flux.iter_csv([DATA]))
+        for size in [1, 100, 1000, len(DATA)]:
+            with self.subTest(size=size):
+                segments = list(parallel.iter_segments(chunked(DATA), size))
+                blocks = [
+                    block for segment in segments
+                    for block in parallel.decode_segment(segment)]
+                columns = flux.merge_blocks(blocks)
+                self.assertEqual(list(columns), list(expected))
+                for name, array in expected.items():
+                    self.assertEqual(
+                        columns[name].astype(str).tolist(), array.astype(str).tolist())
+
+    def execute(self, query, connection):
+        cursor = connection.cursor()
+        serve(cursor, DATA)
+        return [tuple(row) for row in cursor.execute(query).fetchall()]
+
+    def test_same_results_as_one_process(self):
+        single = influxdb2_dbapi.connect(org='org', token='token')
+        with mock.patch.object(parallel, 'SEGMENT_SIZE', 1000):
+            for query in [
+                QUERY,
+                f'SELECT host, SUM(value) FROM ({QUERY}) GROUP BY host ORDER BY host',
+                f'SELECT msg FROM ({QUERY}) WHERE msg IS NOT NULL',
+            ]:
+                with self.subTest(query=query):
+                    self.assertEqual(
+                        self.execute(query, self.connection),
+                        self.execute(query, single))
+
+    def test_rows_stream_in_order(self):
+        with mock.patch.object(parallel, 'SEGMENT_SIZE', 500):
+            rows = self.execute(QUERY, self.connection)
+        hosts = [row[-1] for row in rows if len(row) > 4]
+        self.assertEqual(hosts, ['a'] * 50 + ['b'] * 50 + ['c'] * 20)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+
+from .context import influxdb2_dbapi
+from .fixtures import FakeResponse, flux_csv, serve, wait_for
+
+import time
+import unittest
+from unittest import mock
+
+from sqlalchemy.engine.url import make_url
+
+from influxdb2_dbapi import db
+from influxdb2_dbapi.exceptions import OperationalError
+from influxdb2_dbapi.influxdb2_sqlalchemy import Influxdb2Dialect
+from influxdb2_dbapi.prefetch import Prefetcher
+
+
+QUERY = 'from(bucket: "b") |> range(start: -1h)'
+
+DATA = flux_csv(['a', 'b'], points=5)
+
+
+def serve_slowly(cursor, delay, data=DATA):
+    """Answer queries with `data` in small chunks, `delay` seconds apart."""
+    cursor._post_query = lambda query: FakeResponse(data, delay, chunk_size=64)
+
+
+class PrefetcherTestSuite(unittest.TestCase):
+
+    def test_reads_ahead_up_to_depth(self):
+        produced = []
+
+        def rows():
+            for i in range(100):
+                produced.append(i)
+                yield i
+
+        prefetcher = Prefetcher(rows(), depth=2, chunk_rows=1)
+        prefetcher.wait()
+        # two chunks queued, and one waiting for room
+        wait_for(lambda: len(produced) == 4)
+        time.sleep(0.05)
+        self.assertEqual(len(produced), 4)
+        self.assertEqual(list(prefetcher), list(range(100)))
+
+    def test_chunks_grow(self):
+        prefetcher = Prefetcher(iter(range(10)), depth=10, chunk_rows=4)
+        sizes = []
+        while not prefetcher._done:
+            chunk, _ = prefetcher._queue.get()
+            sizes.append(len(chunk) if chunk is not None else None)
+            prefetcher._done = chunk is None
+        self.assertEqual(sizes, [1, 2, 4, 3, None])
+
+    def test_errors_are_raised_in_turn(self):
+        def rows():
+            yield 1
+            raise ValueError('bad row')
+
+        prefetcher = Prefetcher(rows(), depth=1)
+        self.assertEqual(next(prefetcher), 1)
+        with self.assertRaises(ValueError):
+            next(prefetcher)
+
+    def test_close_stops_reading(self):
+        closed = []
+
+        def rows():
+            try:
+                for i in range(10 ** 6):
+                    yield i
+            finally:
+                closed.append(True)
+
+        prefetcher = Prefetcher(rows(), depth=1, chunk_rows=1)
+        prefetcher.wait()
+        prefetcher.close()
+        prefetcher._thread.join(1)
+        self.assertFalse(prefetcher._thread.is_alive())
+        self.assertEqual(closed, [True])
+        self.assertEqual(list(prefetcher), [])
+
+
+class PrefetchCursorTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.connection = influxdb2_dbapi.connect(org='org', token='token', prefetch=4)
+
+    def test_rows_and_description(self):
+        cursor = self.connection.cursor()
+        serve(cursor, DATA)
+        cursor.execute(QUERY)
+        self.assertIsInstance(cursor._results, Prefetcher)
+        self.assertEqual(cursor.description[0][0], 'result')
+        self.assertEqual(len(cursor.fetchall()), 10)
+        cursor.execute(f'SELECT host, value FROM ({QUERY}) WHERE value > 2')
+        self.assertEqual(len(cursor.fetchall()), 4)
+        cursor.execute(QUERY, prefetch=0)
+        self.assertNotIsInstance(cursor._results, Prefetcher)
+
+    def test_reading_overlaps_consuming(self):
+        def consume(cursor):
+            for _ in cursor:
+                time.sleep(0.03)
+
+        # shared queries are already read by a thread of their own
+        connection = influxdb2_dbapi.connect(org='org', token='token', single_flight=False)
+        elapsed = {}
+        for depth in [0, 4]:
+            cursor = connection.cursor()
+            serve_slowly(cursor, 0.02)
+            start = time.perf_counter()
+            cursor.execute(QUERY, time_format='epoch_ns', prefetch=depth)
+            consume(cursor)
+            elapsed[depth] = time.perf_counter() - start
+        # about 0.36s reading chunks and 0.3s consuming rows, with or without
+        # overlap
+        self.assertLess(elapsed[4], elapsed[0] - 0.15)
+
+    def test_cancel(self):
+        cursor = self.connection.cursor()
+        serve_slowly(cursor, 0.05)
+        cursor.execute(QUERY)
+        cursor.cancel()
+        with self.assertRaises(OperationalError):
+            cursor.fetchall()
+
+    def test_close_stops_the_thread(self):
+        cursor = self.connection.cursor()
+        serve(cursor, flux_csv(['a'] * 200, points=20))
+        cursor.execute(QUERY)
+        prefetcher = cursor._results
+        cursor.close()
+        prefetcher._thread.join(1)
+        self.assertFalse(prefetcher._thread.is_alive())
+
+    def test_execute_stops_the_previous_thread(self):
+        cursor = self.connection.cursor()
+        serve_slowly(cursor, 0.05)
+        cursor.execute(QUERY)
+        prefetcher = cursor._results
+        serve(cursor, flux_csv(['a'], points=3, measurement='mem'))
+        cursor.execute(QUERY)
+        self.assertFalse(prefetcher._thread.is_alive())
+        rows = cursor.fetchall()
+        self.assertEqual([row.measurement for row in rows], ['mem'] * 3)
+
+        # the deadline of a query is its own, not ended by the one before
+        serve_slowly(cursor, 0.05)
+        cursor.execute(QUERY)
+        with self.assertRaisesRegex(OperationalError, 'timeout'):
+            cursor.execute(QUERY, timeout=0.3).fetchall()
+
+    def test_flux_is_not_split_as_sql(self):
+        cursor = self.connection.cursor()
+        with mock.patch.object(db.sqlparse, 'split', wraps=db.sqlparse.split) as split:
+            self.assertIsNone(cursor._split_query(QUERY))
+            self.assertEqual(split.call_count, 0)
+            self.assertIsNotNone(cursor._split_query(f'SELECT * FROM ({QUERY})'))
+            self.assertEqual(split.call_count, 1)
+
+    def test_url(self):
+        _, kwargs = Influxdb2Dialect().create_connect_args(make_url(
+            'influxdb2://influx/?org=o&token=t&prefetch=8'))
+        self.assertEqual(kwargs['prefetch'], 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
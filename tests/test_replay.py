@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+from .context import influxdb2_dbapi
+from .fixtures import FakeResponse, flux_csv
+
+import json
+import os
+import tempfile
+import time
+import unittest
+
+from sqlalchemy.engine.url import make_url
+
+from influxdb2_dbapi import replay
+from influxdb2_dbapi.console import get_connection_kwargs
+from influxdb2_dbapi.exceptions import OperationalError
+from influxdb2_dbapi.influxdb2_sqlalchemy import Influxdb2Dialect
+
+
+QUERY = 'from(bucket: "b") |> range(start: -1h)'
+
+DATA = flux_csv(['a', 'b'], points=5)
+
+
+class ReplayTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def record(self, query=QUERY, data=DATA):
+        connection = influxdb2_dbapi.connect(
+            org='org', token='token', single_flight=False, record=self.directory)
+        connection.hosts.post = lambda send, retry=True: FakeResponse(data)
+        rows = connection.cursor().execute(query).fetchall()
+        connection.close()
+        return rows
+
+    def test_record_and_replay(self):
+        recorded = self.record()
+        key = replay.get_key('org', QUERY)
+        self.assertEqual(sorted(os.listdir(self.directory)), [f'{key}.csv', f'{key}.json'])
+        with open(os.path.join(self.directory, f'{key}.json')) as file:
+            metadata = json.load(file)
+        self.assertEqual(metadata['query'], QUERY)
+        self.assertEqual(metadata['bytes'], len(DATA))
+        self.assertGreaterEqual(metadata['seconds'], metadata['first_byte_seconds'])
+
+        connection = influxdb2_dbapi.connect(org='org', token='token', replay=self.directory)
+        cursor = connection.cursor()
+        # layout does not matter
+        self.assertEqual(cursor.execute(QUERY.replace(' |> ', '\n  |> ')).fetchall(), recorded)
+        cursor.execute(f'SELECT host, SUM(value) AS total FROM ({QUERY}) GROUP BY host')
+        self.assertEqual([tuple(row) for row in cursor.fetchall()], [('a', 10.0), ('b', 10.0)])
+
+        with self.assertRaises(OperationalError):
+            cursor.execute('from(bucket: "other") |> range(start: -1h)')
+        with self.assertRaises(OperationalError):
+            influxdb2_dbapi.connect(
+                org='other', token='token', replay=self.directory).cursor().execute(QUERY)
+
+    def test_abandoned_responses_are_not_recorded(self):
+        connection = influxdb2_dbapi.connect(
+            org='org', token='token', single_flight=False, record=self.directory)
+        connection.hosts.post = lambda send, retry=True: FakeResponse(DATA)
+        cursor = connection.cursor().execute(QUERY)
+        cursor.fetchone()
+        cursor.close()
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_throttled_replay(self):
+        self.record()
+        key = replay.get_key('org', QUERY)
+        path = os.path.join(self.directory, f'{key}.json')
+        with open(path) as file:
+            metadata = json.load(file)
+        metadata.update(first_byte_seconds=0.1, seconds=0.3)
+        with open(path, 'w') as file:
+            json.dump(metadata, file)
+
+        connection = influxdb2_dbapi.connect(
+            org='org', token='token', replay=self.directory, replay_speed=2)
+        start = time.perf_counter()
+        self.assertEqual(len(connection.cursor().execute(QUERY).fetchall()), 10)
+        self.assertGreaterEqual(time.perf_counter() - start, 0.15)
+
+        # closing stops the delivery
+        response = replay.ReplayedResponse(DATA, rate=len(DATA) / 10)
+        chunks = response.stream(16)
+        next(chunks)
+        response.close()
+        self.assertEqual(list(chunks), [])
+
+    def test_url(self):
+        _, kwargs = Influxdb2Dialect().create_connect_args(make_url(
+            'influxdb2://influx/?org=o&token=t&replay=/tmp/r&replay_speed=0.5'))
+        self.assertEqual((kwargs['replay'], kwargs['replay_speed']), ('/tmp/r', 0.5))
+        kwargs = get_connection_kwargs('http://influx:8086/?org=o&record=/tmp/r')
+        self.assertEqual(kwargs['record'], '/tmp/r')
+
+
+if __name__ == '__main__':
+    unittest.main()
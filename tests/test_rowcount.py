@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+from .context import influxdb2_dbapi
+from .fixtures import FakeResponse, count_csv, flux_csv, serve
+
+import unittest
+
+import numpy as np
+from sqlalchemy.engine.url import make_url
+
+from influxdb2_dbapi import flux
+from influxdb2_dbapi.influxdb2_sqlalchemy import Influxdb2Dialect
+
+
+QUERY = 'from(bucket: "b") |> range(start: -1h)'
+
+DATA = flux_csv(['a', 'b'], points=3)
+
+ERROR = (
+    '#datatype,string,string\r\n'
+    '#group,true,true\r\n'
+    '#default,,\r\n'
+    ',error,reference\r\n'
+    ',no column _value exists,\r\n'
+).encode('utf-8')
+
+
+def count_like_influxdb(query, data):
+    """
+    Answer the `count_query` of a query returning `data` like InfluxDB, whose
+    `count()` skips null `_value`s, unless a `map()` set them on every row.
+    """
+    values = flux.read_columns(flux.iter_csv(FakeResponse(data)))['value']
+    if 'r with _value: 1' not in query:
+        values = values[~np.isnan(values)]
+    return count_csv(len(values))
+
+
+class RowcountTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.connection = influxdb2_dbapi.connect(
+            org='org', token='token', rowcount_query=True, single_flight=False)
+        self.cursor = self.connection.cursor()
+        self.sent = []
+
+    def serve(self, count=count_csv(6)):
+        def respond(query):
+            self.sent.append(query)
+            return count if '|> count()' in query else DATA
+        return serve(self.cursor, respond)
+
+    def test_flux_rows_are_counted_on_the_server(self):
+        responses = self.serve()
+        self.cursor.execute(QUERY)
+        self.assertEqual(self.cursor.rowcount, 6)
+        self.assertIn('|> count()', self.sent[-1])
+        # the results are still streamed
+        self.assertFalse(responses[0].closed)
+        self.assertEqual(len(self.cursor.fetchall()), 6)
+        # and the count is not sent again
+        self.assertEqual(self.cursor.rowcount, 6)
+        self.assertEqual(len(self.sent), 2)
+
+    def test_rows_without_values_are_counted(self):
+        data = flux_csv(['a', 'b'], points=3, nulls=1)
+        serve(self.cursor, lambda query: (
+            count_like_influxdb(query, data) if '|> count()' in query else data))
+        self.cursor.execute(QUERY)
+        self.assertEqual(self.cursor.rowcount, 6)
+        self.assertEqual(len(self.cursor.fetchall()), 6)
+
+    def test_count_failure_falls_back_to_fetching(self):
+        self.serve(count=ERROR)
+        self.cursor.execute(QUERY)
+        self.assertEqual(self.cursor.rowcount, 6)
+        self.assertEqual(len(self.cursor.fetchall()), 6)
+
+    def test_sql_rows_are_counted_locally(self):
+        self.serve()
+        # UPPER is not vectorized, so this runs on SQLite
+        self.cursor.execute(f"SELECT UPPER(host) FROM ({QUERY}) WHERE value > 0;")
+        self.assertEqual(self.cursor.rowcount, 4)
+        self.assertEqual(len(self.cursor.fetchall()), 4)
+
+        self.cursor.execute(f'SELECT host FROM ({QUERY}) WHERE value > 0')
+        self.assertEqual(self.cursor.stats['executor'], 'vectorized')
+        self.assertEqual(self.cursor.rowcount, 4)
+        self.assertEqual(len(self.sent), 2)
+
+    def test_rowcount_query_is_optional(self):
+        self.serve()
+        self.cursor.execute(QUERY, rowcount_query=False)
+        self.assertEqual(self.cursor.rowcount, 6)
+        self.assertEqual(len(self.sent), 1)
+
+    def test_url(self):
+        _, kwargs = Influxdb2Dialect().create_connect_args(make_url(
+            'influxdb2://influx:8086/?org=o&token=t&rowcount_query=yes'))
+        self.assertTrue(kwargs['rowcount_query'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+from .context import influxdb2_dbapi
+from .fixtures import flux_csv, serve
+
+import datetime
+import unittest
+
+import numpy as np
+
+from influxdb2_dbapi import flux
+from influxdb2_dbapi.exceptions import NotSupportedError
+
+
+QUERY = 'from(bucket: "b") |> range(start: -1h)'
+
+UTC = datetime.timezone.utc
+
+
+class FetchSeriesTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.connection = influxdb2_dbapi.connect(org='org', token='token')
+
+    def test_one_series_per_table(self):
+        cursor = self.connection.cursor()
+        serve(cursor, flux_csv(['a', 'b'], points=4))
+        series = list(cursor.fetch_series(QUERY))
+        self.assertEqual(len(series), 2)
+        first = series[0]
+        self.assertEqual(first.tags, {
+            'start': datetime.datetime(2023, 1, 1, tzinfo=UTC),
+            'stop': datetime.datetime(2023, 1, 2, tzinfo=UTC),
+            'field': 'usage',
+            'measurement': 'cpu',
+            'host': 'a',
+        })
+        self.assertEqual(first.times.dtype, np.dtype('datetime64[ns]'))
+        self.assertEqual(str(first.times[1]), '2023-01-01T00:00:01.000000000')
+        self.assertEqual(list(first.columns), ['value'])
+        self.assertEqual(first.columns['value'].tolist(), [0.0, 1.0, 2.0, 3.0])
+        self.assertEqual(series[1].tags['host'], 'b')
+
+    def test_epoch_ns(self):
+        cursor = self.connection.cursor()
+        serve(cursor, flux_csv(['a']))
+        series, = cursor.fetch_series(QUERY, time_format='epoch_ns')
+        self.assertEqual(series.times.tolist(), [
+            1672531200 * 10 ** 9 + i * 10 ** 9 for i in range(3)])
+        self.assertEqual(series.tags['start'], 1672531200 * 10 ** 9)
+
+    def test_tables_sharing_numbers(self):
+        # the tables of several results are numbered from 0 in each one
+        columns = [
+            flux.FluxColumn('result', 'string', False, ''),
+            flux.FluxColumn('table', 'long', False, ''),
+            flux.FluxColumn('_value', 'long', False, ''),
+        ]
+        rows = [
+            (columns, cells)
+            for cells in [['r1', '0', '1'], ['r1', '0', '2'], ['r2', '0', '3']]
+        ]
+        series = list(flux.iter_series(rows))
+        self.assertEqual([s.columns['value'].tolist() for s in series], [[1, 2], [3]])
+        self.assertIsNone(series[0].times)
+
+    def test_sql_is_not_supported(self):
+        cursor = self.connection.cursor()
+        with self.assertRaises(NotSupportedError):
+            cursor.fetch_series(f'SELECT * FROM ({QUERY})')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+from .context import influxdb2_dbapi
+from .fixtures import flux_csv, serve, serve_connection
+
+import unittest
+import warnings
+from unittest import mock
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.dialects import registry
+from sqlalchemy.orm import Session
+
+from influxdb2_dbapi import vectorized
+
+from .test_compiler import Cpu
+
+
+registry.register('influxdb2', 'influxdb2_dbapi.influxdb2_sqlalchemy', 'Influxdb2HTTPDialect')
+
+QUERY = 'from(bucket: "b") |> range(start: -1h)'
+
+DATA = flux_csv(['a', 'b'], points=5)
+
+
+class ServerSideCursorTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.connection = influxdb2_dbapi.connect(org='org', token='token')
+
+    def test_rows_are_converted_as_fetched(self):
+        cursor = self.connection.cursor(server_side=True)
+        serve(cursor, DATA)
+        to_rows = mock.Mock(wraps=vectorized.to_rows)
+        with mock.patch.object(vectorized, 'ROWS_PER_BATCH', 3), \
+                mock.patch.object(vectorized, 'to_rows', to_rows):
+            cursor.execute(f'SELECT host, value FROM ({QUERY}) WHERE value >= 1')
+            self.assertEqual(cursor.stats['executor'], 'vectorized')
+            self.assertEqual(len(cursor.fetchmany(2)), 2)
+            self.assertEqual(to_rows.call_count, 1)
+            self.assertEqual(len(cursor.fetchall()), 6)
+        self.assertEqual(to_rows.call_count, 3)
+        self.assertTrue(all(len(call.args[0][0]) <= 3 for call in to_rows.call_args_list))
+
+    def test_rowcount_does_not_fetch(self):
+        cursor = self.connection.cursor(server_side=True)
+        serve(cursor, DATA)
+        cursor.execute(QUERY)
+        self.assertEqual(cursor.rowcount, -1)
+        self.assertEqual(len(cursor.fetchall()), 10)
+
+        cursor = self.connection.cursor()
+        serve(cursor, DATA)
+        cursor.execute(QUERY)
+        self.assertEqual(cursor.rowcount, 10)
+
+
+class StreamResultsTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.cursors = []
+        self.engine = create_engine('influxdb2://influx:8086/?org=o&token=t')
+
+        @event.listens_for(self.engine, 'connect')
+        def connect(dbapi_connection, connection_record):
+            serve_connection(dbapi_connection, DATA)
+
+        @event.listens_for(self.engine, 'before_cursor_execute')
+        def before_cursor_execute(connection, cursor, *args):
+            self.cursors.append(cursor)
+
+    def test_stream_results(self):
+        with self.engine.connect() as connection:
+            result = connection.execution_options(stream_results=True).execute(text(QUERY))
+            rows = [row for partition in result.partitions(4) for row in partition]
+            self.assertEqual(len(rows), 10)
+            result = connection.execute(text(QUERY))
+            self.assertEqual(len(result.fetchall()), 10)
+        self.assertEqual([cursor.server_side for cursor in self.cursors], [True, False])
+
+    def test_yield_per(self):
+        with warnings.catch_warnings():
+            # the dialect does not cache statements
+            warnings.simplefilter('ignore')
+            with Session(self.engine) as session:
+                points = list(session.query(Cpu).yield_per(3))
+        self.assertEqual(len(points), 10)
+        self.assertTrue(self.cursors[0].server_side)
+
+
+if __name__ == '__main__':
+    unittest.main()
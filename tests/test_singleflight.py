@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+
+from .context import influxdb2_dbapi
+from .fixtures import flux_csv, serve, wait_for
+
+import threading
+import unittest
+from unittest import mock
+
+from influxdb2_dbapi import flux, singleflight
+from influxdb2_dbapi.exceptions import OperationalError
+
+
+QUERY = 'from(bucket: "b") |> range(start: -1h)'
+
+DATA = flux_csv(['a', 'b'], points=100)
+
+
+class SingleFlightTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.sent = []
+        self.release = threading.Event()
+        self.responses = []
+
+    def respond(self, query):
+        self.sent.append(query)
+        self.release.wait(5)
+        return DATA
+
+    def cursor(self, **kwargs):
+        kwargs.setdefault('org', 'org')
+        kwargs.setdefault('single_flight', True)
+        cursor = influxdb2_dbapi.connect(token='token', **kwargs).cursor()
+        serve(cursor, self.respond, responses=self.responses)
+        return cursor
+
+    def subscribers(self):
+        flights = list(singleflight._flights.values())
+        return len(flights[0].positions) if flights else 0
+
+    def start(self, cursor, query=QUERY, rows=None):
+        results = []
+
+        def run():
+            try:
+                cursor.execute(query)
+                results.extend(cursor.fetchall() if rows is None else cursor.fetchmany(rows))
+            except Exception as e:
+                results.append(e)
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        return thread, results
+
+    def test_normalize(self):
+        self.assertEqual(
+            flux.normalize('from(bucket: "b")\n  |>  filter(fn: (r) => r.host == "a  b")  '),
+            'from(bucket: "b") |> filter(fn: (r) => r.host == "a  b")')
+
+    def test_concurrent_queries_share_a_request(self):
+        leader, follower = self.cursor(), self.cursor()
+        thread, leader_rows = self.start(leader)
+        wait_for(lambda: self.sent)
+        # the same query, laid out differently, through another connection
+        other, follower_rows = self.start(follower, QUERY.replace(' |> ', '\n  |> '))
+        wait_for(lambda: self.subscribers() == 2)
+        self.release.set()
+        thread.join()
+        other.join()
+
+        self.assertEqual(len(self.sent), 1)
+        self.assertEqual(len(leader_rows), 200)
+        self.assertEqual(leader_rows, follower_rows)
+        self.assertEqual(follower.stats['shared'], 1)
+        self.assertNotIn('shared', leader.stats)
+        self.assertEqual(singleflight._flights, {})
+
+    def test_independent_iteration(self):
+        leader, follower = self.cursor(), self.cursor()
+        thread, leader_rows = self.start(leader, rows=1)
+        wait_for(lambda: self.sent)
+        other, follower_rows = self.start(follower)
+        wait_for(lambda: self.subscribers() == 2)
+        self.release.set()
+        thread.join()
+        leader.close()
+        other.join()
+
+        self.assertEqual(len(leader_rows), 1)
+        self.assertEqual(len(follower_rows), 200)
+        self.assertTrue(self.responses[0].closed)
+
+    def test_request_aborted_when_every_cursor_leaves(self):
+        cursor = self.cursor()
+        thread, results = self.start(cursor, rows=1)
+        wait_for(lambda: self.sent)
+        cursor.cancel()
+        self.release.set()
+        thread.join()
+        self.assertIsInstance(results[0], OperationalError)
+        wait_for(lambda: not singleflight._flights)
+        self.assertTrue(self.responses[0].closed)
+
+    def test_opt_in(self):
+        self.assertFalse(influxdb2_dbapi.connect(org='org', token='token').single_flight)
+
+    def test_queries_not_shared(self):
+        for kwargs in [{'org': 'other'}, {'single_flight': False}]:
+            with self.subTest(**kwargs):
+                self.sent = []
+                self.release.clear()
+                thread, _ = self.start(self.cursor())
+                wait_for(lambda: self.sent)
+                other, _ = self.start(self.cursor(**kwargs))
+                wait_for(lambda: len(self.sent) == 2)
+                self.release.set()
+                thread.join()
+                other.join()
+
+    def test_large_responses_stream_in_bounded_memory(self):
+        sizes = []
+        append = singleflight.Flight._append
+
+        def recording_append(flight, chunk):
+            sizes.append(flight.size)
+            return append(flight, chunk)
+
+        with mock.patch.object(singleflight, 'MAX_BUFFER', 1000), \
+                mock.patch.object(flux, 'CHUNK_SIZE', 100), \
+                mock.patch.object(singleflight.Flight, '_append', recording_append):
+            leader, follower = self.cursor(), self.cursor()
+            thread, leader_rows = self.start(leader)
+            wait_for(lambda: self.sent)
+            other, follower_rows = self.start(follower)
+            wait_for(lambda: self.subscribers() == 2)
+            self.release.set()
+            thread.join()
+            other.join()
+
+        self.assertEqual(len(self.sent), 1)
+        self.assertEqual(len(leader_rows), 200)
+        self.assertEqual(leader_rows, follower_rows)
+        self.assertGreater(len(DATA), 10000)
+        self.assertLessEqual(max(sizes), 1100)
+
+    def test_lagging_cursor_does_not_block_others(self):
+        with mock.patch.object(singleflight, 'MAX_BUFFER', 1000), \
+                mock.patch.object(flux, 'CHUNK_SIZE', 100):
+            lagging, other = self.cursor(), self.cursor()
+            thread, lagging_rows = self.start(lagging, rows=1)
+            wait_for(lambda: self.sent)
+            flight = singleflight._flights[next(iter(singleflight._flights))]
+            other_thread, other_rows = self.start(other)
+            wait_for(lambda: self.subscribers() == 2)
+            self.release.set()
+            thread.join()
+            # the lagging cursor stops reading after its first row
+            other_thread.join(5)
+            self.assertFalse(other_thread.is_alive())
+
+            self.assertEqual(len(other_rows), 200)
+            self.assertEqual(other.stats['shared'], 1)
+            self.assertGreater(flight.spilled, 0)
+            self.assertLessEqual(flight.size, 1000)
+            self.assertEqual(lagging_rows + lagging.fetchall(), other_rows)
+            lagging.close()
+            other.close()
+            self.assertIsNone(flight.spill)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+from .context import influxdb2_dbapi
+from .fixtures import flux_csv, serve
+
+import os
+import unittest
+from unittest import mock
+
+from sqlalchemy.engine.url import make_url
+
+from influxdb2_dbapi import db
+from influxdb2_dbapi.influxdb2_sqlalchemy import Influxdb2Dialect
+
+
+QUERY = 'from(bucket: "b") |> range(start: -1h)'
+
+# a table with a column that the tables before it lack
+REGIONS = (
+    '#datatype,string,long,dateTime:RFC3339,double,string\r\n'
+    '#group,false,false,false,false,true\r\n'
+    '#default,_result,,,,\r\n'
+    ',result,table,_time,_value,region\r\n'
+    + ''.join(f',,2,2023-01-01T00:00:0{i}Z,{i}.5,eu\r\n' for i in range(5))
+).encode('utf-8')
+
+DATA = flux_csv(['a', 'b'], points=30) + b'\r\n' + REGIONS
+
+SQL = f'SELECT host, region, UPPER(host), SUM(value) FROM ({QUERY}) GROUP BY host, region ORDER BY host'
+
+
+class SpillTestSuite(unittest.TestCase):
+
+    def execute(self, sql=SQL, **kwargs):
+        connection = influxdb2_dbapi.connect(org='org', token='token', **kwargs)
+        cursor = connection.cursor()
+        serve(cursor, DATA)
+        rows = [tuple(row) for row in cursor.execute(sql).fetchall()]
+        return cursor, rows
+
+    def test_results_are_the_same_on_disk(self):
+        _, expected = self.execute()
+        with mock.patch.object(db, 'BATCH_ROWS', 7):
+            cursor, rows = self.execute(memory_budget=1000)
+        self.assertEqual(rows, expected)
+        self.assertEqual(cursor.stats['executor'], 'sqlite')
+        self.assertGreater(cursor.stats['spill_bytes'], 0)
+        self.assertGreater(cursor.stats['model_bytes'], 1000)
+        self.assertGreater(cursor.stats['peak_rss'], 0)
+
+    def test_no_spill_within_budget(self):
+        cursor, _ = self.execute(memory_budget=10 ** 9)
+        self.assertEqual(cursor.stats['spill_bytes'], 0)
+
+    def test_vectorized_fallback_spills(self):
+        # the vectorized executor can't sum strings, so this runs on SQLite
+        sql = f'SELECT SUM(host) FROM ({QUERY})'
+        _, expected = self.execute(sql)
+        cursor, rows = self.execute(sql, memory_budget=1)
+        self.assertEqual(rows, expected)
+        self.assertGreater(cursor.stats['spill_bytes'], 0)
+
+    def test_vectorized_queries_keep_to_the_budget(self):
+        sql = f'SELECT host, SUM(value) FROM ({QUERY}) GROUP BY host ORDER BY host'
+        cursor, expected = self.execute(sql, memory_budget=10 ** 9)
+        self.assertEqual(cursor.stats['executor'], 'vectorized')
+        self.assertEqual(cursor.stats['spill_bytes'], 0)
+        self.assertGreater(cursor.stats['model_bytes'], 0)
+        self.assertGreater(cursor.stats['peak_rss'], 0)
+
+        # over the budget, the results read so far and the rest go to SQLite
+        with mock.patch.object(db, 'BATCH_ROWS', 7):
+            cursor, rows = self.execute(sql, memory_budget=1000)
+        self.assertEqual(rows, expected)
+        self.assertEqual(cursor.stats['executor'], 'sqlite')
+        self.assertGreater(cursor.stats['spill_bytes'], 0)
+        self.assertGreater(cursor.stats['model_bytes'], 1000)
+
+    def test_spill_file_is_removed(self):
+        connection = influxdb2_dbapi.connect(org='org', token='token', memory_budget=1)
+        cursor = connection.cursor()
+        serve(cursor, DATA)
+        cursor.execute(SQL).fetchmany(1)
+        path = cursor._model.path
+        self.assertTrue(os.path.exists(path))
+        cursor.close()
+        self.assertFalse(os.path.exists(path))
+
+    def test_url(self):
+        _, kwargs = Influxdb2Dialect().create_connect_args(make_url(
+            'influxdb2://influx:8086/?org=o&token=t&memory_budget=1000000'))
+        self.assertEqual(kwargs['memory_budget'], 1000000)
+
+
+if __name__ == '__main__':
+    unittest.main()
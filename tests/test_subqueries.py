@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+from .context import influxdb2_dbapi
+from .fixtures import FakeResponse, count_csv, flux_csv, serve
+
+import time
+import unittest
+
+from influxdb2_dbapi.exceptions import OperationalError, ProgrammingError
+
+
+CPU = '''from(bucket: "b")
+  |> range(start: -1h)
+  |> filter(fn: (r) => r._measurement == "cpu")'''
+
+MEM = 'from(bucket: "b") |> range(start: -1h) |> filter(fn: (r) => r._measurement == "mem")'
+
+JOIN = f'''SELECT cpu.host, cpu.value AS cpu, mem.value AS mem
+FROM ({CPU}) AS cpu
+JOIN ({MEM}) AS mem ON cpu.host = mem.host AND cpu.time = mem.time
+WHERE mem.value > 0
+ORDER BY cpu.host, cpu.time'''
+
+ERROR = (
+    '#datatype,string,string\r\n'
+    '#group,true,true\r\n'
+    '#default,,\r\n'
+    ',error,reference\r\n'
+    ',unknown bucket,897\r\n'
+).encode('utf-8')
+
+
+def respond(query):
+    if '|> count()' in query:
+        return count_csv(4)
+    if '"mem"' in query:
+        return flux_csv(['a', 'b'], points=2, measurement='mem')
+    return flux_csv(['a', 'b', 'c'], points=2)
+
+
+class SubqueriesTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.cursor = influxdb2_dbapi.connect(org='org', token='token').cursor()
+
+    def test_split_query(self):
+        subqueries, sql = self.cursor._split_query(JOIN)
+        self.assertEqual(subqueries, [('Model', CPU), ('Model1', MEM)])
+        self.assertIn('FROM (SELECT * FROM Model) AS cpu', sql)
+        self.assertIn('JOIN (SELECT * FROM Model1) AS mem ON', sql)
+
+    def test_plain_flux_is_not_split(self):
+        query = (
+            'join(tables: {cpu: from(bucket: "b") |> range(start: -1h), '
+            'mem: from(bucket: "c") |> range(start: -1h)}, on: ["_time"])')
+        self.assertIsNone(self.cursor._split_query(query))
+
+    def test_parentheses_in_strings(self):
+        query = (
+            'SELECT * FROM (from(bucket: "b)") |> range(start: -1h) '
+            '|> filter(fn: (r) => r.host == "(a")) WHERE host = \'(\'')
+        subqueries, sql = self.cursor._split_query(query)
+        self.assertTrue(subqueries[0][1].endswith('r.host == "(a")'))
+        self.assertEqual(sql, 'SELECT * FROM (SELECT * FROM Model) WHERE host = \'(\'')
+
+    def test_join(self):
+        serve(self.cursor, respond)
+        rows = self.cursor.execute(JOIN).fetchall()
+        self.assertEqual(self.cursor.stats['executor'], 'sqlite')
+        self.assertEqual(
+            [tuple(row) for row in rows], [('a', 1.0, 1.0), ('b', 1.0, 1.0)])
+        self.assertEqual(self.cursor.stats['flux_rows'], 10)
+        self.assertEqual(self.cursor.stats['tables']['Model1']['rows'], 4)
+
+    def test_subqueries_are_fetched_concurrently(self):
+        serve(self.cursor, respond, delay=0.5)
+        start = time.perf_counter()
+        self.cursor.execute(JOIN).fetchall()
+        self.assertLess(time.perf_counter() - start, 0.9)
+
+    def test_deadline_covers_every_subquery(self):
+        def post_query(query):
+            if '"mem"' in query:
+                # about 1s, in small chunks
+                return FakeResponse(respond(query), delay=0.1, chunk_size=64)
+            return FakeResponse(respond(query))
+
+        self.cursor._post_query = post_query
+        start = time.perf_counter()
+        with self.assertRaisesRegex(OperationalError, 'timeout'):
+            self.cursor.execute(JOIN, timeout=0.5)
+        self.assertLess(time.perf_counter() - start, 0.9)
+
+    def test_failed_subquery(self):
+        responses = serve(
+            self.cursor, lambda query: ERROR if '"mem"' in query else respond(query),
+            delay=0.2)
+        with self.assertRaisesRegex(ProgrammingError, 'unknown bucket'):
+            self.cursor.execute(JOIN)
+        self.assertTrue(all(response.closed for response in responses))
+
+    def test_first_failure_is_raised_without_waiting(self):
+        def post_query(query):
+            if '"mem"' in query:
+                return FakeResponse(ERROR)
+            # about 1s, in small chunks
+            return FakeResponse(respond(query), delay=0.1, chunk_size=64)
+
+        self.cursor._post_query = post_query
+        start = time.perf_counter()
+        with self.assertRaisesRegex(ProgrammingError, 'unknown bucket'):
+            self.cursor.execute(JOIN)
+        self.assertLess(time.perf_counter() - start, 0.5)
+
+    def test_explain(self):
+        serve(self.cursor, respond)
+        plan = self.cursor.execute(f'EXPLAIN {JOIN}').fetchall()
+        self.assertEqual(
+            [(stage.stage, stage.query) for stage in plan[:2]],
+            [('flux', CPU), ('flux', MEM)])
+        self.assertEqual(plan[2].engine, 'sqlite')
+        plan = self.cursor.execute(f'EXPLAIN ANALYZE {JOIN}').fetchall()
+        self.assertEqual([stage.rows for stage in plan], [6, 4, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+from .context import influxdb2_dbapi
+from .fixtures import flux_csv, serve
+
+import datetime
+import unittest
+
+import numpy as np
+import pandas as pd
+from sqlalchemy.engine.url import make_url
+
+from influxdb2_dbapi import flux
+from influxdb2_dbapi.db import Type
+from influxdb2_dbapi.exceptions import ProgrammingError
+from influxdb2_dbapi.influxdb2_sqlalchemy import Influxdb2Dialect
+
+
+QUERY = 'from(bucket: "b") |> range(start: -1h)'
+
+# 2023-01-01T00:00:01Z
+TIME = 1672531201 * 10 ** 9
+
+
+class TimeFormatTestSuite(unittest.TestCase):
+
+    def execute(self, query=QUERY, connect_format='datetime', **kwargs):
+        connection = influxdb2_dbapi.connect(
+            org='org', token='token', time_format=connect_format)
+        cursor = connection.cursor()
+        serve(cursor, flux_csv(['a', 'b']))
+        rows = cursor.execute(query, **kwargs).fetchall()
+        return cursor, rows
+
+    def test_parse_rfc3339(self):
+        for text in [
+            '2023-01-01T00:00:00Z',
+            '2023-06-15T13:45:12.123456789Z',
+            '2023-06-15T13:45:12.5Z',
+            '1969-12-31T23:59:59.999Z',
+            '2023-01-01T02:00:00.25+02:00',
+            '2023-01-01T00:00:00-01:30',
+        ]:
+            with self.subTest(text=text):
+                self.assertEqual(flux.parse_rfc3339(text), pd.Timestamp(text).value)
+
+    def test_flux_results(self):
+        _, expected = self.execute()
+        self.assertEqual(
+            expected[1].time,
+            datetime.datetime(2023, 1, 1, 0, 0, 1, tzinfo=datetime.timezone.utc))
+
+        _, rows = self.execute(time_format='epoch_ns')
+        self.assertEqual(rows[1].time, TIME)
+        self.assertIsInstance(rows[1].start, int)
+
+        _, rows = self.execute(connect_format='datetime64')
+        self.assertEqual(rows[1].time, np.datetime64(TIME, 'ns'))
+
+        # other values are the same as what `influxdb_client` returns
+        self.assertEqual(
+            [row._replace(start=None, stop=None, time=None) for row in expected],
+            [row._replace(start=None, stop=None, time=None) for row in rows])
+
+    def test_vectorized_results(self):
+        query = f'SELECT host, time FROM ({QUERY}) WHERE value = 1 ORDER BY host'
+        cursor, rows = self.execute(query, connect_format='epoch_ns')
+        self.assertEqual(cursor.stats['executor'], 'vectorized')
+        self.assertEqual(rows, [('a', TIME), ('b', TIME)])
+        self.assertEqual(cursor.description[1][1], Type.NUMBER)
+
+        _, rows = self.execute(query, time_format='datetime64')
+        self.assertEqual(rows[0].time, np.datetime64(TIME, 'ns'))
+
+    def test_unknown_format(self):
+        with self.assertRaises(ProgrammingError):
+            influxdb2_dbapi.connect(org='org', token='token', time_format='iso')
+        with self.assertRaises(ProgrammingError):
+            self.execute(time_format='iso')
+
+    def test_url(self):
+        _, kwargs = Influxdb2Dialect().create_connect_args(make_url(
+            'influxdb2://influx:8086/?org=o&token=t&time_format=epoch_ns'))
+        self.assertEqual(kwargs['time_format'], 'epoch_ns')
+
+
+if __name__ == '__main__':
+    unittest.main()
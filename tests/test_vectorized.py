@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+from .context import influxdb2_dbapi
+from .fixtures import flux_csv, serve
+
+import itertools
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from influxdb2_dbapi import vectorized
+
+
+FLUX = '''from(bucket: "b")
+  |> range(start: -1h)
+'''
+
+QUERIES = [
+    'SELECT host, AVG(value) AS avg FROM ({}) AS "virtual_table" GROUP BY host',
+    'SELECT host, value FROM ({}) WHERE value >= 2 AND host != \'b\'',
+    'SELECT host AS h, SUM(value), COUNT(*), MIN(value), MAX(value) '
+    'FROM ({}) AS "virtual_table" GROUP BY host ORDER BY "SUM(value)" DESC, h',
+    'SELECT COUNT(*) AS count FROM ({}) WHERE host IN (\'a\', \'c\')',
+    'SELECT host, value FROM ({}) ORDER BY value DESC, host LIMIT 4',
+    'SELECT host, value FROM ({}) ORDER BY 2, 1 LIMIT 3 OFFSET 2',
+    'SELECT COUNT(DISTINCT host), AVG(value) FROM ({}) '
+    'WHERE time > \'2023-01-01 00:00:01.000000\' AND value BETWEEN 1 AND 3',
+    'SELECT field, measurement, MAX(host) FROM ({}) GROUP BY field, measurement',
+    'SELECT SUM(value) AS total FROM ({}) WHERE host = \'nobody\'',
+    'SELECT host FROM ({}) GROUP BY host ORDER BY host DESC LIMIT 2',
+    'SELECT host, time, value FROM ({}) WHERE time >= \'2023-01-01T00:00:02Z\'',
+    'SELECT time, value FROM ({}) WHERE time < \'2023-01-01 00:00:02\' AND host = \'a\' '
+    'ORDER BY time DESC',
+    'SELECT host, MIN(time), MAX(time) FROM ({}) WHERE time <= \'2023-01-01\' GROUP BY host',
+    'SELECT host, value FROM ({}) WHERE time > \'2023-01-01T01:00:01+01:00\'',
+]
+
+
+# a string tag holding dates
+DAYS = (
+    '#datatype,string,long,dateTime:RFC3339,double,string\r\n'
+    '#group,false,false,false,false,true\r\n'
+    '#default,_result,,,,\r\n'
+    ',result,table,_time,_value,day\r\n'
+    + ''.join(
+        f',,{i},2023-01-01T00:00:0{i}Z,{i}.5,2023-01-0{i + 1}\r\n' for i in range(3))
+).encode('utf-8')
+
+
+class VectorizedTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.connection = influxdb2_dbapi.connect(org='org', token='token')
+
+    def run_query(self, query, time_format=None, data=None):
+        cursor = self.connection.cursor()
+        serve(cursor, data or flux_csv(['a', 'b', 'c'], points=4))
+        rows = cursor.execute(query.format(FLUX), time_format=time_format).fetchall()
+        names = [column[0] for column in cursor.description]
+        return cursor.stats['executor'], names, [tuple(row) for row in rows]
+
+    def test_same_results_as_sqlite(self):
+        for query, time_format in itertools.product(
+                QUERIES, ['datetime', 'epoch_ns', 'datetime64']):
+            if time_format != 'datetime' and 'time' not in query:
+                continue
+            with self.subTest(query=query, time_format=time_format):
+                executor, names, rows = self.run_query(query, time_format)
+                self.assertEqual(executor, 'vectorized')
+                with mock.patch.object(vectorized, 'parse', return_value=None):
+                    executor, sqlite_names, sqlite_rows = self.run_query(query, time_format)
+                self.assertEqual(executor, 'sqlite')
+                self.assertEqual(names, sqlite_names)
+                if 'ORDER BY' not in query:
+                    # SQLite may scan an index instead of the table
+                    rows, sqlite_rows = sorted(rows), sorted(sqlite_rows)
+                self.assertEqual(rows, sqlite_rows)
+                self.assertTrue(rows or 'nobody' in query)
+
+    def test_dates_in_strings_compare_as_strings(self):
+        query = (
+            "SELECT day, value FROM ({}) "
+            "WHERE day = '2023-01-01' OR time >= '2023-01-01T00:00:02Z'")
+        _, _, sqlite_rows = self.run_query(query, data=DAYS)
+        self.assertEqual(sorted(sqlite_rows), [('2023-01-01', 0.5), ('2023-01-03', 2.5)])
+        query = "SELECT day, value FROM ({}) WHERE day = '2023-01-01'"
+        executor, _, rows = self.run_query(query, data=DAYS)
+        self.assertEqual(executor, 'vectorized')
+        with mock.patch.object(vectorized, 'parse', return_value=None):
+            _, _, sqlite_rows = self.run_query(query, data=DAYS)
+        self.assertEqual(rows, sqlite_rows)
+        self.assertEqual(rows, [('2023-01-01', 0.5)])
+
+    def test_unsupported_sql_falls_back(self):
+        for query in [
+            'SELECT UPPER(host) FROM ({})',
+            'SELECT host FROM ({}) WHERE value > 1 OR host = \'a\'',
+            'SELECT DISTINCT host FROM ({})',
+            'SELECT host, COUNT(*) FROM ({}) GROUP BY host HAVING COUNT(*) > 1',
+        ]:
+            with self.subTest(query=query):
+                self.assertIsNone(vectorized.parse(query.format('SELECT * FROM Model')))
+                executor, _, rows = self.run_query(query)
+                self.assertEqual(executor, 'sqlite')
+                self.assertTrue(rows)
+
+    def test_unsupported_data_falls_back(self):
+        # SQLite sums strings as numbers
+        executor, _, rows = self.run_query('SELECT SUM(host) FROM ({})')
+        self.assertEqual(executor, 'sqlite')
+        self.assertEqual(rows, [(0.0,)])
+
+    def test_top_n_keeps_precision(self):
+        times = np.array(
+            ['2023-01-01T00:00:00.000000001', '2023-01-01T00:00:00.000000003',
+             '2023-01-01T00:00:00.000000002', '2023-01-01T00:00:00.000000003'],
+            dtype='datetime64[ns]')
+        integers = np.array([2 ** 62, 2 ** 62 + 1, 5, 2 ** 62 + 1, 2 ** 62 - 1])
+        floats = np.array([0.5, 2.0, 2.0, -1.0, 2.0])
+        for key, top, descending in itertools.product(
+                [times, integers, floats], [1, 2, 3], [False, True]):
+            with self.subTest(key=key, top=top, descending=descending):
+                self.assertEqual(
+                    vectorized.sort_indices([key], [descending], top).tolist(),
+                    vectorized.sort_indices([key], [descending])[:top].tolist())
+        self.assertEqual(vectorized.sort_indices([times], [True], 1).tolist(), [1])
+        self.assertEqual(vectorized.sort_indices([integers], [True], 2).tolist(), [1, 3])
+
+    def test_plan(self):
+        plan = vectorized.parse(
+            'SELECT host, AVG(value) FROM (SELECT * FROM Model) AS t '
+            'WHERE 1 < value GROUP BY host ORDER BY 2 DESC LIMIT 5')
+        self.assertEqual(plan.items[1].name, 'AVG(value)')
+        self.assertEqual(plan.where, [
+            vectorized.Predicate(vectorized.Column('value'), '>', 1)])
+        self.assertEqual(plan.limit, 5)
+
+
+if __name__ == '__main__':
+    unittest.main()